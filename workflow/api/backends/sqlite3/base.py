@@ -0,0 +1,26 @@
+"""
+SQLite backend applying pragmas to every connection, see the production profile of the settings.
+
+Two keys of the database settings are read on top of Django's:
+
+- ``PRAGMAS``: pragmas run on every new connection, e.g. ``{'journal_mode': 'WAL'}``.
+- ``IMMEDIATE_TRANSACTIONS``: open transactions with ``BEGIN IMMEDIATE``, taking the write
+  lock upfront. A deferred transaction that reads then writes can't wait for the lock of
+  another writer: SQLite fails it at once with "database is locked", whatever the busy
+  timeout. An immediate one waits for the lock up to the busy timeout instead.
+"""
+from django.db.backends.sqlite3 import base
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+    def get_new_connection(self, conn_params):
+        conn = super().get_new_connection(conn_params)
+        for name, value in self.settings_dict.get('PRAGMAS', {}).items():
+            conn.execute('PRAGMA %s = %s' % (name, value))
+        return conn
+
+    def _start_transaction_under_autocommit(self):
+        if self.settings_dict.get('IMMEDIATE_TRANSACTIONS'):
+            self.cursor().execute('BEGIN IMMEDIATE')
+        else:
+            super()._start_transaction_under_autocommit()
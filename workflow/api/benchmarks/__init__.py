@@ -0,0 +1,108 @@
+"""
+Benchmarks of the api app.
+
+Every module of this package is a benchmark exposing ``run(stdout, options)``.
+They are run against a scratch database with ``python manage.py benchmark``, a new one
+for each benchmark. A benchmark may return its timings, in seconds by label, to be
+compared with the baselines stored in baselines.json.
+"""
+import json
+import os
+import time
+
+BASELINES = os.path.join(os.path.dirname(__file__), 'baselines.json')
+# Slowdown over the baseline failing the benchmark command, 0.5 being 50% slower: above
+# the run to run noise of a shared machine, below the several-fold slowdown of a lost
+# index or an N+1 query.
+THRESHOLD = 0.5
+
+
+def best_of(func, repeat: int = 3) -> float:
+    """
+    Return the best wall time of several calls of a function.
+
+    Parameters
+    ----------
+    func : callable
+        Function to time, called without arguments
+    repeat : int, optional
+        Number of calls (the default is 3)
+    Returns
+    -------
+    float
+        Best elapsed time in seconds
+    """
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+def write_table(stdout, header: tuple, rows: list):
+    """
+    Write benchmark results as an aligned text table.
+
+    Parameters
+    ----------
+    stdout : OutputWrapper
+        Stream of the management command
+    header : tuple
+        Column titles
+    rows : list
+        Rows of values, one tuple per row
+    """
+    rows = [tuple(str(value) for value in row) for row in rows]
+    widths = [max(len(str(title)), *(len(row[i]) for row in rows)) for i, title in enumerate(header)]
+    stdout.write('  '.join(str(title).rjust(width) for title, width in zip(header, widths)))
+    for row in rows:
+        stdout.write('  '.join(value.rjust(width) for value, width in zip(row, widths)))
+
+
+def load_baselines(path: str) -> dict:
+    """
+    Return the stored baselines, by benchmark: the scale they were measured at and their timings in ms.
+    """
+    try:
+        with open(path) as stream:
+            return json.load(stream)
+    except FileNotFoundError:
+        return {}
+
+
+def save_baselines(path: str, baselines: dict):
+    with open(path, 'w') as stream:
+        json.dump(baselines, stream, indent=2, sort_keys=True)
+        stream.write('\n')
+
+
+def compare(baseline: dict, timings: dict, threshold: float = THRESHOLD):
+    """
+    Compare timings with their baseline.
+
+    Parameters
+    ----------
+    baseline : dict
+        Baseline timings in milliseconds, by label
+    timings : dict
+        Measured timings in seconds, by label
+    threshold : float, optional
+        Relative slowdown counted as a regression (the default is THRESHOLD)
+    Returns
+    -------
+    tuple
+        Table rows (label, baseline ms, ms, change) and the labels of the regressions
+    """
+    rows, regressions = [], []
+    for label, seconds in timings.items():
+        milliseconds, before = seconds * 1000, baseline.get(label)
+        if before is None:
+            rows.append((label, '-', '%.2f' % milliseconds, 'new'))
+            continue
+        change = milliseconds / before - 1 if before else 0
+        if change > threshold:
+            regressions.append(label)
+        rows.append((label, '%.2f' % before, '%.2f' % milliseconds,
+                     '%+.0f%%%s' % (change * 100, ' REGRESSION' if change > threshold else '')))
+    return rows, regressions
@@ -0,0 +1,109 @@
+"""
+Throughput of concurrent clients mixing reads and writes, with the database settings of
+the development and production profiles, then with the writer queue.
+
+Every client sends the same sequence of requests through the whole Django stack: out of
+ten, three workflow lists, three comment lists, two workflow details, a new comment and
+a new workflow. Requests failing with "database is locked" are counted, over all the
+runs, not retried; the other figures are the best of the runs.
+"""
+import logging
+import threading
+import time
+from itertools import cycle, islice
+
+from django.conf import settings
+from django.db import OperationalError, connections
+from django.test import Client
+from django.test.utils import override_settings
+from django.urls import reverse
+
+from api.benchmarks import write_table
+from api.benchmarks.endpoints import workflow_payload
+from api.models import WorkflowSteps
+from api.tests.factories import WorkflowTreeFactory
+from api.utils.cache import get_cache
+from api.utils.writer import close_writer
+
+WORKFLOWS = 1000
+CLIENTS = (1, 4, 16)
+REQUESTS = 200
+
+DURABLE = dict(settings.SQLITE_PRODUCTION, PRAGMAS=dict(settings.SQLITE_PRODUCTION['PRAGMAS'], synchronous='FULL'))
+PROFILES = (
+    ('development', {'PRAGMAS': {'journal_mode': 'DELETE'}, 'IMMEDIATE_TRANSACTIONS': False}, False),
+    ('production', settings.SQLITE_PRODUCTION, False),
+    ('production + writer queue', settings.SQLITE_PRODUCTION, True),
+    # Every commit synced, where group commits pay off.
+    ('synchronous=FULL', DURABLE, False),
+    ('synchronous=FULL + writer queue', DURABLE, True),
+)
+
+
+def requests(workflows: range) -> list:
+    """
+    Return the functions preparing the requests of a client, as (method, url[, data]).
+    """
+    workflow = workflows[len(workflows) // 2]
+    workflow_list = lambda: ('get', reverse('api:WorkflowListPost'))
+    comment_list = lambda: ('get', reverse('api:CommentListPost') + '?workflow_id=%d' % workflow)
+    detail = lambda: ('get', reverse('api:WorkflowGetDeleteUpdate', kwargs={'pk': workflow}))
+    comment = lambda: ('post', reverse('api:CommentListPost'),
+                       {'workflow_id': workflow, 'name': 'comment', 'text': 'concurrent comment'})
+    new = lambda: ('post', reverse('api:WorkflowListPost'), workflow_payload(5))
+    return [workflow_list, comment_list, detail, comment, workflow_list, comment_list, detail, new, workflow_list,
+            comment_list]
+
+
+def client(sequence: list, count: int, barrier: threading.Barrier, latencies: list, errors: list):
+    http = Client(SERVER_NAME='localhost')
+    barrier.wait()
+    try:
+        for prepare in islice(cycle(sequence), count):
+            method, url, *data = prepare()
+            start = time.perf_counter()
+            try:
+                response = getattr(http, method)(url, *data, content_type='application/json')
+                assert response.status_code < 400, (method, url, response.status_code)
+            except OperationalError:
+                errors.append(1)
+            latencies.append(time.perf_counter() - start)
+    finally:
+        connections.close_all()
+
+
+def measure(sequence: list, clients: int) -> tuple:
+    barrier, latencies, errors = threading.Barrier(clients + 1), [], []
+    threads = [threading.Thread(target=client, args=(sequence, REQUESTS // clients or 1, barrier, latencies, errors))
+               for _ in range(clients)]
+    for thread in threads:
+        thread.start()
+    barrier.wait()
+    start = time.perf_counter()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+    latencies.sort()
+    return (len(latencies) / elapsed, latencies[len(latencies) // 2], latencies[int(len(latencies) * 0.99)],
+            len(errors))
+
+
+def run(stdout, options):
+    workflows = WorkflowTreeFactory(statuses=tuple(WorkflowSteps.STATUS_COUNTERS)).create_batch(
+        max(int(WORKFLOWS * options['scale']), 2))
+    sequence, database, rows = requests(workflows), connections.databases['default'], []
+    # Locked requests are counted, not logged.
+    logging.getLogger('django.request').disabled = True
+    for name, profile, writer_queue in PROFILES:
+        connections.close_all()
+        database.update(profile)
+        with override_settings(SQLITE_WRITER_QUEUE=writer_queue):
+            for clients in CLIENTS:
+                get_cache().clear()
+                throughput, median, p99, errors = zip(*(measure(sequence, clients) for _ in range(options['repeat'])))
+                rows.append((name, clients, '%.0f' % max(throughput), '%.2f' % (min(median) * 1000),
+                             '%.2f' % (min(p99) * 1000), sum(errors)))
+            close_writer()
+    connections.close_all()
+    logging.getLogger('django.request').disabled = False
+    write_table(stdout, ('profile', 'clients', 'requests/s', 'p50 ms', 'p99 ms', 'locked'), rows)
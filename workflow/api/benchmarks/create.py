@@ -0,0 +1,46 @@
+"""
+Latency of creating a workflow through WorkflowSerializer, as the number of steps grows.
+
+"before" replays the former implementation: a get_or_create on the full row
+followed by one INSERT per step, each committed on its own.
+"""
+from itertools import count
+
+from api.benchmarks import best_of, write_table
+from api.models import Workflow, WorkflowSteps
+from api.serializers.serializers import WorkflowSerializer
+
+STEP_COUNTS = (1, 10, 50, 200)
+
+_sequence = count()
+
+
+def payload(steps: int) -> dict:
+    number = next(_sequence)
+    return {
+        'name': 'workflow %d' % number,
+        'description': 'benchmark workflow %d' % number,
+        'steps': [{'name': 'step %d' % i, 'description': 'benchmark step %d' % i} for i in range(steps)],
+    }
+
+
+def create_per_step(data: dict):
+    steps_data = data.pop('steps')
+    workflow, created = Workflow.objects.get_or_create(**data)
+    for item in steps_data:
+        WorkflowSteps.objects.create(workflow_id=workflow, **item)
+
+
+def create_with_serializer(data: dict):
+    serializer = WorkflowSerializer(data=data)
+    serializer.is_valid(raise_exception=True)
+    serializer.save()
+
+
+def run(stdout, options):
+    rows = []
+    for steps in STEP_COUNTS:
+        before = best_of(lambda: create_per_step(payload(steps)), options['repeat'])
+        after = best_of(lambda: create_with_serializer(payload(steps)), options['repeat'])
+        rows.append((steps, '%.2f' % (before * 1000), '%.2f' % (after * 1000), '%.1fx' % (before / after)))
+    write_table(stdout, ('steps', 'before ms', 'after ms', 'speedup'), rows)
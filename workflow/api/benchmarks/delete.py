@@ -0,0 +1,39 @@
+"""
+Time the database is held by a workflow deletion: the cascading delete against the soft
+delete of the API, which flags the workflow alone whatever the number of its children.
+"""
+import time
+
+from django.db import transaction
+
+from api.benchmarks import write_table
+from api.models import Workflow, WorkflowSteps, Comment
+
+SIZES = (10, 1000, 10000)
+
+
+def populate(children: int) -> Workflow:
+    workflow = Workflow.objects.create(name='workflow %d' % children, description='benchmark workflow')
+    WorkflowSteps.objects.bulk_create(
+        WorkflowSteps(workflow_id=workflow, name='step %d' % i, description='benchmark step') for i in range(children))
+    Comment.objects.bulk_create(
+        Comment(workflow_id=workflow, name='comment %d' % i, text='benchmark comment') for i in range(children))
+    return workflow
+
+
+def timed(func) -> float:
+    start = time.perf_counter()
+    with transaction.atomic():
+        func()
+    return time.perf_counter() - start
+
+
+def run(stdout, options):
+    rows = []
+    for size in SIZES:
+        children = max(int(size * options['scale']), 1)
+        hard = min(timed(populate(children).delete) for _ in range(options['repeat']))
+        soft = min(timed(Workflow.objects.filter(pk=populate(children).pk).soft_delete)
+                   for _ in range(options['repeat']))
+        rows.append((children, '%.2f' % (hard * 1000), '%.2f' % (soft * 1000), '%.0fx' % (hard / soft)))
+    write_table(stdout, ('children', 'cascade ms', 'soft ms', 'speedup'), rows)
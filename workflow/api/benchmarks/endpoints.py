@@ -0,0 +1,141 @@
+"""
+Latency of every endpoint of api/urls.py, through the whole Django stack (middleware,
+url resolution, views, rendering), on workflows generated by WorkflowTreeFactory.
+
+Writes get a target of their own on every run, e.g. a new comment to delete, so each
+run times the same work. The best time of each operation is kept and returned, to be
+compared with the stored baselines.
+"""
+import json
+import time
+from itertools import count
+
+from django.test import Client
+from django.urls import reverse
+
+from api.benchmarks import write_table
+from api.models import Workflow, Comment, WorkflowSteps
+from api.tests.factories import WorkflowTreeFactory
+from api.utils.cache import get_cache
+from api.utils.pagination import KeysetPagination
+
+WORKFLOWS = 10000
+STEPS = 10
+COMMENTS = 10
+BATCH = 100
+# Fast operations are sampled for at least MIN_TIME seconds, in up to MAX_RUNS requests.
+MIN_TIME = 0.5
+MAX_RUNS = 30
+
+_sequence = count()
+
+
+def workflow_payload(steps: int = STEPS) -> dict:
+    number = next(_sequence)
+    return {
+        'name': 'benchmark workflow %d' % number,
+        'description': 'benchmark workflow',
+        'steps': [{'name': 'step %d' % i, 'description': 'benchmark step'} for i in range(steps)],
+    }
+
+
+class Endpoints:
+    """
+    The timed operations, by label.
+
+    An operation prepares a request, returning its method, url, payload and expected
+    status; only sending the request is timed.
+    """
+
+    def __init__(self, client: Client, workflows: range):
+        self.client = client
+        self.workflows = workflows
+        # Workflows of the second half of the table, one per write: four operations use
+        # MAX_RUNS of them at most.
+        self.targets = iter(range(workflows[len(workflows) // 2], workflows[-1] + 1))
+
+    def send(self, method: str, url: str, data=None, status: int = 200):
+        if data is not None:
+            data = json.dumps(data)
+        response = getattr(self.client, method)(url, data, content_type='application/json')
+        # Streamed exports are read to the end.
+        b''.join(response.streaming_content) if response.streaming else response.content
+        assert response.status_code == status, (method, url, response.status_code)
+
+    def measure(self, prepare, repeat: int) -> float:
+        """
+        Return the best time of sending the requests of an operation, sent ``repeat`` times
+        at least and then until MIN_TIME is spent or MAX_RUNS are sent.
+        """
+        timings = []
+        while len(timings) < repeat or (sum(timings) < MIN_TIME and len(timings) < MAX_RUNS):
+            request = prepare()
+            start = time.perf_counter()
+            self.send(*request)
+            timings.append(time.perf_counter() - start)
+        return min(timings)
+
+    def uncached(self, url: str) -> tuple:
+        get_cache().clear()
+        return 'get', url
+
+    def workflow_update(self) -> tuple:
+        pk = next(self.targets)
+        steps = list(WorkflowSteps.objects.filter(workflow_id=pk).values('id', 'name', 'description'))
+        for step in steps[::2]:
+            step['name'] = 'renamed'
+        data = dict(workflow_payload(0), steps=steps[1:] + [{'name': 'new step', 'description': 'benchmark step'}])
+        return 'put', reverse('api:WorkflowGetDeleteUpdate', kwargs={'pk': pk}), data, 201
+
+    def comment_target(self) -> str:
+        pk = Comment.objects.filter(workflow_id=next(self.targets)).values_list('id', flat=True).first()
+        return reverse('api:CommentGetDeleteUpdate', kwargs={'pk': pk})
+
+    def operations(self) -> dict:
+        middle = Workflow.objects.get(id=self.workflows[len(self.workflows) // 2])
+        detail = reverse('api:WorkflowGetDeleteUpdate', kwargs={'pk': middle.id})
+        comment = Comment.objects.filter(workflow_id=middle).first()
+        cursor = KeysetPagination().encode_cursor((middle.created_at, middle.id))
+        workflows, comments = reverse('api:WorkflowListPost'), reverse('api:CommentListPost')
+        runs = reverse('api:WorkflowRunListPost', kwargs={'pk': middle.id})
+        comment_data = {'workflow_id': middle.id, 'name': 'comment', 'text': 'benchmark comment'}
+        return {
+            'workflow list': lambda: ('get', workflows),
+            'workflow list deep cursor': lambda: ('get', workflows + '?cursor=' + cursor),
+            'workflow list filtered': lambda: (
+                'get', workflows + '?status=%d&created_after=2000-01-01' % WorkflowSteps.RETIRED),
+            'workflow create': lambda: ('post', workflows, workflow_payload(), 201),
+            'workflow batch create': lambda: (
+                'post', reverse('api:WorkflowBatchPost'), [workflow_payload() for _ in range(BATCH)], 201),
+            'workflow detail': lambda: self.uncached(detail),
+            'workflow detail cached': lambda: ('get', detail),
+            'workflow comments': lambda: ('get', reverse('api:WorkflowCommentList', kwargs={'pk': middle.id})),
+            # The runs started are listed next.
+            'workflow run start': lambda: ('post', runs, None, 201),
+            'workflow runs list': lambda: ('get', runs),
+            'workflow update': self.workflow_update,
+            'workflow delete': lambda: (
+                'delete', reverse('api:WorkflowGetDeleteUpdate', kwargs={'pk': next(self.targets)}), None, 204),
+            'workflow export ndjson': lambda: ('get', reverse('api:WorkflowExport', args=['ndjson'])),
+            'workflow export csv': lambda: ('get', reverse('api:WorkflowExport', args=['csv'])),
+            'comment list': lambda: ('get', comments),
+            'comment list by workflow': lambda: ('get', comments + '?workflow_id=%d' % middle.id),
+            'comment create': lambda: ('post', comments, comment_data, 201),
+            'comment detail': lambda: ('get', reverse('api:CommentGetDeleteUpdate', kwargs={'pk': comment.id})),
+            'comment update': lambda: ('put', self.comment_target(), dict(comment_data, name='renamed'), 201),
+            'comment delete': lambda: ('delete', self.comment_target(), None, 204),
+            'search': lambda: ('get', reverse('api:SearchList') + '?q=workflow'),
+        }
+
+
+def run(stdout, options):
+    workflows = WorkflowTreeFactory(
+        steps=STEPS, comments=COMMENTS, statuses=tuple(WorkflowSteps.STATUS_COUNTERS),
+    ).create_batch(max(int(WORKFLOWS * options['scale']), 8 * max(MAX_RUNS, options['repeat'])))
+    stdout.write("Dataset: %d workflows, %d steps and %d comments each" % (len(workflows), STEPS, COMMENTS))
+
+    endpoints = Endpoints(Client(SERVER_NAME='localhost'), workflows)
+    timings = {label: endpoints.measure(prepare, options['repeat'])
+               for label, prepare in endpoints.operations().items()}
+    write_table(stdout, ('operation', 'ms'), [(label, '%.2f' % (seconds * 1000)) for label, seconds in timings.items()])
+    return timings
@@ -0,0 +1,41 @@
+"""
+Throughput and peak Python memory of the streaming export, which must stay flat
+whatever the size of the tables.
+"""
+import time
+import tracemalloc
+
+from api.benchmarks import write_table
+from api.benchmarks.search import populate
+from api.models import Workflow
+from api.utils.export import FORMATS
+
+CORPUS_ROWS = (50000, 200000)
+
+
+def consume(export_format: str) -> int:
+    return sum(len(line) for line in FORMATS[export_format]())
+
+
+def measure(export_format: str):
+    start = time.perf_counter()
+    size = consume(export_format)
+    elapsed = time.perf_counter() - start
+    # Memory is traced on a second pass, tracing slows the export down a lot.
+    tracemalloc.start()
+    consume(export_format)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return elapsed, size, peak
+
+
+def run(stdout, options):
+    rows, populated = [], 0
+    for corpus in CORPUS_ROWS:
+        # Grow the same tables from one size to the next.
+        populated += populate(int(corpus * options['scale']) - populated, first_id=Workflow.objects.count())
+        for export_format in sorted(FORMATS):
+            elapsed, size, peak = measure(export_format)
+            rows.append((populated, export_format, '%.0f' % (populated / elapsed), '%.1f' % (size / 2 ** 20),
+                         '%.1f' % (peak / 2 ** 20)))
+    write_table(stdout, ('rows', 'format', 'rows/s', 'output MB', 'peak MB'), rows)
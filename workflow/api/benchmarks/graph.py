@@ -0,0 +1,92 @@
+"""
+Cost of the step dependencies of a workflow of 10k steps, from its creation to its run.
+
+The dependencies are random but seeded: each step depends on up to 3 of the 100 steps
+before it. The workflow is validated (including the cycle check), written with its
+graph, then its graph is rendered as in the detail, from the stored one parsed (cold) or
+from the cache (warm).
+A run of it is then started and drained by 4 workers with no-op steps. Making ready the
+dependents of a batch reads them from the cached graph and costs a few queries whatever
+the size of the workflow. The steps/s are rather bound by the frontier, the steps ready
+at once: all of them without dependencies, a few dozen with them.
+"""
+import random
+import time
+
+from django.conf import settings
+from django.db import connections
+
+from api.benchmarks import best_of, write_table
+from api.models import StepRun, Workflow, WorkflowRun, WorkflowSteps
+from api.serializers.serializers import WorkflowItemSerializer, WorkflowSerializer
+from api.utils.graph import get_graph
+from api.utils.scheduler import run_workers, start_run
+
+STEPS = 10000
+WINDOW = 100
+SEED = 25
+# (name, dependencies of each step)
+SHAPES = (('none', 0), ('random', 3))
+
+
+def payload(steps: int, dependencies: int) -> dict:
+    generator = random.Random(SEED)
+    return {
+        'name': 'workflow of %d steps with %d dependencies' % (steps, dependencies),
+        'description': 'benchmark workflow',
+        'steps': [{'name': 'step %d' % i, 'description': 'benchmark step',
+                   'depends_on': generator.sample(range(max(i - WINDOW, 0), i), min(i, dependencies))}
+                  for i in range(steps)],
+    }
+
+
+def run_workflow(workflow: Workflow, repeat: int) -> tuple:
+    """
+    Return the best time to start a run of a workflow and the best steps/s of its workers.
+    """
+    started, rate = None, 0
+    for _ in range(repeat):
+        StepRun.objects.all().delete()
+        WorkflowRun.objects.all().delete()
+        start = time.perf_counter()
+        start_run(workflow)
+        elapsed = time.perf_counter() - start
+        stats = run_workers(1, 4, poll_interval=0.01, exit_when_idle=True)
+        rate = max(rate, stats['steps'] / (time.perf_counter() - start - elapsed))
+        started = elapsed if started is None else min(started, elapsed)
+        assert WorkflowRun.objects.get().state == WorkflowRun.SUCCEEDED
+    return started, rate
+
+
+def run(stdout, options):
+    connections.close_all()
+    connections.databases['default'].update(settings.SQLITE_PRODUCTION)
+    rows = []
+    for name, dependencies in SHAPES:
+        data = payload(max(int(STEPS * options['scale']), 1), dependencies)
+        validate = best_of(lambda: WorkflowSerializer(data=data).is_valid(raise_exception=True), options['repeat'])
+        serializer = WorkflowSerializer(data=data)
+        serializer.is_valid(raise_exception=True)
+        start = time.perf_counter()
+        workflow = serializer.save()
+        save = time.perf_counter() - start
+
+        # Only active steps are run, the API creates steps in definition.
+        WorkflowSteps.objects.filter(workflow_id=workflow).update(status=WorkflowSteps.ACTIVE)
+        workflow = Workflow.objects.prefetch_related('steps').get(pk=workflow.pk)
+
+        def render(cold: bool):
+            if cold:
+                get_graph.cache_clear()
+            workflow.__dict__.pop('graph', None)
+            WorkflowItemSerializer(workflow, fields=('graph',)).data
+
+        cold = best_of(lambda: render(True), options['repeat'])
+        warm = best_of(lambda: render(False), options['repeat'])
+        started, rate = run_workflow(workflow, options['repeat'])
+        rows.append((name, len(data['steps']), sum(len(step['depends_on']) for step in data['steps']),
+                     len(workflow.graph.level_sets()), '%.1f' % (validate * 1000), '%.1f' % (save * 1000),
+                     '%.1f' % (cold * 1000), '%.1f' % (warm * 1000), '%.1f' % (started * 1000), '%.0f' % rate))
+    connections.close_all()
+    write_table(stdout, ('dependencies', 'steps', 'edges', 'levels', 'validate ms', 'save ms', 'graph cold ms',
+                         'graph warm ms', 'start run ms', 'steps/s'), rows)
@@ -0,0 +1,67 @@
+"""
+Throughput of workflow creation, in workflows per second: one POST per workflow
+against the batch endpoint, with JSON and NDJSON bodies.
+"""
+import json
+import time
+from itertools import count
+
+from rest_framework.test import APIRequestFactory
+
+from api.benchmarks import write_table
+from api.views import WorkflowListPost, WorkflowBatchPost
+
+ITEMS = 2000
+STEPS = 10
+BATCH_SIZES = (100, 1000)
+
+_sequence = count()
+
+
+def payloads(items: int) -> list:
+    return [
+        {
+            'name': 'workflow %d' % number,
+            'description': 'benchmark workflow',
+            'steps': [{'name': 'step %d' % i, 'description': 'benchmark step'} for i in range(STEPS)],
+        }
+        for number in (next(_sequence) for _ in range(items))
+    ]
+
+
+def post_one_by_one(factory, items: list):
+    view = WorkflowListPost.as_view()
+    for item in items:
+        assert view(factory.post('/api/workflow/', item, format='json')).status_code == 201
+
+
+def post_batches(factory, items: list, batch_size: int, ndjson: bool):
+    view = WorkflowBatchPost.as_view()
+    for start in range(0, len(items), batch_size):
+        batch = items[start:start + batch_size]
+        if ndjson:
+            body = '\n'.join(json.dumps(item) for item in batch)
+            request = factory.post('/api/workflow/batch/', body, content_type='application/x-ndjson')
+        else:
+            request = factory.post('/api/workflow/batch/', batch, format='json')
+        assert view(request).status_code == 201
+
+
+def throughput(func, items: list) -> str:
+    start = time.perf_counter()
+    func(items)
+    return '%.0f' % (len(items) / (time.perf_counter() - start))
+
+
+def run(stdout, options):
+    factory = APIRequestFactory()
+    items = max(int(ITEMS * options['scale']), 1)
+    rows = [('single POST', '-', throughput(lambda batch: post_one_by_one(factory, batch), payloads(items)))]
+    for batch_size in BATCH_SIZES:
+        for ndjson in (False, True):
+            rows.append((
+                'batch NDJSON' if ndjson else 'batch JSON', batch_size,
+                throughput(lambda batch: post_batches(factory, batch, batch_size, ndjson), payloads(items)),
+            ))
+    stdout.write("%d workflows of %d steps" % (items, STEPS))
+    write_table(stdout, ('endpoint', 'batch size', 'workflows/s'), rows)
@@ -0,0 +1,38 @@
+"""
+CPU time of list serialization: ModelSerializer(many=True) against the values-based
+fast path, from the queryset of a page to the list of dicts handed to the renderer.
+"""
+from django.utils import timezone
+
+from api.benchmarks import best_of, write_table
+from api.models import Workflow, Comment
+from api.serializers.serializers import WorkflowListSerializer, CommentListSerializer, workflow_list_values, \
+    comment_list_values
+
+PAGE_SIZES = (10, 100, 1000)
+ROWS = 10000
+
+
+def populate(rows: int):
+    now = timezone.now()
+    workflow = Workflow.objects.create(name='workflow', description='benchmark workflow')
+    Workflow.objects.bulk_create(
+        Workflow(name='workflow %d' % i, description='benchmark workflow ' * 10) for i in range(rows))
+    Comment.objects.bulk_create(
+        Comment(workflow_id=workflow, name='comment %d' % i, text='benchmark comment ' * 10) for i in range(rows))
+    return now
+
+
+def run(stdout, options):
+    populate(max(int(ROWS * options['scale']), max(PAGE_SIZES)))
+    rows = []
+    for label, serializer_class, fast, queryset in (
+            ('workflows', WorkflowListSerializer, workflow_list_values, Workflow.objects.all()),
+            ('comments', CommentListSerializer, comment_list_values, Comment.objects.all())):
+        for page_size in PAGE_SIZES:
+            page = queryset[:page_size]
+            before = best_of(lambda: serializer_class(page.all(), many=True).data, options['repeat'])
+            after = best_of(lambda: fast.to_representation(fast.values(page.all())), options['repeat'])
+            rows.append((label, page_size, '%.2f' % (before * 1000), '%.2f' % (after * 1000),
+                         '%.1fx' % (before / after)))
+    write_table(stdout, ('list', 'rows', 'serializer ms', 'values ms', 'speedup'), rows)
@@ -0,0 +1,38 @@
+"""
+Encoding time of workflow detail payloads: DRF's stdlib JSON renderer against the orjson backed
+renderer, for workflows of growing numbers of steps and comments.
+"""
+from api.benchmarks import best_of, write_table
+from api.models import Workflow, WorkflowSteps, Comment
+from api.serializers.serializers import WorkflowItemSerializer
+from api.utils.renderers import FastJSONRenderer, orjson
+from rest_framework.renderers import JSONRenderer
+
+SIZES = (10, 1000, 10000)
+
+
+def populate(children: int) -> Workflow:
+    workflow = Workflow.objects.create(name='workflow %d' % children, description='benchmark workflow ' * 10)
+    WorkflowSteps.objects.bulk_create(
+        WorkflowSteps(workflow_id=workflow, name='step %d' % i, description='benchmark step ' * 10, status=i % 3)
+        for i in range(children))
+    Comment.objects.bulk_create(
+        Comment(workflow_id=workflow, name='comment %d' % i, text='benchmark comment ' * 10)
+        for i in range(children))
+    return workflow
+
+
+def run(stdout, options):
+    if orjson is None:
+        stdout.write('orjson is not installed, both renderers use the stdlib.')
+    rows = []
+    for size in SIZES:
+        children = max(int(size * options['scale']), 1)
+        data = WorkflowItemSerializer(populate(children)).data
+        stdlib, fast = JSONRenderer(), FastJSONRenderer()
+        assert stdlib.render(data) == fast.render(data)
+        before = best_of(lambda: stdlib.render(data), options['repeat'])
+        after = best_of(lambda: fast.render(data), options['repeat'])
+        rows.append((children, len(fast.render(data)) // 1024, '%.2f' % (before * 1000), '%.2f' % (after * 1000),
+                     '%.1fx' % (before / after)))
+    write_table(stdout, ('children', 'KiB', 'stdlib ms', 'orjson ms', 'speedup'), rows)
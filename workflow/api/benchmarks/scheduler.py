@@ -0,0 +1,66 @@
+"""
+Throughput of the workers of api.utils.scheduler, in steps per second, as their number grows.
+
+Runs of workflows of 10 active steps are started, then executed by pools of workers of
+growing size until no step is left, with the production profile of the database. Steps
+either do nothing, measuring the cost of claiming and recording them, or wait for 2 ms,
+like steps calling another service: the database is then idle between claims and more
+workers run more steps, up to the rate SQLite commits the claims and results. Conflicts,
+steps read by a worker but claimed first by another one, only happen on databases reading
+the batches before claiming them.
+"""
+import time
+
+from django.conf import settings
+from django.db import connections
+from django.test.utils import override_settings
+
+from api.benchmarks import write_table
+from api.models import StepRun, Workflow, WorkflowRun, WorkflowSteps
+from api.tests.factories import WorkflowTreeFactory
+from api.utils.scheduler import run_workers, start_run
+
+WORKFLOWS = 200
+STEPS = 10
+# (processes, threads per process)
+POOLS = ((1, 1), (1, 2), (1, 4), (1, 8), (2, 4), (4, 4))
+HANDLERS = (
+    ('no-op', None),
+    ('2 ms', 'api.benchmarks.scheduler.wait'),
+)
+
+
+def wait(step_run: StepRun):
+    time.sleep(0.002)
+
+
+def start_runs(workflows: range):
+    StepRun.objects.all().delete()
+    WorkflowRun.objects.all().delete()
+    for workflow in Workflow.objects.filter(id__in=workflows).only('id'):
+        start_run(workflow)
+
+
+def run(stdout, options):
+    workflows = WorkflowTreeFactory(steps=STEPS, comments=0, statuses=(WorkflowSteps.ACTIVE,)).create_batch(
+        max(int(WORKFLOWS * options['scale']), 1))
+    connections.close_all()
+    connections.databases['default'].update(settings.SQLITE_PRODUCTION)
+    rows = []
+    for name, handler in HANDLERS:
+        with override_settings(WORKFLOW_STEP_HANDLER=handler):
+            for processes, threads in POOLS:
+                best = None
+                for _ in range(options['repeat']):
+                    start_runs(workflows)
+                    start = time.perf_counter()
+                    stats = run_workers(processes, threads, poll_interval=0.01, exit_when_idle=True)
+                    elapsed = time.perf_counter() - start
+                    assert not WorkflowRun.objects.filter(state=WorkflowRun.RUNNING).exists()
+                    if best is None or elapsed < best[0]:
+                        best = elapsed, stats
+                elapsed, stats = best
+                rows.append((name, processes, threads, stats['steps'], '%.0f' % (stats['steps'] / elapsed),
+                             stats['batches'], stats['conflicts']))
+    connections.close_all()
+    write_table(stdout, ('step', 'processes', 'threads', 'steps', 'steps/s', 'batches', 'conflicts'), rows)
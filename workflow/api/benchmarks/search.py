@@ -0,0 +1,75 @@
+"""
+Latency of full-text queries on a corpus of one million workflows, steps and comments.
+
+"before" replays the former BaseModel.search for every term: a leading-wildcard
+icontains on the name and text columns of the three tables, which scans them all.
+"""
+import random
+from itertools import accumulate
+
+from django.db.models import Q
+
+from api.benchmarks import best_of, write_table
+from api.models import Workflow, WorkflowSteps, Comment, normalize
+from api.tests.factories import WorkflowTreeFactory
+from api.utils.search import SearchResults
+
+CORPUS_ROWS = 1000000
+STEPS_PER_WORKFLOW = 10
+COMMENTS_PER_WORKFLOW = 9
+QUERIES = ('velora', 'velora tamin', '"velora tamin"', 'zuvexo')
+
+SYLLABLES = ('ka', 'lo', 'mi', 've', 'ra', 'ta', 'min', 'zu', 'xo', 'den', 'sa', 'po', 'ri', 'nel')
+
+
+def vocabulary(rng, size=5000):
+    words = set()
+    while len(words) < size:
+        words.add(''.join(rng.choice(SYLLABLES) for _ in range(rng.randint(2, 4))))
+    words = sorted(words - {'velora', 'tamin', 'zuvexo'})
+    # Two common words and a rare one, queried by the benchmark.
+    words[20:20], words[30:30], words[4000:4000] = ['velora'], ['tamin'], ['zuvexo']
+    return words
+
+
+def sentences(rng, words):
+    # Zipf distribution: the word of rank r is picked with a weight of 1 / r.
+    cum_weights = list(accumulate(1 / rank for rank in range(1, len(words) + 1)))
+    return lambda length: ' '.join(rng.choices(words, cum_weights=cum_weights, k=length))
+
+
+def populate(rows: int, chunk_size: int = 1000, first_id: int = 0):
+    rng = random.Random(first_id)
+    sentence = sentences(rng, vocabulary(rng))
+    workflows = rows // (1 + STEPS_PER_WORKFLOW + COMMENTS_PER_WORKFLOW)
+    WorkflowTreeFactory(steps=STEPS_PER_WORKFLOW, comments=COMMENTS_PER_WORKFLOW,
+                        text=lambda number, words: sentence(words), chunk_size=chunk_size).create_batch(workflows)
+    return workflows * (1 + STEPS_PER_WORKFLOW + COMMENTS_PER_WORKFLOW)
+
+
+def search_icontains(query_string):
+    hits = []
+    for model, text in ((Workflow, 'description'), (WorkflowSteps, 'description'), (Comment, 'text')):
+        queryset = model.objects.all()
+        for word in normalize(query_string):
+            queryset = queryset.filter(Q(name__icontains=word) | Q(**{text + '__icontains': word}))
+        hits.append(queryset.count())
+        hits.extend(queryset.order_by('created_at')[:10])
+    return hits
+
+
+def search_index(query_string):
+    results = SearchResults(query_string)
+    return results.count(), results[:10]
+
+
+def run(stdout, options):
+    rows = populate(int(CORPUS_ROWS * options['scale']))
+    stdout.write("Corpus: %d rows" % rows)
+    table = []
+    for query in QUERIES:
+        hits = SearchResults(query).count()
+        before = best_of(lambda: search_icontains(query), options['repeat'])
+        after = best_of(lambda: search_index(query), options['repeat'])
+        table.append((query, hits, '%.2f' % (before * 1000), '%.2f' % (after * 1000), '%.1fx' % (before / after)))
+    write_table(stdout, ('query', 'hits', 'before ms', 'after ms', 'speedup'), table)
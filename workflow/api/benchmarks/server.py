@@ -0,0 +1,103 @@
+"""
+Requests per second and latency percentiles of the read endpoints served in process by
+workflow/wsgi.py, from a pool of threads, and by workflow/asgi.py, from concurrent
+asyncio tasks. No network server is involved, only the Django handlers.
+"""
+import asyncio
+import statistics
+import time
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+
+from django.db import connections
+
+from api.benchmarks import write_table
+from api.models import Workflow, WorkflowSteps, Comment
+from workflow.asgi import application as asgi_application
+from workflow.wsgi import application as wsgi_application
+
+REQUESTS = 400
+CONCURRENCY = (1, 16, 64)
+
+
+def populate():
+    for number in range(20):
+        workflow = Workflow.objects.create(name="workflow %d" % number, description="benchmark workflow")
+        WorkflowSteps.objects.bulk_create(
+            WorkflowSteps(workflow_id=workflow, name="step %d" % i, description="benchmark step") for i in range(20))
+        Comment.objects.bulk_create(
+            Comment(workflow_id=workflow, name="comment %d" % i, text="benchmark comment") for i in range(20))
+    workflow, comment = Workflow.objects.first(), Comment.objects.first()
+    return (
+        ('workflow list', '/api/workflow/'),
+        ('workflow detail', '/api/workflow/%d' % workflow.id),
+        ('comment list', '/api/comment/'),
+        ('comment detail', '/api/comment/%d' % comment.id),
+    )
+
+
+def wsgi_get(path: str) -> float:
+    environ = {
+        'REQUEST_METHOD': 'GET', 'PATH_INFO': path, 'QUERY_STRING': '', 'SERVER_NAME': 'localhost',
+        'SERVER_PORT': '80', 'HTTP_ACCEPT': 'application/json', 'wsgi.input': BytesIO(), 'wsgi.url_scheme': 'http',
+    }
+    start = time.perf_counter()
+    body = wsgi_application(environ, lambda status, headers: None)
+    b''.join(body)
+    body.close()
+    return time.perf_counter() - start
+
+
+async def asgi_get(path: str) -> float:
+    scope = {
+        'type': 'http', 'method': 'GET', 'path': path, 'query_string': b'', 'server': ('localhost', 80),
+        'headers': [(b'host', b'localhost'), (b'accept', b'application/json')],
+    }
+
+    async def receive():
+        return {'type': 'http.request', 'body': b'', 'more_body': False}
+
+    async def send(message):
+        pass
+
+    start = time.perf_counter()
+    await asgi_application(scope, receive, send)
+    return time.perf_counter() - start
+
+
+def run_wsgi(path: str, requests: int, concurrency: int):
+    with ThreadPoolExecutor(concurrency) as executor:
+        start = time.perf_counter()
+        latencies = list(executor.map(wsgi_get, [path] * requests))
+    return time.perf_counter() - start, latencies
+
+
+def run_asgi(path: str, requests: int, concurrency: int):
+    async def main():
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def limited():
+            async with semaphore:
+                return await asgi_get(path)
+
+        return await asyncio.gather(*(limited() for _ in range(requests)))
+
+    start = time.perf_counter()
+    latencies = asyncio.run(main())
+    return time.perf_counter() - start, latencies
+
+
+def run(stdout, options):
+    endpoints = populate()
+    # The handlers open their own connections from their threads.
+    connections.close_all()
+    requests = max(int(REQUESTS * options['scale']), 1)
+    rows = []
+    for label, path in endpoints:
+        for concurrency in CONCURRENCY:
+            for handler, runner in (('wsgi', run_wsgi), ('asgi', run_asgi)):
+                elapsed, latencies = runner(path, requests, concurrency)
+                p99 = statistics.quantiles(latencies, n=100)[98] if len(latencies) > 1 else latencies[0]
+                rows.append((label, handler, concurrency, '%.0f' % (requests / elapsed),
+                             '%.1f' % (statistics.median(latencies) * 1000), '%.1f' % (p99 * 1000)))
+    write_table(stdout, ('endpoint', 'handler', 'concurrency', 'req/s', 'p50 ms', 'p99 ms'), rows)
@@ -0,0 +1,77 @@
+import importlib
+import os
+import pkgutil
+import tempfile
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+from api import benchmarks
+
+
+class Command(BaseCommand):
+    help = "Run the api benchmarks against scratch databases, comparing their timings with the stored baselines."
+
+    def add_arguments(self, parser):
+        parser.add_argument('names', nargs='*', help="Benchmarks to run, all of them by default.")
+        parser.add_argument('--repeat', type=int, default=3, help="Number of timed runs per measurement.")
+        parser.add_argument('--scale', type=float, default=1.0,
+                            help="Factor applied to the size of the generated datasets.")
+        parser.add_argument('--baselines', default=benchmarks.BASELINES, help="File of the stored baselines.")
+        parser.add_argument('--save-baselines', action='store_true',
+                            help="Store the timings as the new baselines instead of comparing them.")
+        parser.add_argument('--threshold', type=float, default=benchmarks.THRESHOLD,
+                            help="Slowdown over a baseline failing the command, 0.25 being 25%% slower.")
+
+    def handle(self, *args, **options):
+        available = sorted(module.name for module in pkgutil.iter_modules(benchmarks.__path__))
+        names = options['names'] or available
+        unknown = set(names) - set(available)
+        if unknown:
+            raise CommandError("Unknown benchmark(s): %s. Available: %s." % (
+                ', '.join(sorted(unknown)), ', '.join(available)))
+
+        baselines, regressions = benchmarks.load_baselines(options['baselines']), []
+        for name in names:
+            self.stdout.write(self.style.MIGRATE_HEADING("Benchmark: %s" % name))
+            timings = self.run_benchmark(name, options)
+            if not timings:
+                continue
+            if options['save_baselines']:
+                baselines[name] = {'scale': options['scale'],
+                                   'ms': {label: round(seconds * 1000, 3) for label, seconds in timings.items()}}
+            else:
+                regressions.extend('%s: %s' % (name, label) for label in self.compare(
+                    baselines.get(name), timings, options))
+
+        if options['save_baselines']:
+            benchmarks.save_baselines(options['baselines'], baselines)
+            self.stdout.write(self.style.SUCCESS("Baselines saved to %s" % options['baselines']))
+        if regressions:
+            raise CommandError("%d regression(s) over the baselines: %s." % (len(regressions), ', '.join(regressions)))
+
+    def run_benchmark(self, name: str, options: dict) -> dict:
+        """
+        Run a benchmark against a database of its own, so that no benchmark sees the rows of another.
+        """
+        with tempfile.TemporaryDirectory() as directory:
+            if connection.vendor == 'sqlite':
+                # A file database, so that commits pay the same fsync cost as in production.
+                connection.settings_dict['TEST'] = dict(
+                    connection.settings_dict.get('TEST') or {}, NAME=os.path.join(directory, 'benchmark.sqlite3'))
+            old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True)
+            try:
+                return importlib.import_module('api.benchmarks.%s' % name).run(self.stdout, options)
+            finally:
+                connection.creation.destroy_test_db(old_name, verbosity=0)
+
+    def compare(self, baseline: dict, timings: dict, options: dict) -> list:
+        if baseline is None:
+            self.stdout.write("No baseline, run with --save-baselines to store one.")
+            return []
+        if baseline['scale'] != options['scale']:
+            self.stdout.write("Baseline measured at --scale %s, not compared." % baseline['scale'])
+            return []
+        rows, regressions = benchmarks.compare(baseline['ms'], timings, options['threshold'])
+        benchmarks.write_table(self.stdout, ('operation', 'baseline ms', 'ms', 'change'), rows)
+        return regressions
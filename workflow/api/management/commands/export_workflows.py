@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand
+
+from api.utils.export import CHUNK_SIZE, FORMATS
+
+
+class Command(BaseCommand):
+    help = "Export every workflow with its steps and comments as NDJSON or CSV."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--format', choices=sorted(FORMATS), default='ndjson', dest='export_format')
+        parser.add_argument('--output', help="File to write, the standard output by default.")
+        parser.add_argument('--chunk-size', type=int, default=CHUNK_SIZE,
+                            help="Number of workflows read per round trip.")
+
+    def handle(self, *args, **options):
+        lines = FORMATS[options['export_format']](options['chunk_size'])
+        if options['output']:
+            with open(options['output'], 'w', newline='', encoding='utf-8') as output:
+                output.writelines(lines)
+        else:
+            for line in lines:
+                self.stdout.write(line, ending='')
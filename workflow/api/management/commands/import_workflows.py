@@ -0,0 +1,49 @@
+import os
+import sys
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from api.utils.importer import CHUNK_SIZE, READERS, get_position, import_records
+
+
+class Command(BaseCommand):
+    help = ("Import workflows with their steps and comments from an NDJSON or CSV export. "
+            "An interrupted import of a file resumes after its last committed chunk when run again.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help="File to import, '-' for the standard input.")
+        parser.add_argument('--format', choices=sorted(READERS), dest='import_format',
+                            help="Format of the file, guessed from its extension by default.")
+        parser.add_argument('--chunk-size', type=int, default=CHUNK_SIZE,
+                            help="Number of workflows per transaction.")
+
+    def handle(self, *args, **options):
+        path = options['path']
+        import_format = options['import_format'] or os.path.splitext(path)[1].lstrip('.').lower()
+        if import_format not in READERS:
+            raise CommandError("Unknown format, pass --format %s." % '|'.join(sorted(READERS)))
+        # The standard input can't be read again, its imports don't resume.
+        progress = None if path == '-' else os.path.abspath(path)
+
+        start = get_position(progress)
+        if start:
+            self.stdout.write("Resuming after record %d." % start)
+
+        stream = sys.stdin if path == '-' else open(path, newline='', encoding='utf-8')
+        began, total_rows, total_rejected, position = time.perf_counter(), 0, 0, start
+        try:
+            for position, rows, rejected in import_records(READERS[import_format](stream), progress,
+                                                           options['chunk_size']):
+                for number, error in rejected:
+                    self.stderr.write("Record %d rejected: %s" % (number, error))
+                total_rows += rows
+                total_rejected += len(rejected)
+                self.stdout.write("%d records read, %d rows imported, %.0f rows/s" % (
+                    position, total_rows, total_rows / (time.perf_counter() - began)))
+        finally:
+            if stream is not sys.stdin:
+                stream.close()
+
+        self.stdout.write(self.style.SUCCESS("Imported %d rows from %d records in %.1fs, %d records rejected." % (
+            total_rows, position - start, time.perf_counter() - began, total_rejected)))
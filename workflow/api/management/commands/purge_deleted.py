@@ -0,0 +1,33 @@
+import time
+from collections import Counter
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from api.utils.purge import BATCH_SIZE, purge_deleted
+
+
+class Command(BaseCommand):
+    help = ("Remove the soft deleted workflows, steps and comments from the database, "
+            "in batches of one transaction each.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=BATCH_SIZE,
+                            help="Maximum number of rows removed per transaction.")
+        parser.add_argument('--older-than', type=int, default=0,
+                            help="Only remove rows deleted at least this many seconds ago.")
+
+    def handle(self, *args, **options):
+        if options['batch_size'] < 1:
+            raise CommandError("--batch-size must be positive.")
+        before = timezone.now() - timedelta(seconds=options['older_than'])
+
+        began, removed = time.perf_counter(), Counter()
+        for model, rows in purge_deleted(before, options['batch_size']):
+            name = str(model._meta.verbose_name_plural)
+            removed[name] += rows
+            self.stdout.write("%d %s removed" % (rows, name))
+        self.stdout.write(self.style.SUCCESS("Purged %d rows in %.1fs%s" % (
+            sum(removed.values()), time.perf_counter() - began,
+            ''.join(', %d %s' % (rows, name) for name, rows in removed.items()))))
@@ -0,0 +1,26 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from api.utils.counters import BATCH_SIZE, recount
+
+
+class Command(BaseCommand):
+    help = ("Recompute the step and comment counters of the workflows from their rows, "
+            "repairing the workflows whose counters drifted.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=BATCH_SIZE,
+                            help="Number of workflows checked per transaction.")
+
+    def handle(self, *args, **options):
+        if options['batch_size'] < 1:
+            raise CommandError("--batch-size must be positive.")
+
+        began, checked, repaired = time.perf_counter(), 0, 0
+        for count, drifted in recount(options['batch_size']):
+            checked, repaired = checked + count, repaired + len(drifted)
+            if drifted:
+                self.stdout.write("Repaired workflows %s" % ', '.join(str(pk) for pk in drifted))
+        self.stdout.write(self.style.SUCCESS("Checked %d workflows in %.1fs, %d repaired" % (
+            checked, time.perf_counter() - began, repaired)))
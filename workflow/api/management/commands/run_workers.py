@@ -0,0 +1,33 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from api.utils.scheduler import BATCH_SIZE, POLL_INTERVAL, run_workers
+
+
+class Command(BaseCommand):
+    help = ("Run the steps of the workflow runs with a pool of workers, claiming the ready steps "
+            "from the database in batches, until interrupted.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--processes', type=int, default=1,
+                            help="Number of worker processes, forked from this one when more than 1.")
+        parser.add_argument('--threads', type=int, default=4, help="Number of workers per process.")
+        parser.add_argument('--batch-size', type=int, default=BATCH_SIZE,
+                            help="Maximum number of steps claimed by a worker at once.")
+        parser.add_argument('--poll-interval', type=float, default=POLL_INTERVAL,
+                            help="Seconds waited by a worker finding no ready step.")
+        parser.add_argument('--exit-when-idle', action='store_true',
+                            help="Stop once no step is ready nor running, instead of waiting for new runs.")
+
+    def handle(self, *args, **options):
+        for name in ('processes', 'threads', 'batch_size'):
+            if options[name] < 1:
+                raise CommandError("--%s must be positive." % name.replace('_', '-'))
+
+        began = time.perf_counter()
+        stats = run_workers(options['processes'], options['threads'], batch_size=options['batch_size'],
+                            poll_interval=options['poll_interval'], exit_when_idle=options['exit_when_idle'])
+        elapsed = time.perf_counter() - began
+        self.stdout.write(self.style.SUCCESS("Ran %d steps in %.1fs (%.0f steps/s), %d batches, %d conflicts" % (
+            stats['steps'], elapsed, stats['steps'] / elapsed, stats['batches'], stats['conflicts'])))
@@ -0,0 +1,17 @@
+# Generated by Django 3.0.5 on 2026-10-18 17:54
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0005_workflowsteps_status'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='workflow',
+            index=models.Index(fields=['name', 'description'], name='workflow_dedupe_idx'),
+        ),
+    ]
@@ -0,0 +1,63 @@
+from django.db import migrations
+
+# Each indexed table maps to a kind; the rowid of a document is ``id * 3 + kind``
+# (see api.utils.search.KINDS).
+INDEXED_TABLES = (
+    # (table, kind, body column, workflow id column)
+    ('api_workflow', 0, 'description', 'id'),
+    ('api_workflowsteps', 1, 'description', 'workflow_id_id'),
+    ('api_comment', 2, 'text', 'workflow_id_id'),
+)
+
+STATEMENTS = (
+    """
+    CREATE TRIGGER {table}_search_ai AFTER INSERT ON {table} BEGIN
+        INSERT INTO api_search_index (rowid, name, body, workflow_id)
+        VALUES (new.id * 3 + {kind}, new.name, new.{body}, new.{workflow});
+    END
+    """,
+    """
+    CREATE TRIGGER {table}_search_au AFTER UPDATE OF name, {body} ON {table} BEGIN
+        UPDATE api_search_index SET name = new.name, body = new.{body} WHERE rowid = new.id * 3 + {kind};
+    END
+    """,
+    """
+    CREATE TRIGGER {table}_search_ad AFTER DELETE ON {table} BEGIN
+        DELETE FROM api_search_index WHERE rowid = old.id * 3 + {kind};
+    END
+    """,
+    """
+    INSERT INTO api_search_index (rowid, name, body, workflow_id)
+    SELECT id * 3 + {kind}, name, {body}, {workflow} FROM {table}
+    """,
+)
+
+
+def create_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    schema_editor.execute(
+        "CREATE VIRTUAL TABLE api_search_index USING fts5(name, body, workflow_id UNINDEXED)")
+    for table, kind, body, workflow in INDEXED_TABLES:
+        for statement in STATEMENTS:
+            schema_editor.execute(statement.format(table=table, kind=kind, body=body, workflow=workflow))
+
+
+def drop_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    for table, kind, body, workflow in INDEXED_TABLES:
+        for suffix in ('ai', 'au', 'ad'):
+            schema_editor.execute("DROP TRIGGER IF EXISTS {}_search_{}".format(table, suffix))
+    schema_editor.execute("DROP TABLE IF EXISTS api_search_index")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0007_keyset_indexes'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
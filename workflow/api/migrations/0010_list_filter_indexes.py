@@ -0,0 +1,37 @@
+# Generated by Django 3.0.5 on 2026-10-18 18:22
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0009_modified_at_indexes'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='comment',
+            index=models.Index(fields=['workflow_id', 'created_at'], name='comment_workflow_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='comment',
+            index=models.Index(fields=['archived', 'created_at'], name='comment_archived_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='comment',
+            index=models.Index(fields=['deleted', 'created_at'], name='comment_deleted_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='workflow',
+            index=models.Index(fields=['archived', 'created_at'], name='workflow_archived_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='workflow',
+            index=models.Index(fields=['deleted', 'created_at'], name='workflow_deleted_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='workflowsteps',
+            index=models.Index(fields=['status', 'workflow_id'], name='step_status_idx'),
+        ),
+    ]
@@ -0,0 +1,134 @@
+# Generated by Django 3.0.5 on 2026-10-18 18:24
+
+from django.db import migrations, models
+
+# Soft deleted rows leave the search index right away; the children of a soft deleted
+# workflow are filtered out at query time (see api.utils.search).
+INDEXED_TABLES = (
+    ('api_workflow', 0),
+    ('api_workflowsteps', 1),
+    ('api_comment', 2),
+)
+
+TRIGGER = """
+CREATE TRIGGER {table}_search_sd AFTER UPDATE OF deleted ON {table} WHEN new.deleted AND NOT old.deleted BEGIN
+    DELETE FROM api_search_index WHERE rowid = new.id * 3 + {kind};
+END
+"""
+
+
+def create_soft_delete_triggers(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    for table, kind in INDEXED_TABLES:
+        schema_editor.execute(TRIGGER.format(table=table, kind=kind))
+
+
+def drop_soft_delete_triggers(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    for table, kind in INDEXED_TABLES:
+        schema_editor.execute("DROP TRIGGER IF EXISTS {}_search_sd".format(table))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0010_list_filter_indexes'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='comment',
+            name='comment_keyset_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='comment',
+            name='comment_modified_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='comment',
+            name='comment_workflow_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='comment',
+            name='comment_archived_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='comment',
+            name='comment_deleted_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='workflow',
+            name='workflow_dedupe_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='workflow',
+            name='workflow_keyset_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='workflow',
+            name='workflow_modified_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='workflow',
+            name='workflow_archived_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='workflow',
+            name='workflow_deleted_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='workflowsteps',
+            name='step_status_idx',
+        ),
+        migrations.AddIndex(
+            model_name='comment',
+            index=models.Index(condition=models.Q(deleted=False), fields=['created_at', 'id'], name='comment_keyset_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='comment',
+            index=models.Index(condition=models.Q(deleted=False), fields=['modified_at'], name='comment_modified_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='comment',
+            index=models.Index(condition=models.Q(deleted=False), fields=['workflow_id', 'created_at'], name='comment_workflow_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='comment',
+            index=models.Index(condition=models.Q(deleted=False), fields=['archived', 'created_at'], name='comment_archived_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='comment',
+            index=models.Index(condition=models.Q(deleted=True), fields=['modified_at'], name='comment_tombstone_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='workflow',
+            index=models.Index(condition=models.Q(deleted=False), fields=['name', 'description'], name='workflow_dedupe_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='workflow',
+            index=models.Index(condition=models.Q(deleted=False), fields=['created_at', 'id'], name='workflow_keyset_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='workflow',
+            index=models.Index(condition=models.Q(deleted=False), fields=['modified_at'], name='workflow_modified_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='workflow',
+            index=models.Index(condition=models.Q(deleted=False), fields=['archived', 'created_at'], name='workflow_archived_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='workflow',
+            index=models.Index(condition=models.Q(deleted=True), fields=['modified_at'], name='workflow_tombstone_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='workflowsteps',
+            index=models.Index(condition=models.Q(deleted=False), fields=['status', 'workflow_id'], name='step_status_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='workflowsteps',
+            index=models.Index(condition=models.Q(deleted=True), fields=['modified_at'], name='step_tombstone_idx'),
+        ),
+        migrations.RunPython(create_soft_delete_triggers, drop_soft_delete_triggers),
+    ]
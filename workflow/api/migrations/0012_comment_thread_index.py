@@ -0,0 +1,17 @@
+# Generated by Django 3.0.5 on 2026-10-18 18:28
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0011_soft_delete'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='comment',
+            index=models.Index(condition=models.Q(deleted=False), fields=['workflow_id', 'id'], name='comment_thread_idx'),
+        ),
+    ]
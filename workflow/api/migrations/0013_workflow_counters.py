@@ -0,0 +1,54 @@
+# Generated by Django 3.0.5 on 2026-10-18 18:33
+
+from django.db import migrations, models
+
+COUNTERS = ('step_count', 'definition_step_count', 'active_step_count', 'retired_step_count', 'comment_count')
+
+# Count the rows written before the counters existed, as api.utils.counters.recount does.
+STATUS_COUNTERS = (
+    ('definition_step_count', 0),
+    ('active_step_count', 1),
+    ('retired_step_count', 2),
+)
+
+COUNT = "(SELECT COUNT(*) FROM {table} WHERE workflow_id_id = api_workflow.id AND deleted = 0{where})"
+
+
+def count_rows(apps, schema_editor):
+    counters = {counter: COUNT.format(table='api_workflowsteps', where=' AND status = %d' % status)
+                for counter, status in STATUS_COUNTERS}
+    counters['step_count'] = COUNT.format(table='api_workflowsteps', where='')
+    counters['comment_count'] = COUNT.format(table='api_comment', where='')
+    schema_editor.execute('UPDATE api_workflow SET {}'.format(
+        ', '.join('{} = {}'.format(counter, count) for counter, count in counters.items())))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0012_comment_thread_index'),
+    ]
+
+    # SQLite rebuilds a table to add a field, which would drop the search index triggers
+    # of api_workflow (see 0008_search_index); a column with a constant default is added
+    # in place instead.
+    operations = [
+        migrations.SeparateDatabaseAndState(
+            database_operations=[
+                migrations.RunSQL(
+                    'ALTER TABLE api_workflow ADD COLUMN {} integer DEFAULT 0 NOT NULL'.format(counter),
+                    'ALTER TABLE api_workflow DROP COLUMN {}'.format(counter),
+                )
+                for counter in COUNTERS
+            ],
+            state_operations=[
+                migrations.AddField(
+                    model_name='workflow',
+                    name=counter,
+                    field=models.IntegerField(default=0, editable=False),
+                )
+                for counter in COUNTERS
+            ],
+        ),
+        migrations.RunPython(count_rows, migrations.RunPython.noop),
+    ]
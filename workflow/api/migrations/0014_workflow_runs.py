@@ -0,0 +1,62 @@
+# Generated by Django 3.0.5 on 2026-10-18 19:10
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0013_workflow_counters'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='WorkflowRun',
+            fields=[
+                ('id', models.AutoField(primary_key=True, serialize=False)),
+                ('state', models.IntegerField(choices=[(0, 'Running'), (1, 'Succeeded'), (2, 'Failed')], default=0, verbose_name='State')),
+                ('steps_total', models.IntegerField(default=0, editable=False)),
+                ('steps_done', models.IntegerField(default=0, editable=False)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('finished_at', models.DateTimeField(blank=True, null=True)),
+                ('workflow_id', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='runs', to='api.Workflow')),
+            ],
+            options={
+                'verbose_name': 'WorkflowRun',
+                'verbose_name_plural': 'WorkflowRuns',
+                'ordering': ('id',),
+            },
+        ),
+        migrations.CreateModel(
+            name='StepRun',
+            fields=[
+                ('id', models.AutoField(primary_key=True, serialize=False)),
+                ('state', models.IntegerField(choices=[(0, 'Waiting'), (1, 'Ready'), (2, 'Claimed'), (3, 'Succeeded'), (4, 'Failed'), (5, 'Cancelled')], default=0, verbose_name='State')),
+                ('claim', models.CharField(blank=True, max_length=32, null=True)),
+                ('claimed_at', models.DateTimeField(blank=True, null=True)),
+                ('attempts', models.IntegerField(default=0)),
+                ('finished_at', models.DateTimeField(blank=True, null=True)),
+                ('error', models.TextField(blank=True, default='')),
+                ('run_id', models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='step_runs', to='api.WorkflowRun')),
+                ('step_id', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='runs', to='api.WorkflowSteps')),
+            ],
+            options={
+                'verbose_name': 'StepRun',
+                'verbose_name_plural': 'StepRuns',
+                'ordering': ('id',),
+            },
+        ),
+        migrations.AddIndex(
+            model_name='steprun',
+            index=models.Index(condition=models.Q(state=1), fields=['id'], name='steprun_ready_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='steprun',
+            index=models.Index(condition=models.Q(state=2), fields=['claimed_at'], name='steprun_claimed_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='steprun',
+            index=models.Index(fields=['run_id', 'state'], name='steprun_run_idx'),
+        ),
+    ]
@@ -0,0 +1,76 @@
+# Generated by Django 3.0.5 on 2026-10-18 19:34
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0014_workflow_runs'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StepDependency',
+            fields=[
+                ('id', models.AutoField(primary_key=True, serialize=False)),
+            ],
+            options={
+                'verbose_name': 'StepDependency',
+                'verbose_name_plural': 'StepDependencies',
+                'ordering': ('id',),
+            },
+        ),
+        migrations.CreateModel(
+            name='WorkflowGraph',
+            fields=[
+                ('id', models.AutoField(primary_key=True, serialize=False)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('data', models.TextField(editable=False)),
+            ],
+            options={
+                'verbose_name': 'WorkflowGraph',
+                'verbose_name_plural': 'WorkflowGraphs',
+                'ordering': ('id',),
+            },
+        ),
+        migrations.AddField(
+            model_name='steprun',
+            name='waiting_on',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddConstraint(
+            model_name='steprun',
+            constraint=models.UniqueConstraint(fields=('run_id', 'step_id'), name='steprun_step_unique'),
+        ),
+        migrations.AddField(
+            model_name='workflowgraph',
+            name='workflow_id',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='graphs', to='api.Workflow'),
+        ),
+        migrations.AddField(
+            model_name='stepdependency',
+            name='depends_on',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='dependents', to='api.WorkflowSteps'),
+        ),
+        migrations.AddField(
+            model_name='stepdependency',
+            name='step_id',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='dependencies', to='api.WorkflowSteps'),
+        ),
+        migrations.AddField(
+            model_name='stepdependency',
+            name='workflow_id',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='dependencies', to='api.Workflow'),
+        ),
+        migrations.AddField(
+            model_name='workflowrun',
+            name='graph_id',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.CASCADE, related_name='runs', to='api.WorkflowGraph'),
+        ),
+        migrations.AddConstraint(
+            model_name='stepdependency',
+            constraint=models.UniqueConstraint(fields=('step_id', 'depends_on'), name='step_dependency_unique'),
+        ),
+    ]
@@ -0,0 +1,27 @@
+# Generated by Django 3.0.5 on 2026-10-18 20:13
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0015_step_dependencies'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ImportProgress',
+            fields=[
+                ('id', models.AutoField(primary_key=True, serialize=False)),
+                ('path', models.CharField(max_length=1024, unique=True)),
+                ('position', models.IntegerField(default=0)),
+                ('modified_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'verbose_name': 'ImportProgress',
+                'verbose_name_plural': 'ImportProgresses',
+                'ordering': ('id',),
+            },
+        ),
+    ]
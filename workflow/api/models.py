@@ -1,7 +1,10 @@
 # -*- encoding: utf-8 -*-
 from __future__ import unicode_literals
 
-from django.db import models
+from django.conf import settings
+from django.db import models, transaction
+from django.utils import timezone
+from django.utils.functional import cached_property
 from django.utils.translation import ugettext_lazy as _
 from django.utils.encoding import smart_text as smart_unicode
 from shortuuidfield import ShortUUIDField
@@ -23,16 +26,131 @@ def normalize(query_string):
     return (normspace(' ', (t[0] or t[1]).strip()) for t in terms)
 
 
+# Indexes serving live rows only leave the tombstones out, see LiveManager.
+LIVE = models.Q(deleted=False)
+TOMBSTONE = models.Q(deleted=True)
+
+
+class SoftDeleteQuerySet(models.QuerySet):
+    """
+    QuerySet of models with the ``archived`` and ``deleted`` flags.
+
+    Bulk writes change the validators of the lists reading the table (see
+    api.utils.cache.invalidate_lists), as the signals do for the writes of instances.
+    """
+
+    def archived(self):
+        return self.filter(archived=True)
+
+    def unarchived(self):
+        return self.filter(archived=False)
+
+    def archive(self) -> int:
+        return self.update(archived=True, modified_at=timezone.now())
+
+    def unarchive(self) -> int:
+        return self.update(archived=False, modified_at=timezone.now())
+
+    def update(self, **kwargs) -> int:
+        from api.utils.cache import invalidate_lists
+        rows = super().update(**kwargs)
+        if rows:
+            invalidate_lists(self.model)
+        return rows
+
+    def bulk_create(self, objs, *args, **kwargs) -> list:
+        """
+        Insert the rows, adding the steps and comments to the counters of their workflows.
+        """
+        from api.utils.cache import invalidate_lists
+        if not issubclass(self.model, CountedModel):
+            objs = super().bulk_create(objs, *args, **kwargs)
+        else:
+            from api.utils.counters import count_instances
+            with transaction.atomic(savepoint=False):
+                objs = super().bulk_create(objs, *args, **kwargs)
+                count_instances(objs)
+        if objs:
+            invalidate_lists(self.model)
+        return objs
+
+    def bulk_update(self, objs, fields, *args, **kwargs):
+        """
+        Update the rows, moving the changed steps and comments between counters.
+
+        Only instances read from the database are counted again, see CountedModel.
+        """
+        if not issubclass(self.model, CountedModel) or {'deleted', *self.model.COUNTED_FIELDS}.isdisjoint(fields):
+            return super().bulk_update(objs, fields, *args, **kwargs)
+
+        from api.utils.counters import count_changes
+        objs = list(objs)
+        with transaction.atomic(savepoint=False):
+            super().bulk_update(objs, fields, *args, **kwargs)
+            count_changes(objs)
+
+    def delete(self):
+        if not issubclass(self.model, Workflow):
+            return super().delete()
+
+        from api.utils.counters import deleting_workflows
+        with deleting_workflows(self.values_list('id', flat=True)):
+            return super().delete()
+
+    def soft_delete(self) -> int:
+        """
+        Flag the rows as deleted with a single UPDATE, whatever the number of their children.
+
+        The rows are hidden by LiveManager right away and physically removed later, in
+        batches, by the purge_deleted command. Signals are not sent, the counters of the
+        workflows of flagged steps or comments are decremented (see CountedModel).
+        Returns:
+            int: Number of flagged rows
+        """
+        if not issubclass(self.model, CountedModel):
+            return self.update(deleted=True, modified_at=timezone.now())
+
+        from api.utils.counters import count_rows
+        live = self.filter(deleted=False)
+        with transaction.atomic(savepoint=False):
+            rows = list(live.select_for_update().values_list(*self.model.COUNTED_FIELDS))
+            flagged = live.update(deleted=True, modified_at=timezone.now())
+            count_rows(self.model, rows, -1)
+        return flagged
+
+
+class LiveManager(models.Manager.from_queryset(SoftDeleteQuerySet)):
+    """
+    Default manager hiding soft deleted rows.
+
+    Attributes:
+        parent (str): Foreign key to a soft deletable model, whose deleted rows hide their
+            children too, so that deleting a workflow is a single UPDATE
+    """
+
+    def __init__(self, parent: str = None):
+        super().__init__()
+        self.parent = parent
+
+    def get_queryset(self) -> SoftDeleteQuerySet:
+        queryset = super().get_queryset().filter(deleted=False)
+        if self.parent is not None:
+            queryset = queryset.filter(**{self.parent + '__deleted': False})
+        return queryset
+
+
 class BaseModel(models.Model):
     """
     Abstract model with for all models in our application.
 
+    ``objects`` hides the rows flagged as deleted, ``all_objects`` includes them.
+
     Attributes:
         created_at (DateTime): Description
         modified_at (DateTime): Description
         uuid (ShortUUID): Description
         archived (Boolean): Description
-        deleted (Boolean): Description
+        deleted (Boolean): Soft deleted, waiting to be purged
     """
     created_at = models.DateTimeField(_("Date Created"), auto_now_add=True)
     modified_at = models.DateTimeField(_("Date Modified"), auto_now=True)
@@ -40,6 +158,9 @@ class BaseModel(models.Model):
     archived = models.BooleanField(default=False)
     deleted = models.BooleanField(default=False)
 
+    objects = LiveManager()
+    all_objects = models.Manager.from_queryset(SoftDeleteQuerySet)()
+
     class Meta:
         """Summary
 
@@ -52,20 +173,85 @@ class BaseModel(models.Model):
     def created_on_arrow(self):
         return arrow.get(self.created_at).humanize()
 
+    def soft_delete(self):
+        """
+        Flag the instance as deleted with a single UPDATE, see SoftDeleteQuerySet.soft_delete.
+        """
+        self.deleted = True
+        self.save(update_fields=['deleted', 'modified_at'])
+
     @classmethod
     def search(cls, query_string):
         """
-        Searches the model table for words similar to the query string
+        Searches the model table for rows containing every word of the query string
 
         Args:
-            query_string (TYPE): Description
+            query_string (str): Words and "quoted phrases" to look for
         Returns:
-            TYPE: Description
+            QuerySet: The matching rows, oldest first
         """
-        query_terms = normalize(query_string)
-        for word in query_terms:
-            query_object = models.Q(**{"name__icontains": word})
-            return cls.objects.filter(query_object).order_by('date_created')
+        from api.utils.search import search_queryset
+        return search_queryset(cls, query_string)
+
+
+class CountedModel(BaseModel):
+    """
+    Abstract model of the rows counted on their workflow, see api.utils.counters.
+
+    The counted columns of an instance read from the database are remembered as
+    ``counted_row``, so that saving it only counts the difference. Instances read
+    without these columns (``only()``, ``defer()``) are not counted again when saved.
+
+    Attributes:
+        COUNTED_FIELDS (tuple): Fields selecting the counters of a row, the workflow first
+    """
+    COUNTED_FIELDS = ('workflow_id',)
+
+    class Meta:
+        abstract = True
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        if set(cls.counted_attnames()) <= set(field_names) and 'deleted' in field_names:
+            instance.counted_row = instance.get_counted_row()
+        return instance
+
+    @classmethod
+    def counted_attnames(cls) -> tuple:
+        return tuple(cls._meta.get_field(name).attname for name in cls.COUNTED_FIELDS)
+
+    @classmethod
+    def counters(cls, row: tuple) -> tuple:
+        """
+        Return the counters of the workflow that a row adds to.
+        Args:
+            row (tuple): Values of COUNTED_FIELDS
+        Returns:
+            tuple: Names of Workflow counter fields
+        """
+        raise NotImplementedError
+
+    def save(self, *args, **kwargs):
+        """
+        Save the instance and count it, or the change of its counted fields, on its workflow.
+        """
+        from api.utils.counters import count_changes, count_instances
+        created, update_fields = self._state.adding, kwargs.get('update_fields')
+        with transaction.atomic(savepoint=False):
+            super().save(*args, **kwargs)
+            if created:
+                count_instances([self])
+            elif update_fields is None or not {'deleted', *self.COUNTED_FIELDS}.isdisjoint(update_fields):
+                count_changes([self])
+
+    def get_counted_row(self) -> tuple:
+        """
+        Return the values of COUNTED_FIELDS, None when the instance is deleted and not counted.
+        """
+        if self.deleted:
+            return None
+        return tuple(getattr(self, attname) for attname in self.counted_attnames())
 
 
 class Workflow(BaseModel):
@@ -84,11 +270,39 @@ class Workflow(BaseModel):
     id = models.AutoField(primary_key=True)
     name = models.CharField(_("Name"), blank=False, null=False, max_length=150)
     description = models.TextField(_("Description"), blank=False, null=False, max_length=350)
+    # Live steps and comments, maintained by api.utils.counters.
+    step_count = models.IntegerField(default=0, editable=False)
+    definition_step_count = models.IntegerField(default=0, editable=False)
+    active_step_count = models.IntegerField(default=0, editable=False)
+    retired_step_count = models.IntegerField(default=0, editable=False)
+    comment_count = models.IntegerField(default=0, editable=False)
+
+    COUNTERS = ('step_count', 'definition_step_count', 'active_step_count', 'retired_step_count', 'comment_count')
+
+    # Posting a workflow whose name and description match an existing one
+    # appends the steps to that workflow instead of creating a duplicate.
+    # The match is looked up before the insert, in the same transaction, and is not a
+    # unique constraint: imports (api.utils.importer) keep duplicates on purpose. On
+    # SQLite a single transaction writes at a time, so two concurrent posts can't both
+    # insert: with IMMEDIATE_TRANSACTIONS the second one waits for the first and finds
+    # its workflow, otherwise it fails with "database is locked". On databases with
+    # concurrent writers, e.g. PostgreSQL, the deduplication is best-effort.
+    DEDUPE_FIELDS = ('name', 'description')
 
     class Meta:
         verbose_name = _("Workflow")
         verbose_name_plural = _("Workflows")
         ordering = ('id',)
+        indexes = [
+            # Lookup of DEDUPE_FIELDS, not unique.
+            models.Index(fields=['name', 'description'], name='workflow_dedupe_idx', condition=LIVE),
+            models.Index(fields=['created_at', 'id'], name='workflow_keyset_idx', condition=LIVE),
+            models.Index(fields=['modified_at'], name='workflow_modified_idx', condition=LIVE),
+            # Filters of the list endpoint, ending with the list order (the id is implied).
+            models.Index(fields=['archived', 'created_at'], name='workflow_archived_idx', condition=LIVE),
+            # Tombstones waiting to be purged, oldest first.
+            models.Index(fields=['modified_at'], name='workflow_tombstone_idx', condition=TOMBSTONE),
+        ]
 
     def __unicode__(self) -> str:
         """
@@ -106,8 +320,47 @@ class Workflow(BaseModel):
         """
         return "{}".format(self.name)
 
+    def save(self, *args, **kwargs):
+        """
+        Save the workflow, leaving the counters out of the UPDATE of an existing row.
+
+        The counters are only changed by adding deltas in the database, an instance read
+        before a step or comment was added must not write back its stale counts.
+        """
+        if not self._state.adding and kwargs.get('update_fields') is None and not kwargs.get('force_insert'):
+            kwargs['update_fields'] = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key and field.name not in self.COUNTERS and
+                field.attname not in self.get_deferred_fields()]
+        super().save(*args, **kwargs)
+
+    def delete(self, *args, **kwargs):
+        from api.utils.counters import deleting_workflows
+        with deleting_workflows([self.pk]):
+            return super().delete(*args, **kwargs)
+
+    @cached_property
+    def latest_comments(self) -> list:
+        """
+        Return the latest comments of the workflow, newest first.
+        Returns:
+            list: At most settings.WORKFLOW_DETAIL_COMMENTS comments
+        """
+        return list(self.comments.only('id', 'workflow_id', 'name', 'text', 'created_at').order_by('-id')[
+            :settings.WORKFLOW_DETAIL_COMMENTS])
+
+    @cached_property
+    def graph(self):
+        """
+        Return the dependencies of the live steps of the workflow, from its latest stored graph.
+        Returns:
+            StepGraph: The steps in id order, their dependencies and topological levels
+        """
+        from api.utils.graph import load_graph
+        return load_graph(self)
+
 
-class WorkflowSteps(BaseModel):
+class WorkflowSteps(CountedModel):
     """
     Model the workflowstep interface
 
@@ -133,6 +386,13 @@ class WorkflowSteps(BaseModel):
         (ACTIVE, _('Active')),
         (RETIRED, _('Retired')),
     )
+    # Workflow counter of the steps with each status.
+    STATUS_COUNTERS = {
+        DEFINITION: 'definition_step_count',
+        ACTIVE: 'active_step_count',
+        RETIRED: 'retired_step_count',
+    }
+    COUNTED_FIELDS = ('workflow_id', 'status')
 
     id = models.AutoField(primary_key=True)
     workflow_id = models.ForeignKey(Workflow, on_delete=models.CASCADE, related_name='steps')
@@ -140,10 +400,17 @@ class WorkflowSteps(BaseModel):
     description = models.TextField(blank=False, null=False, max_length=350)
     status = models.IntegerField(_('Status'), choices=STATUS_CHOICE_LIST, default=DEFINITION)
 
+    objects = LiveManager(parent='workflow_id')
+
     class Meta:
         verbose_name = _("WorkflowStep")
         verbose_name_plural = _("WorkflowSteps")
         ordering = ('id',)
+        indexes = [
+            # Workflows having a step with a given status.
+            models.Index(fields=['status', 'workflow_id'], name='step_status_idx', condition=LIVE),
+            models.Index(fields=['modified_at'], name='step_tombstone_idx', condition=TOMBSTONE),
+        ]
 
     def __unicode__(self) -> str:
         """
@@ -164,8 +431,12 @@ class WorkflowSteps(BaseModel):
     def get_status_display(self, status_code) -> str:
         return self.STATUS_CHOICE_LIST[status_code]
 
+    @classmethod
+    def counters(cls, row: tuple) -> tuple:
+        return 'step_count', cls.STATUS_COUNTERS[row[1]]
+
 
-class Comment(BaseModel):
+class Comment(CountedModel):
     """
     Model the comment interface
 
@@ -185,10 +456,22 @@ class Comment(BaseModel):
     name = models.CharField(blank=False, null=False, max_length=150)
     text = models.TextField(blank=False, null=False, max_length=350)
 
+    objects = LiveManager(parent='workflow_id')
+
     class Meta:
         verbose_name = _("Comment")
         verbose_name_plural = _("Comments")
         ordering = ('id',)
+        indexes = [
+            models.Index(fields=['created_at', 'id'], name='comment_keyset_idx', condition=LIVE),
+            models.Index(fields=['modified_at'], name='comment_modified_idx', condition=LIVE),
+            # Filters of the list endpoint, ending with the list order (the id is implied).
+            models.Index(fields=['workflow_id', 'created_at'], name='comment_workflow_idx', condition=LIVE),
+            # Comments of a workflow, newest first.
+            models.Index(fields=['workflow_id', 'id'], name='comment_thread_idx', condition=LIVE),
+            models.Index(fields=['archived', 'created_at'], name='comment_archived_idx', condition=LIVE),
+            models.Index(fields=['modified_at'], name='comment_tombstone_idx', condition=TOMBSTONE),
+        ]
 
     def __unicode__(self) -> str:
         """
@@ -205,3 +488,229 @@ class Comment(BaseModel):
             string: The name of workflow
         """
         return self.name
+
+    @classmethod
+    def counters(cls, row: tuple) -> tuple:
+        return 'comment_count',
+
+
+class StepDependency(models.Model):
+    """
+    Model a dependency between two steps of a workflow
+
+    Parameters
+    ----------
+        id: integer
+            An unique identifier for the dependency
+        workflow_id: integer
+            Refers to the instance of workflow of both steps.
+        step_id: integer
+            Refers to the instance of workflowstep waiting for the other one.
+        depends_on: integer
+            Refers to the instance of workflowstep to run first.
+    """
+    id = models.AutoField(primary_key=True)
+    workflow_id = models.ForeignKey(Workflow, on_delete=models.CASCADE, related_name='dependencies')
+    step_id = models.ForeignKey(WorkflowSteps, on_delete=models.CASCADE, related_name='dependencies')
+    depends_on = models.ForeignKey(WorkflowSteps, on_delete=models.CASCADE, related_name='dependents')
+
+    class Meta:
+        verbose_name = _("StepDependency")
+        verbose_name_plural = _("StepDependencies")
+        ordering = ('id',)
+        constraints = [
+            models.UniqueConstraint(fields=['step_id', 'depends_on'], name='step_dependency_unique'),
+        ]
+
+
+class WorkflowGraph(models.Model):
+    """
+    Model the dependencies of the steps of a workflow, precomputed by api.utils.graph
+
+    A graph is never changed: changing the dependencies of a workflow stores a new one, the
+    latest being current. Runs keep the graph they started with.
+
+    Parameters
+    ----------
+        id: integer
+            An unique identifier for the graph
+        workflow_id: integer
+            Refers to an instance of workflow.
+        data: string
+            The steps, their dependents and topological levels, in JSON.
+    """
+    id = models.AutoField(primary_key=True)
+    workflow_id = models.ForeignKey(Workflow, on_delete=models.CASCADE, related_name='graphs')
+    created_at = models.DateTimeField(auto_now_add=True)
+    data = models.TextField(editable=False)
+
+    class Meta:
+        verbose_name = _("WorkflowGraph")
+        verbose_name_plural = _("WorkflowGraphs")
+        ordering = ('id',)
+
+
+class WorkflowRun(models.Model):
+    """
+    Model a run of a workflow, executed by the workers of api.utils.scheduler
+
+    Parameters
+    ----------
+        id: integer
+            An unique identifier for the run
+        workflow_id: integer
+            Refers to the instance of workflow run.
+        state: integer
+            State of the run.
+        steps_total: integer
+            Number of steps to run,
+        steps_done: integer
+            Number of steps that succeeded.
+        graph_id: integer
+            Refers to the instance of workflowgraph run.
+    """
+    RUNNING = 0
+    SUCCEEDED = 1
+    FAILED = 2
+
+    STATE_CHOICE_LIST = (
+        (RUNNING, _('Running')),
+        (SUCCEEDED, _('Succeeded')),
+        (FAILED, _('Failed')),
+    )
+
+    id = models.AutoField(primary_key=True)
+    workflow_id = models.ForeignKey(Workflow, on_delete=models.CASCADE, related_name='runs')
+    state = models.IntegerField(_('State'), choices=STATE_CHOICE_LIST, default=RUNNING)
+    steps_total = models.IntegerField(default=0, editable=False)
+    steps_done = models.IntegerField(default=0, editable=False)
+    graph_id = models.ForeignKey(WorkflowGraph, on_delete=models.CASCADE, related_name='runs', null=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        verbose_name = _("WorkflowRun")
+        verbose_name_plural = _("WorkflowRuns")
+        ordering = ('id',)
+
+    def __str__(self) -> str:
+        return "{} #{}".format(self.workflow_id_id, self.id)
+
+
+class StepRunState:
+    """
+    States of a step run, defined before StepRun for the conditions of its partial indexes.
+    """
+    WAITING = 0
+    READY = 1
+    CLAIMED = 2
+    SUCCEEDED = 3
+    FAILED = 4
+    CANCELLED = 5
+
+    CHOICE_LIST = (
+        (WAITING, _('Waiting')),
+        (READY, _('Ready')),
+        (CLAIMED, _('Claimed')),
+        (SUCCEEDED, _('Succeeded')),
+        (FAILED, _('Failed')),
+        (CANCELLED, _('Cancelled')),
+    )
+
+
+# The queue of the scheduler: the step runs waiting for a worker (StepRun.READY) and
+# those claimed by one (StepRun.CLAIMED), each in a partial index of its own.
+READY_STEP = models.Q(state=StepRunState.READY)
+CLAIMED_STEP = models.Q(state=StepRunState.CLAIMED)
+
+
+class StepRun(models.Model):
+    """
+    Model the run of a step within a workflow run
+
+    Parameters
+    ----------
+        id: integer
+            An unique identifier for the step run
+        run_id: integer
+            Refers to an instance of workflow run.
+        step_id: integer
+            Refers to the instance of workflowstep run.
+        state: integer
+            State of the step run, see StepRunState.
+        claim: string
+            Token of the batch of the worker running the step.
+        attempts: integer
+            Number of times the step was claimed.
+        waiting_on: integer
+            Number of dependencies of the step left to run.
+    """
+    WAITING = StepRunState.WAITING
+    READY = StepRunState.READY
+    CLAIMED = StepRunState.CLAIMED
+    SUCCEEDED = StepRunState.SUCCEEDED
+    FAILED = StepRunState.FAILED
+    CANCELLED = StepRunState.CANCELLED
+
+    STATE_CHOICE_LIST = StepRunState.CHOICE_LIST
+
+    id = models.AutoField(primary_key=True)
+    # Indexed with the state below.
+    run_id = models.ForeignKey(WorkflowRun, on_delete=models.CASCADE, related_name='step_runs', db_index=False)
+    step_id = models.ForeignKey(WorkflowSteps, on_delete=models.CASCADE, related_name='runs')
+    state = models.IntegerField(_('State'), choices=STATE_CHOICE_LIST, default=WAITING)
+    claim = models.CharField(max_length=32, null=True, blank=True)
+    claimed_at = models.DateTimeField(null=True, blank=True)
+    attempts = models.IntegerField(default=0)
+    waiting_on = models.IntegerField(default=0)
+    finished_at = models.DateTimeField(null=True, blank=True)
+    error = models.TextField(blank=True, default='')
+
+    class Meta:
+        verbose_name = _("StepRun")
+        verbose_name_plural = _("StepRuns")
+        ordering = ('id',)
+        indexes = [
+            # Oldest ready steps first.
+            models.Index(fields=['id'], name='steprun_ready_idx', condition=READY_STEP),
+            # Claims expired, e.g. by a killed worker.
+            models.Index(fields=['claimed_at'], name='steprun_claimed_idx', condition=CLAIMED_STEP),
+            models.Index(fields=['run_id', 'state'], name='steprun_run_idx'),
+        ]
+        constraints = [
+            # Step runs depending on a step, found by their step.
+            models.UniqueConstraint(fields=['run_id', 'step_id'], name='steprun_step_unique'),
+        ]
+
+    def __str__(self) -> str:
+        return "{} #{}".format(self.step_id_id, self.id)
+
+
+class ImportProgress(models.Model):
+    """
+    Model the progress of an import of workflows, see api.utils.importer
+
+    The position is saved in the transaction of each chunk, so that an interrupted
+    import resumes right after the last committed chunk.
+
+    Parameters
+    ----------
+        id: integer
+            An unique identifier for the import
+        path: string
+            Absolute path of the imported file.
+        position: integer
+            Number of records imported or rejected so far.
+    """
+    id = models.AutoField(primary_key=True)
+    path = models.CharField(max_length=1024, unique=True)
+    position = models.IntegerField(default=0)
+    modified_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        verbose_name = _("ImportProgress")
+        verbose_name_plural = _("ImportProgresses")
+        ordering = ('id',)
+
+    def __str__(self) -> str:
+        return "{} @{}".format(self.path, self.position)
@@ -1,8 +1,31 @@
+from django.db import transaction
 from django.http import Http404
+from django.utils import timezone
 from rest_framework import serializers
 from rest_framework.status import HTTP_400_BAD_REQUEST
 
-from api.models import Workflow, WorkflowSteps, Comment
+from api.models import Workflow, WorkflowSteps, Comment, WorkflowRun
+from api.serializers.values import ValuesSerializer
+from api.utils.graph import CycleError, StepGraph, add_dependencies, saved_ids
+
+
+def without_dependencies(item: dict) -> dict:
+    """
+    Return the fields of a validated step dict that are columns of WorkflowSteps.
+    """
+    return {field: value for field, value in item.items() if field != 'depends_on'}
+
+
+class SparseFieldsMixin:
+    """
+    Let a serializer render a subset of its fields, given with the ``fields`` keyword argument.
+    """
+
+    def __init__(self, *args, fields: tuple = None, **kwargs):
+        super().__init__(*args, **kwargs)
+        if fields is not None:
+            for name in set(self.fields) - set(fields):
+                self.fields.pop(name)
 
 
 # https://www.django-rest-framework.org/api-guide/relations/#nested-relationships
@@ -12,16 +35,18 @@ class WorkflowStepSerializer(serializers.ModelSerializer):
     """
     id = serializers.IntegerField(required=False)
     status = serializers.SerializerMethodField()
+    # Positions, in the list of steps sent, of the steps to run before this one.
+    depends_on = serializers.ListField(child=serializers.IntegerField(min_value=0), required=False, write_only=True)
 
     class Meta:
         model = WorkflowSteps
-        fields = ('id', 'name', 'description', 'status')
+        fields = ('id', 'name', 'description', 'status', 'depends_on')
 
     def get_status(self, instance):
         return WorkflowSteps.STATUS_CHOICE_LIST[instance.status][1]
 
 
-class CommentSerializer(serializers.ModelSerializer):
+class CommentSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     """
     Create Comment model serializer to control fields, add new item and update item.
     """
@@ -90,15 +115,45 @@ class WorkflowSerializer(serializers.ModelSerializer):
         model = Workflow
         fields = ['name', 'description', 'steps']
 
+    def validate_steps(self, steps: list) -> list:
+        """
+        :param steps: List of validated step dicts.
+        :return: The steps, once their dependencies are checked to be other steps of the list, without cycle.
+        """
+        edges = []
+        for position, item in enumerate(steps):
+            for parent in item.get('depends_on', ()):
+                if parent >= len(steps) or parent == position:
+                    raise serializers.ValidationError(
+                        'Step %d depends on %d, which is not another step of the list.' % (position, parent))
+                edges.append((position, parent))
+        if edges:
+            try:
+                StepGraph.build(range(len(steps)), edges)
+            except CycleError as exc:
+                raise serializers.ValidationError(str(exc))
+        return steps
+
     def create(self, validated_data: dict) -> Workflow:
         """
         :param validated_data: Type dict
-        :return: Create an instance of Workflow Model
+        :return: Create an instance of Workflow Model, or append the steps to the live workflow with the same
+            Workflow.DEDUPE_FIELDS, a best-effort match on databases with concurrent writers.
         """
         steps_data = validated_data.pop('steps')
-        workflow, created = Workflow.objects.get_or_create(**validated_data)
-        for item in steps_data:
-            WorkflowSteps.objects.create(workflow_id=workflow, **item)
+        lookup = {field: validated_data[field] for field in Workflow.DEDUPE_FIELDS}
+        with transaction.atomic():
+            workflow = Workflow.objects.filter(**lookup).first()
+            if workflow is None:
+                workflow = Workflow.objects.create(**validated_data)
+            else:
+                # The steps are appended to the existing workflow, which changes it.
+                workflow.save(update_fields=['modified_at'])
+            created = WorkflowSteps.objects.bulk_create(
+                WorkflowSteps(workflow_id=workflow, **without_dependencies(item)) for item in steps_data
+            )
+            if any(item.get('depends_on') for item in steps_data):
+                add_dependencies(workflow.id, saved_ids(created), steps_data)
 
         return workflow
 
@@ -108,45 +163,88 @@ class WorkflowSerializer(serializers.ModelSerializer):
         :param validated_data: Dict type
         :return: An instance of Workflow Model.
         """
-        instance.name = validated_data.get('name', instance.name)
-        instance.description = validated_data.get('description', instance.description)
-        instance.save()
+        with transaction.atomic():
+            instance.name = validated_data.get('name', instance.name)
+            instance.description = validated_data.get('description', instance.description)
+            instance.save()
 
-        steps = validated_data.get('steps')
-        workflowSteps = WorkflowSteps.objects.filter(workflow_id=instance)
-
-        workflowSteps_ids = [WorkflowSteps.objects.get(id=x.id).id for x in workflowSteps]
-        steps_ids = [x.get('id') for x in steps]
-        if set(steps_ids) == set(workflowSteps_ids):
-            for item in steps:
-                _id = item.get('id', None)
-                if _id:
-                    try:
-                        step_item = WorkflowSteps.objects.get(id=_id, workflow_id=instance)
-                        step_item.name = item.get('name', step_item.name)
-                        step_item.description = item.get('description', step_item.description)
-                        step_item.save()
-                    except WorkflowSteps.DoesNotExist:
-                        raise Http404("WorkflowSteps does not exist.")
-                else:
-                    WorkflowSteps.objects.create(workflow_id=instance, **item)
+            steps = validated_data.get('steps')
+            if steps is not None:
+                self.reconcile_steps(instance, steps)
 
         return instance
 
+    def reconcile_steps(self, instance: Workflow, steps: list):
+        """
+        Make the steps of a workflow match the given list with a constant number of queries.
 
-class WorkflowItemSerializer(serializers.ModelSerializer):
+        Steps with an id are updated, steps without one are created and existing steps
+        missing from the list are soft deleted. The dependencies of the list replace those of the
+        workflow.
+        :param instance: The Workflow owning the steps.
+        :param steps: List of validated step dicts.
+        """
+        existing = {step.id: step for step in WorkflowSteps.objects.filter(workflow_id=instance).only(
+            'id', 'workflow_id', 'name', 'description', 'status', 'deleted')}
+        if any(item.get('id') and item['id'] not in existing for item in steps):
+            raise Http404("WorkflowSteps does not exist.")
+
+        now = timezone.now()
+        kept, to_create, to_update, changed_fields = set(), [], [], set()
+        for item in steps:
+            item = without_dependencies(item)
+            _id = item.pop('id', None)
+            if not _id:
+                to_create.append(WorkflowSteps(workflow_id=instance, **item))
+                continue
+            step = existing[_id]
+            kept.add(_id)
+            changed = {field for field, value in item.items() if getattr(step, field) != value}
+            if changed:
+                for field in changed:
+                    setattr(step, field, item[field])
+                step.modified_at = now
+                changed_fields |= changed
+                to_update.append(step)
+
+        if to_create:
+            WorkflowSteps.objects.bulk_create(to_create)
+        if to_update:
+            WorkflowSteps.objects.bulk_update(to_update, sorted(changed_fields) + ['modified_at'])
+        stale = existing.keys() - kept
+        if stale:
+            WorkflowSteps.objects.filter(id__in=stale).soft_delete()
+
+        ids = []
+        if any(item.get('depends_on') for item in steps):
+            created = iter(saved_ids(to_create))
+            ids = [item.get('id') or next(created) for item in steps]
+        add_dependencies(instance.id, ids, steps, replace=True)
+
+
+class WorkflowItemSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     """
     Create Workflow model serializer to control fields, add new item and update item.
     """
     steps = WorkflowStepSerializer(many=True)
-    comments = CommentItemSerializer(many=True)
+    # Only the latest comments, newest first; every comment is listed by WorkflowCommentList.
+    comments = CommentItemSerializer(many=True, source='latest_comments')
+    comments_count = serializers.IntegerField(source='comment_count', read_only=True)
+    # Dependencies of the steps, as positions in ``steps``: those each step depends on, and
+    # the topological levels, the steps of a level running in parallel once the levels
+    # before it are done.
+    graph = serializers.SerializerMethodField()
 
     class Meta:
         error_status_codes = {
             HTTP_400_BAD_REQUEST: 'Bad Request'
         }
         model = Workflow
-        fields = ['name', 'description', 'steps', 'comments']
+        fields = ['name', 'description', 'steps', 'comments', 'comments_count', 'graph']
+
+    def get_graph(self, instance: Workflow) -> dict:
+        graph = instance.graph
+        return {'depends_on': graph.parents, 'levels': graph.level_sets()}
 
 
 class WorkflowListSerializer(serializers.ModelSerializer):
@@ -159,4 +257,34 @@ class WorkflowListSerializer(serializers.ModelSerializer):
             HTTP_400_BAD_REQUEST: 'Bad Request'
         }
         model = Workflow
-        fields = ['id', 'name', 'description', 'created_at']
+        fields = ['id', 'name', 'description', 'created_at', 'step_count', 'definition_step_count',
+                  'active_step_count', 'retired_step_count', 'comment_count']
+
+
+class WorkflowRunSerializer(serializers.ModelSerializer):
+    """
+    Create WorkflowRun model serializer to show the progress of a run.
+    """
+    state = serializers.SerializerMethodField()
+
+    class Meta:
+        model = WorkflowRun
+        fields = ('id', 'state', 'steps_total', 'steps_done', 'created_at', 'finished_at')
+
+    def get_state(self, instance):
+        return WorkflowRun.STATE_CHOICE_LIST[instance.state][1]
+
+
+class SearchResultSerializer(serializers.Serializer):
+    """
+    Serialize a full-text search hit.
+    """
+    kind = serializers.CharField()
+    id = serializers.IntegerField()
+    workflow_id = serializers.IntegerField()
+    name = serializers.CharField()
+    rank = serializers.FloatField()
+
+
+workflow_list_values = ValuesSerializer(WorkflowListSerializer)
+comment_list_values = ValuesSerializer(CommentListSerializer)
@@ -0,0 +1,112 @@
+from django.core.exceptions import ImproperlyConfigured
+from django.utils import timezone
+from django.utils.functional import cached_property
+from rest_framework import ISO_8601, serializers
+from rest_framework.settings import api_settings
+
+
+def datetime_converter(field: serializers.DateTimeField):
+    """
+    Return a function with the output of ``field.to_representation``, the output format
+    and timezone being resolved once instead of for every value.
+    """
+    output_format = getattr(field, 'format', api_settings.DATETIME_FORMAT)
+    field_timezone = getattr(field, 'timezone', field.default_timezone())
+    if output_format is None or output_format.lower() != ISO_8601 or field_timezone is None:
+        return field.to_representation
+
+    def convert(value):
+        if isinstance(value, str) or timezone.is_naive(value):
+            return field.to_representation(value)
+        try:
+            value = value.astimezone(field_timezone).isoformat()
+        except OverflowError:
+            return field.to_representation(value)
+        return value[:-6] + 'Z' if value.endswith('+00:00') else value
+
+    return convert
+
+
+class ValuesSerializer:
+    """
+    Fast read path for flat, read-only list serializers.
+
+    Rows are read with ``QuerySet.values()`` for exactly the fields of the serializer and
+    only the fields whose representation differs from the database value go through a
+    converter, built from the serializer field for each page. The output is the same
+    as ``serializer_class(queryset, many=True).data`` without building model instances
+    nor walking DRF's fields per row.
+
+    Supported fields are plain model fields serialized as CharField, IntegerField or
+    DateTimeField, and foreign keys serialized as their primary key.
+    """
+    IDENTITY_FIELDS = (serializers.CharField, serializers.IntegerField)
+
+    def __init__(self, serializer_class, names: tuple = None):
+        self.serializer_class = serializer_class
+        self.names = names
+        self.narrowed = {}
+
+    @cached_property
+    def fields(self) -> dict:
+        fields = self.serializer_class().fields
+        if self.names is None:
+            return fields
+        return {name: fields[name] for name in self.names}
+
+    def narrow(self, names: tuple) -> 'ValuesSerializer':
+        """
+        Return the fast path for a subset of the fields, None standing for every field.
+
+        The narrowed serializers are kept, so their converters are only built once.
+        """
+        if names is None or names == tuple(self.fields):
+            return self
+        try:
+            return self.narrowed[names]
+        except KeyError:
+            return self.narrowed.setdefault(names, ValuesSerializer(self.serializer_class, names))
+
+    @cached_property
+    def converters(self) -> tuple:
+        converters = []
+        for name, field in self.fields.items():
+            if field.source != name:
+                raise ImproperlyConfigured("%s.%s: fields with a source are not supported." % (
+                    self.serializer_class.__name__, name))
+            if isinstance(field, serializers.DateTimeField):
+                converters.append((name, datetime_converter))
+            elif isinstance(field, serializers.PrimaryKeyRelatedField) and field.pk_field is None:
+                continue
+            elif type(field) in self.IDENTITY_FIELDS:
+                continue
+            else:
+                raise ImproperlyConfigured("%s.%s: %s is not supported." % (
+                    self.serializer_class.__name__, name, type(field).__name__))
+        return tuple(converters)
+
+    def values(self, queryset, extra: tuple = ()):
+        """
+        Narrow a queryset to the dicts of the serialized fields.
+
+        ``extra`` columns, such as the key of a keyset pagination, are read as well and
+        dropped by to_representation().
+        """
+        return queryset.values(*self.fields, *(name for name in dict.fromkeys(extra) if name not in self.fields))
+
+    def to_representation(self, rows) -> list:
+        """
+        Convert the dicts read by values() in place and return them as a list.
+        """
+        rows = list(rows)
+        extra = rows[0].keys() - self.fields.keys() if rows else ()
+        for name in extra:
+            for row in rows:
+                del row[name]
+        for name, make_converter in self.converters:
+            convert = make_converter(self.fields[name])
+            for row in rows:
+                value = row[name]
+                if value is not None:
+                    row[name] = convert(value)
+        return rows
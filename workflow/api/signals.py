@@ -0,0 +1,37 @@
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+
+from api.models import Workflow, WorkflowSteps, Comment
+from api.utils.cache import invalidate_detail, invalidate_lists
+from api.utils.counters import count_rows, is_deleting
+
+
+@receiver([post_save, post_delete], sender=Workflow)
+def invalidate_workflow(sender, instance: Workflow, **kwargs):
+    """
+    Drop the cached detail of a saved or deleted workflow and change the list validators.
+    """
+    invalidate_detail(instance.pk)
+    invalidate_lists(sender)
+
+
+@receiver([post_save, post_delete], sender=WorkflowSteps)
+@receiver([post_save, post_delete], sender=Comment)
+def invalidate_parent_workflow(sender, instance, **kwargs):
+    """
+    Drop the cached detail of the workflow of a saved or deleted step or comment and change
+    the list validators.
+    """
+    invalidate_detail(instance.workflow_id_id)
+    invalidate_lists(sender)
+
+
+@receiver(post_delete, sender=WorkflowSteps)
+@receiver(post_delete, sender=Comment)
+def uncount_deleted(sender, instance, **kwargs):
+    """
+    Remove a deleted step or comment from the counters of its workflow, unless it was soft
+    deleted already or the workflow is deleted with it.
+    """
+    if not is_deleting(instance.workflow_id_id):
+        count_rows(sender, [instance.get_counted_row()], -1)
@@ -1,7 +1,12 @@
-from workflow.wsgi import *
-from factory import DjangoModelFactory
+from datetime import timedelta
+from itertools import cycle, islice
 
-from api.models import Workflow, WorkflowSteps
+from django.db import connection, transaction
+from django.db.models import Max
+from django.utils import timezone
+from factory import DjangoModelFactory, Sequence, SubFactory
+
+from api.models import Workflow, WorkflowSteps, Comment
 
 
 class WorkflowFactory(DjangoModelFactory):
@@ -16,8 +21,128 @@ class WorkflowStepFactory(DjangoModelFactory):
     class Meta:
         model = WorkflowSteps
 
-    workflow_factory = WorkflowFactory()
-    workflow_id = workflow_factory
-    name = 'name of workflow step'
+    workflow_id = SubFactory(WorkflowFactory)
+    name = Sequence(lambda n: 'step %d' % n)
     description = 'description of workflow step'
-    status = 'status of workflow step'
+    status = WorkflowSteps.DEFINITION
+
+
+class CommentFactory(DjangoModelFactory):
+    class Meta:
+        model = Comment
+
+    workflow_id = SubFactory(WorkflowFactory)
+    name = Sequence(lambda n: 'comment %d' % n)
+    text = 'text of comment'
+
+
+def numbered(kind: str):
+    """
+    Return a text generator writing ``<kind> <number>`` whatever the requested length.
+    """
+    return lambda number, words: '%s %d' % (kind, number)
+
+
+class WorkflowTreeFactory:
+    """
+    Insert workflows with a fan-out of steps and comments, millions of rows at a time.
+
+    Rows are written with ``executemany`` in chunks, within one transaction, bypassing the
+    models: no instance is built and no signal is sent. The counters of the workflows are
+    written with them, as the models would. On SQLite, the search index triggers are
+    suspended in the transaction and the new rows are indexed with one statement per
+    table at the end, several times faster than a trigger per row.
+
+    Attributes:
+        steps (int): Steps per workflow
+        comments (int): Comments per workflow
+        statuses (tuple): Statuses given to the steps of a workflow in turn
+        text (callable): ``text(number, words)`` returning the name or text of a row,
+            ``words`` being the rough length wanted
+        chunk_size (int): Workflows inserted per statement
+    """
+    SEARCH_TRIGGERS = "SELECT name, sql FROM sqlite_master WHERE type = 'trigger' AND name LIKE '%\\_search\\_ai' ESCAPE '\\'"
+
+    def __init__(self, steps: int = 10, comments: int = 10, statuses: tuple = (WorkflowSteps.DEFINITION,),
+                 text=None, chunk_size: int = 1000):
+        self.steps = steps
+        self.comments = comments
+        self.statuses = list(islice(cycle(statuses), steps))
+        self.text = text
+        self.chunk_size = chunk_size
+
+    def workflow_rows(self, ids: range, now) -> list:
+        text, adapt = self.text or numbered('workflow'), connection.ops.adapt_datetimefield_value
+        counts = [self.statuses.count(status) for status in WorkflowSteps.STATUS_COUNTERS]
+        # Creation times one microsecond apart, in id order.
+        return [(pk, adapt(now + timedelta(microseconds=pk)), adapt(now), text(pk, 4), text(pk, 20), self.steps,
+                 *counts, self.comments) for pk in ids]
+
+    def step_rows(self, ids: range, now) -> list:
+        text, now = self.text or numbered('step'), connection.ops.adapt_datetimefield_value(now)
+        return [(now, now, pk, text(pk * self.steps + i, 4), text(pk * self.steps + i, 20), status)
+                for pk in ids for i, status in enumerate(self.statuses)]
+
+    def comment_rows(self, ids: range, now) -> list:
+        text, now = self.text or numbered('comment'), connection.ops.adapt_datetimefield_value(now)
+        return [(now, now, pk, text(pk * self.comments + i, 3), text(pk * self.comments + i, 15))
+                for pk in ids for i in range(self.comments)]
+
+    def create_batch(self, size: int) -> range:
+        """
+        Insert workflows with their steps and comments.
+
+        Args:
+            size (int): Number of workflows
+        Returns:
+            range: Identifiers of the new workflows
+        """
+        now = timezone.now()
+        first = (Workflow.all_objects.aggregate(last=Max('id'))['last'] or 0) + 1
+        ids = range(first, first + size)
+        with transaction.atomic(), connection.cursor() as cursor:
+            triggers = self.suspend_search_triggers(cursor)
+            for start in range(0, size, self.chunk_size):
+                chunk = ids[start:start + self.chunk_size]
+                cursor.executemany(
+                    'INSERT INTO api_workflow (id, created_at, modified_at, archived, deleted, name, description, '
+                    'step_count, definition_step_count, active_step_count, retired_step_count, comment_count) '
+                    'VALUES (%s, %s, %s, 0, 0, %s, %s, %s, %s, %s, %s, %s)',
+                    self.workflow_rows(chunk, now))
+                cursor.executemany(
+                    'INSERT INTO api_workflowsteps (created_at, modified_at, archived, deleted, workflow_id_id, name, '
+                    'description, status) VALUES (%s, %s, 0, 0, %s, %s, %s, %s)',
+                    self.step_rows(chunk, now))
+                cursor.executemany(
+                    'INSERT INTO api_comment (created_at, modified_at, archived, deleted, workflow_id_id, name, text) '
+                    'VALUES (%s, %s, 0, 0, %s, %s, %s)',
+                    self.comment_rows(chunk, now))
+            if triggers:
+                self.index(cursor, first)
+                for name, sql in triggers:
+                    cursor.execute(sql)
+        return ids
+
+    def suspend_search_triggers(self, cursor) -> list:
+        """
+        Drop the triggers indexing inserted rows, returning their name and definition.
+        """
+        if connection.vendor != 'sqlite':
+            return []
+        cursor.execute(self.SEARCH_TRIGGERS)
+        triggers = cursor.fetchall()
+        for name, sql in triggers:
+            cursor.execute('DROP TRIGGER %s' % name)
+        return triggers
+
+    def index(self, cursor, first: int):
+        """
+        Index the rows of the workflows from ``first`` on, as the dropped triggers would have.
+        """
+        for table, kind, body, workflow in (('api_workflow', 0, 'description', 'id'),
+                                            ('api_workflowsteps', 1, 'description', 'workflow_id_id'),
+                                            ('api_comment', 2, 'text', 'workflow_id_id')):
+            cursor.execute(
+                'INSERT INTO api_search_index (rowid, name, body, workflow_id) '
+                'SELECT id * 3 + {kind}, name, {body}, {workflow} FROM {table} WHERE {workflow} >= %s'.format(
+                    table=table, kind=kind, body=body, workflow=workflow), [first])
@@ -0,0 +1,60 @@
+from django.db import connection, connections
+from django.test.utils import CaptureQueriesContext
+
+
+class QueryCountMixin:
+    """
+    Mixin for API test cases that pins the number of SQL queries an endpoint runs.
+
+    The test case is expected to expose an APIClient as ``self.client``.
+    """
+
+    def assertEndpointQueries(self, num: int, method: str, url: str, data=None):
+        """
+        Call an endpoint and fail if it does not run exactly ``num`` queries.
+
+        Parameters
+        ----------
+        num : int
+            Expected number of SQL queries
+        method : str
+            Name of the client method, e.g. 'get' or 'put'
+        url : str
+            Url of the endpoint
+        data : dict, optional
+            Payload sent with the request
+        Returns
+        -------
+        Response
+            The response of the endpoint
+        """
+        with CaptureQueriesContext(connection) as context:
+            response = getattr(self.client, method)(url, data, format='json')
+
+        executed = [query['sql'] for query in context.captured_queries]
+        self.assertEqual(
+            len(executed), num,
+            "%d queries executed on %s %s, %d expected:\n%s" % (
+                len(executed), method.upper(), url, num, '\n'.join(executed))
+        )
+        return response
+
+
+class ReplicaMixin:
+    """
+    Mixin for test cases reading from the ``replica`` database, a second SQLite file.
+
+    The replica is only updated by ``sync_replica()``, which stands for replication: the
+    writes made since the last call are missing from it, as when it lags behind. Only
+    committed writes are copied, so the test case should be a TransactionTestCase.
+    """
+    databases = {'default', 'replica'}
+
+    def sync_replica(self):
+        """
+        Copy the default database to the replica.
+        """
+        primary, replica = connections['default'], connections['replica']
+        primary.ensure_connection()
+        replica.ensure_connection()
+        primary.connection.backup(replica.connection)
@@ -0,0 +1,220 @@
+import io
+import os
+import tempfile
+from unittest import mock
+
+from django.core.management import call_command
+from django.test import TestCase, TransactionTestCase
+
+from ..benchmarks import compare
+from ..models import Workflow, WorkflowSteps, Comment, WorkflowRun, StepRun, StepDependency, WorkflowGraph, \
+    ImportProgress
+from ..utils import importer
+from ..utils.graph import add_dependencies
+from ..utils.scheduler import start_run
+
+
+class ImportWorkflowsTestCase(TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+        for number in range(5):
+            workflow = Workflow.objects.create(name="workflow %d" % number, description="description, quoted \"")
+            WorkflowSteps.objects.create(workflow_id=workflow, name="step", description="step", status=2)
+            Comment.objects.create(workflow_id=workflow, name="comment", text="line\nbreak")
+
+    def export(self, export_format: str) -> str:
+        path = os.path.join(self.directory.name, 'workflows.%s' % export_format)
+        call_command('export_workflows', '--format', export_format, '--output', path)
+        return path
+
+    def import_file(self, path: str, *args):
+        call_command('import_workflows', path, *args, stdout=io.StringIO(), stderr=io.StringIO())
+
+    def assertImportedTwice(self):
+        self.assertEqual(Workflow.objects.count(), 10)
+        self.assertEqual(WorkflowSteps.objects.filter(status=2).count(), 10)
+        self.assertEqual(Comment.objects.filter(text="line\nbreak").count(), 10)
+
+    def test_command_imports_ndjson_export(self):
+        """
+        Test an NDJSON export can be imported back.
+        """
+        self.import_file(self.export('ndjson'), '--chunk-size', '2')
+        self.assertImportedTwice()
+
+    def test_command_imports_csv_export(self):
+        """
+        Test a CSV export can be imported back.
+        """
+        self.import_file(self.export('csv'))
+        self.assertImportedTwice()
+
+    def test_command_rejects_invalid_records(self):
+        """
+        Test invalid records are reported and skipped.
+        """
+        path = os.path.join(self.directory.name, 'workflows.ndjson')
+        with open(path, 'w') as output:
+            output.write('{"name": "valid", "description": "valid", "steps": [{"name": "a", "description": "b"}]}\n')
+            output.write('{"name": "", "description": "blank name"}\n')
+            output.write('not json\n')
+            output.write('{"name": "bad", "description": "bad", "steps": [{"name": "a", "description": "b", '
+                         '"status": 9}]}\n')
+        stderr = io.StringIO()
+        call_command('import_workflows', path, stdout=io.StringIO(), stderr=stderr)
+        self.assertEqual(Workflow.objects.filter(name="valid").count(), 1)
+        self.assertEqual(Workflow.objects.count(), 6)
+        self.assertEqual(len(stderr.getvalue().splitlines()), 3)
+
+    def test_command_resumes_after_the_last_committed_chunk(self):
+        """
+        Test a failed import resumes after the last committed chunk, whose position is saved with it.
+        """
+        path = self.export('ndjson')
+        insert_records = importer.insert_records
+        calls = []
+
+        def failing_insert(records):
+            calls.append(records)
+            if len(calls) == 2:
+                raise RuntimeError("disk full")
+            return insert_records(records)
+
+        with mock.patch.object(importer, 'insert_records', failing_insert):
+            with self.assertRaises(RuntimeError):
+                self.import_file(path, '--chunk-size', '2')
+        self.assertEqual(ImportProgress.objects.get(path=os.path.abspath(path)).position, 2)
+        self.assertEqual(Workflow.objects.count(), 7)
+
+        self.import_file(path, '--chunk-size', '2')
+        self.assertImportedTwice()
+        self.assertFalse(ImportProgress.objects.exists())
+
+
+class PurgeDeletedTestCase(TestCase):
+    def setUp(self):
+        self.workflows = [Workflow.objects.create(name="workflow %d" % number, description="description")
+                          for number in range(3)]
+        for workflow in self.workflows:
+            WorkflowSteps.objects.bulk_create(
+                WorkflowSteps(workflow_id=workflow, name="step", description="step") for _ in range(5))
+            Comment.objects.create(workflow_id=workflow, name="comment", text="text")
+
+    def purge(self, *args) -> str:
+        stdout = io.StringIO()
+        call_command('purge_deleted', *args, stdout=stdout)
+        return stdout.getvalue()
+
+    def test_command_removes_tombstones_in_batches(self):
+        """
+        Test deleted workflows are removed with their children, and deleted children alone.
+        """
+        Workflow.objects.filter(id=self.workflows[0].id).soft_delete()
+        WorkflowSteps.objects.filter(id=WorkflowSteps.objects.filter(workflow_id=self.workflows[1]).first().id) \
+            .soft_delete()
+        output = self.purge('--batch-size', '2')
+
+        self.assertIn("Purged 8 rows", output)
+        self.assertEqual(output.count("2 WorkflowSteps removed"), 2)
+        self.assertEqual(list(Workflow.all_objects.all()), self.workflows[1:])
+        self.assertEqual(WorkflowSteps.all_objects.count(), 9)
+        self.assertEqual(Comment.all_objects.count(), 2)
+
+    def test_runs_are_removed_before_their_steps(self):
+        """
+        Test the runs and dependencies of a deleted workflow, and those of a deleted step, are removed.
+        """
+        WorkflowSteps.objects.update(status=WorkflowSteps.ACTIVE)
+        for workflow in self.workflows[:2]:
+            add_dependencies(workflow.id, list(workflow.steps.values_list('id', flat=True)),
+                             [{'depends_on': [position - 1] if position else []} for position in range(5)])
+        start_run(self.workflows[0])
+        start_run(self.workflows[1])
+        Workflow.objects.filter(id=self.workflows[0].id).soft_delete()
+        WorkflowSteps.objects.filter(id=WorkflowSteps.objects.filter(workflow_id=self.workflows[1]).first().id) \
+            .soft_delete()
+        self.purge()
+
+        self.assertEqual(WorkflowRun.objects.get().workflow_id, self.workflows[1])
+        self.assertEqual(StepRun.objects.count(), 4)
+        self.assertEqual(StepDependency.objects.count(), 3)
+        self.assertEqual(set(WorkflowGraph.objects.values_list('workflow_id', flat=True)), {self.workflows[1].id})
+
+    def test_recent_tombstones_are_kept(self):
+        """
+        Test --older-than leaves the rows deleted recently.
+        """
+        Workflow.objects.filter(id=self.workflows[0].id).soft_delete()
+        self.purge('--older-than', '3600')
+        self.assertEqual(Workflow.all_objects.count(), 3)
+
+
+class RunWorkersTestCase(TransactionTestCase):
+    def test_command_runs_every_step(self):
+        """
+        Test the workers of two processes run the steps of every run, then exit once idle.
+        """
+        workflow = Workflow.objects.create(name="workflow", description="description")
+        WorkflowSteps.objects.bulk_create(
+            WorkflowSteps(workflow_id=workflow, name="step", description="step", status=WorkflowSteps.ACTIVE)
+            for _ in range(3))
+        runs = [start_run(workflow) for _ in range(4)]
+
+        stdout = io.StringIO()
+        call_command('run_workers', '--processes', '2', '--threads', '2', '--poll-interval', '0.01',
+                     '--exit-when-idle', stdout=stdout)
+        self.assertIn("Ran 12 steps", stdout.getvalue())
+        self.assertEqual(WorkflowRun.objects.filter(id__in=[run.id for run in runs],
+                                                    state=WorkflowRun.SUCCEEDED).count(), 4)
+
+
+class RecountTestCase(TestCase):
+    def setUp(self):
+        self.workflows = [Workflow.objects.create(name="workflow %d" % number, description="description")
+                          for number in range(3)]
+        for workflow in self.workflows:
+            WorkflowSteps.objects.bulk_create(
+                WorkflowSteps(workflow_id=workflow, name="step", description="step", status=status)
+                for status in (WorkflowSteps.DEFINITION, WorkflowSteps.ACTIVE, WorkflowSteps.ACTIVE))
+            Comment.objects.create(workflow_id=workflow, name="comment", text="text")
+
+    def recount(self, *args) -> str:
+        stdout = io.StringIO()
+        call_command('recount', *args, stdout=stdout)
+        return stdout.getvalue()
+
+    def test_command_repairs_drifted_counters(self):
+        """
+        Test the counters changed behind the models' back are recomputed, the others left alone.
+        """
+        # Writes through QuerySet.update() are not counted.
+        WorkflowSteps.objects.filter(workflow_id=self.workflows[1]).update(status=WorkflowSteps.RETIRED)
+        Workflow.objects.filter(id=self.workflows[2].id).update(comment_count=7, step_count=0)
+        output = self.recount('--batch-size', '2')
+
+        self.assertIn("Checked 3 workflows", output)
+        self.assertIn("Repaired workflows %d\n" % self.workflows[1].id, output)
+        self.assertIn("Repaired workflows %d\n" % self.workflows[2].id, output)
+        self.assertEqual(
+            list(Workflow.objects.values_list('step_count', 'definition_step_count', 'active_step_count',
+                                              'retired_step_count', 'comment_count')),
+            [(3, 1, 2, 0, 1), (3, 0, 0, 3, 1), (3, 1, 2, 0, 1)])
+        self.assertIn("0 repaired", self.recount())
+
+
+class BenchmarkCompareTestCase(TestCase):
+    def test_regressions_past_the_threshold(self):
+        """
+        Test only the operations slower than their baseline by more than the threshold regress.
+        """
+        rows, regressions = compare({'list': 10, 'detail': 10, 'create': 10},
+                                    {'list': 0.0124, 'detail': 0.013, 'create': 0.005, 'search': 0.002}, 0.25)
+
+        self.assertEqual(regressions, ['detail'])
+        self.assertEqual(rows, [
+            ('list', '10.00', '12.40', '+24%'),
+            ('detail', '10.00', '13.00', '+30% REGRESSION'),
+            ('create', '10.00', '5.00', '-50%'),
+            ('search', '-', '2.00', 'new'),
+        ])
@@ -1,7 +1,25 @@
-from django.test import TestCase
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+from datetime import timedelta
+from unittest import mock
 
-from ..models import Workflow, Comment
-from .factories import WorkflowFactory
+from django.conf import settings
+from django.db import OperationalError, connection, connections
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.utils import timezone
+
+from ..models import Workflow, WorkflowSteps, Comment, WorkflowRun, StepRun
+from ..serializers.serializers import WorkflowSerializer
+from ..utils.counters import recount
+from ..utils.graph import CycleError, StepGraph, add_dependencies, saved_ids
+from ..utils.scheduler import claim, finish, requeue_expired, run_workers, start_run
+from ..utils.search import SearchResults
+from ..utils.timing import recording
+from ..utils.writer import WriterQueue
+from .factories import WorkflowFactory, WorkflowTreeFactory
 
 
 class WorkflowModelTestCase(TestCase):
@@ -50,3 +68,534 @@ class WorkflowTestCase(TestCase):
         """
         workflow_factory = WorkflowFactory()
         self.assertIsNotNone(workflow_factory)
+
+
+class SearchTestCase(TestCase):
+    def setUp(self):
+        self.car = Workflow.objects.create(name="How to start a car", description="Basic instructions")
+        self.cook = Workflow.objects.create(name="How to cook", description="Cooking a car shaped cake")
+        WorkflowSteps.objects.bulk_create([
+            WorkflowSteps(workflow_id=self.car, name="Insert the key", description="Insert the key into the ignition"),
+        ])
+
+    def test_search_matches_every_term(self):
+        """
+        Test the search only returns rows containing all the terms.
+        """
+        self.assertEqual(list(Workflow.search("car")), [self.car, self.cook])
+        self.assertEqual(list(Workflow.search("car cake")), [self.cook])
+        self.assertEqual(list(Workflow.search('"start a car"')), [self.car])
+        self.assertEqual(list(Workflow.search("car boat")), [])
+        self.assertEqual(list(Workflow.search("  ")), [])
+
+    def test_index_follows_writes(self):
+        """
+        Test the index is kept in sync with bulk inserts, updates and deletes.
+        """
+        self.assertEqual(WorkflowSteps.search("ignition").count(), 1)
+        self.cook.name = "How to bake"
+        self.cook.save()
+        self.assertEqual(list(Workflow.search("bake")), [self.cook])
+        self.car.delete()
+        self.assertEqual(WorkflowSteps.search("ignition").count(), 0)
+        self.assertEqual(list(Workflow.search("car")), [self.cook])
+
+
+class WorkflowTreeFactoryTestCase(TestCase):
+    def test_create_batch(self):
+        """
+        Test the bulk factory writes counted, indexed rows with the statuses in turn.
+        """
+        Workflow.objects.create(name="existing workflow", description="description")
+        statuses = (WorkflowSteps.ACTIVE, WorkflowSteps.RETIRED)
+        workflows = WorkflowTreeFactory(steps=3, comments=2, statuses=statuses, chunk_size=2).create_batch(5)
+
+        self.assertEqual(len(workflows), 5)
+        self.assertEqual(Workflow.objects.filter(id__in=workflows).count(), 5)
+        self.assertEqual(
+            list(WorkflowSteps.objects.filter(workflow_id=workflows[0]).order_by('id').values_list('status', flat=True)),
+            [WorkflowSteps.ACTIVE, WorkflowSteps.RETIRED, WorkflowSteps.ACTIVE])
+        self.assertEqual(Comment.objects.filter(workflow_id__in=workflows).count(), 10)
+        self.assertEqual([drifted for checked, drifted in recount(100)], [[]])
+        # Ordered by creation time like rows created one by one.
+        self.assertEqual(list(Workflow.objects.order_by('created_at').values_list('id', flat=True))[1:],
+                         list(workflows))
+
+        # The new rows are indexed, and the index still follows the writes.
+        self.assertEqual(WorkflowSteps.search("step").count(), 15)
+        self.assertEqual(Comment.search("comment").count(), 10)
+        Workflow.objects.create(name="indexed workflow", description="description")
+        self.assertEqual(Workflow.search("indexed").count(), 1)
+
+
+class SoftDeleteTestCase(TestCase):
+    def setUp(self):
+        self.workflow = Workflow.objects.create(name="Bake a cake", description="Bake a chocolate cake")
+        self.step = WorkflowSteps.objects.create(workflow_id=self.workflow, name="Oven", description="Heat the oven")
+        self.comment = Comment.objects.create(workflow_id=self.workflow, name="Tip", text="Use dark chocolate")
+
+    def test_managers_hide_deleted_rows(self):
+        """
+        Test the default managers hide deleted rows and the children of deleted workflows.
+        """
+        self.comment.soft_delete()
+        self.assertEqual(Comment.objects.count(), 0)
+        self.assertEqual(Comment.all_objects.count(), 1)
+        self.assertEqual(list(self.workflow.steps.all()), [self.step])
+
+        with self.assertNumQueries(1):
+            self.assertEqual(Workflow.objects.filter(id=self.workflow.id).soft_delete(), 1)
+        self.assertEqual(Workflow.objects.count(), 0)
+        self.assertEqual(WorkflowSteps.objects.count(), 0)
+        self.assertEqual(WorkflowSteps.all_objects.count(), 1)
+
+    def test_archive(self):
+        """
+        Test archived rows stay visible and can be selected.
+        """
+        Workflow.objects.filter(id=self.workflow.id).archive()
+        self.assertEqual(list(Workflow.objects.archived()), [self.workflow])
+        self.assertEqual(list(Workflow.objects.unarchived()), [])
+
+    def test_search_hides_deleted_rows(self):
+        """
+        Test deleted documents and the children of deleted workflows are not found.
+        """
+        self.assertEqual(SearchResults("chocolate").count(), 2)
+        self.comment.soft_delete()
+        self.assertEqual([hit['kind'] for hit in SearchResults("chocolate")[:10]], ['workflow'])
+        Workflow.objects.filter(id=self.workflow.id).soft_delete()
+        self.assertEqual(SearchResults("oven").count(), 0)
+        self.assertEqual(WorkflowSteps.search("oven").count(), 0)
+
+    def test_live_queries_use_partial_indexes(self):
+        """
+        Test the lists of live rows, and the tombstones, are read from the partial indexes.
+        """
+        for queryset, index in ((Workflow.objects.order_by('created_at', 'id'), 'workflow_keyset_idx'),
+                                (Comment.objects.filter(workflow_id=1).order_by('created_at', 'id'), 'comment_workflow_idx'),
+                                (Workflow.all_objects.filter(deleted=True, modified_at__lt=self.workflow.modified_at)
+                                 .order_by('modified_at'), 'workflow_tombstone_idx')):
+            sql, params = queryset.query.sql_with_params()
+            with connection.cursor() as cursor:
+                cursor.execute('EXPLAIN QUERY PLAN ' + sql, params)
+                plan = ' '.join(row[-1] for row in cursor.fetchall())
+            self.assertIn(index, plan)
+
+
+class CounterTestCase(TestCase):
+    def setUp(self):
+        self.workflow = Workflow.objects.create(name="Bake a cake", description="Bake a chocolate cake")
+
+    def assertCounts(self, steps: int, statuses: tuple, comments: int):
+        workflow = Workflow.objects.get(id=self.workflow.id)
+        self.assertEqual(
+            (workflow.step_count, (workflow.definition_step_count, workflow.active_step_count,
+                                   workflow.retired_step_count), workflow.comment_count),
+            (steps, statuses, comments))
+
+    def test_writes_update_counters(self):
+        """
+        Test creating, soft deleting and deleting steps and comments keeps the counters of their workflow.
+        """
+        step = WorkflowSteps.objects.create(workflow_id=self.workflow, name="Oven", description="Heat the oven")
+        WorkflowSteps.objects.bulk_create(
+            WorkflowSteps(workflow_id=self.workflow, name="step", description="step", status=WorkflowSteps.ACTIVE)
+            for _ in range(3))
+        Comment.objects.bulk_create(
+            Comment(workflow_id=self.workflow, name="Tip", text="Use dark chocolate") for _ in range(4))
+        self.assertCounts(4, (1, 3, 0), 4)
+
+        comments = list(Comment.objects.order_by('id'))
+
+        comments[0].soft_delete()
+        comments[0].soft_delete()
+        Comment.objects.filter(id__in=[comments[0].id, comments[1].id]).soft_delete()
+        Comment.objects.get(id=comments[2].id).delete()
+        step.delete()
+        self.assertCounts(3, (0, 3, 0), 1)
+
+    def test_status_changes_move_steps(self):
+        """
+        Test saving a step with another status moves it between the status counters.
+        """
+        WorkflowSteps.objects.bulk_create(
+            WorkflowSteps(workflow_id=self.workflow, name="step", description="step") for _ in range(3))
+        step, *moved = WorkflowSteps.objects.order_by('id')
+        step.status = WorkflowSteps.RETIRED
+        step.save()
+        step.save()
+        for step in moved:
+            step.status = WorkflowSteps.ACTIVE
+        WorkflowSteps.objects.bulk_update(moved, ['status'])
+        self.assertCounts(3, (0, 2, 1), 0)
+
+    def test_workflow_delete_skips_its_counters(self):
+        """
+        Test deleting a workflow doesn't uncount the children deleted with it, and only those.
+        """
+        others = [Workflow.objects.create(name="Bake a pie", description="Bake an apple pie") for _ in range(2)]
+        for workflow in [self.workflow] + others:
+            WorkflowSteps.objects.bulk_create(
+                WorkflowSteps(workflow_id=workflow, name="step", description="step") for _ in range(10))
+        # Read the workflow, collect its steps, comments, graphs and runs, delete the dependencies and runs of the
+        # steps, the dependencies of the workflow, the steps and the workflow.
+        with self.assertNumQueries(11):
+            Workflow.objects.get(id=others[0].id).delete()
+        # Plus the ids of the deleted workflows.
+        with self.assertNumQueries(12):
+            Workflow.objects.filter(id=others[1].id).delete()
+        WorkflowSteps.objects.filter(workflow_id=self.workflow).first().delete()
+        self.assertCounts(9, (9, 0, 0), 0)
+
+    def test_stale_workflow_keeps_counters(self):
+        """
+        Test saving a workflow read before a comment was added doesn't write back its counters.
+        """
+        stale = Workflow.objects.get(id=self.workflow.id)
+        Comment.objects.create(workflow_id=self.workflow, name="Tip", text="Use dark chocolate")
+        stale.name = "Bake a pie"
+        stale.save()
+        self.assertCounts(0, (0, 0, 0), 1)
+
+
+class CounterConcurrencyTestCase(TransactionTestCase):
+    THREADS = 4
+    WRITES = 20
+
+    def setUp(self):
+        self.workflow = Workflow.objects.create(name="Bake a cake", description="Bake a chocolate cake")
+
+    def write(self, number: int, barrier: threading.Barrier, errors: list):
+        """
+        Add steps and comments, delete some of them and rename the workflow from a stale instance.
+        """
+        try:
+            stale = Workflow.objects.get(id=self.workflow.id)
+            barrier.wait()
+            for index in range(self.WRITES):
+                retry(lambda: WorkflowSteps.objects.create(
+                    workflow_id_id=self.workflow.id, name="step", description="step", status=index % 3))
+                comment = retry(lambda: Comment.objects.create(
+                    workflow_id_id=self.workflow.id, name="comment", text="thread %d" % number))
+                if index % 2:
+                    retry(comment.soft_delete)
+                stale.name = "renamed by %d" % number
+                retry(stale.save)
+        except Exception as exc:
+            errors.append(exc)
+        finally:
+            connections.close_all()
+
+    def test_counters_match_rows_after_concurrent_writes(self):
+        """
+        Test no counter update is lost when several connections write the same workflow.
+        """
+        barrier, errors = threading.Barrier(self.THREADS), []
+        threads = [threading.Thread(target=self.write, args=(number, barrier, errors))
+                   for number in range(self.THREADS)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(errors, [])
+
+        workflow = Workflow.objects.get(id=self.workflow.id)
+        steps = WorkflowSteps.objects.filter(workflow_id=workflow)
+        self.assertEqual(workflow.step_count, self.THREADS * self.WRITES)
+        self.assertEqual(workflow.comment_count, self.THREADS * self.WRITES // 2)
+        self.assertEqual(workflow.active_step_count, steps.filter(status=WorkflowSteps.ACTIVE).count())
+        self.assertEqual([drifted for checked, drifted in recount()], [[]])
+
+
+class DedupeConcurrencyTestCase(TransactionTestCase):
+    THREADS = 4
+
+    def post(self, barrier: threading.Barrier, errors: list):
+        data = {'name': "Bake a cake", 'description': "Bake a chocolate cake",
+                'steps': [{'name': "step", 'description': "step"}]}
+        try:
+            serializer = WorkflowSerializer(data=data)
+            serializer.is_valid(raise_exception=True)
+            barrier.wait()
+            retry(serializer.save)
+        except Exception as exc:
+            errors.append(exc)
+        finally:
+            connections.close_all()
+
+    def test_concurrent_posts_append_to_one_workflow(self):
+        """
+        Test concurrent posts of the same workflow create it once on SQLite, the others appending their steps.
+        """
+        barrier, errors = threading.Barrier(self.THREADS), []
+        threads = [threading.Thread(target=self.post, args=(barrier, errors)) for _ in range(self.THREADS)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(errors, [])
+        self.assertEqual(Workflow.objects.get().step_count, self.THREADS)
+
+
+class SQLiteProductionProfileTestCase(TestCase):
+    def test_connections_apply_the_profile(self):
+        """
+        Test every connection gets the pragmas of the profile and opens transactions with the write lock.
+        """
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'production.sqlite3')
+            production = connections['default'].__class__(
+                dict(connection.settings_dict, NAME=path, **settings.SQLITE_PRODUCTION), 'production')
+            try:
+                with production.cursor() as cursor:
+                    values = [cursor.execute('PRAGMA %s' % name).fetchone()[0]
+                              for name in ('journal_mode', 'synchronous', 'mmap_size', 'cache_size', 'busy_timeout')]
+                self.assertEqual(values, ['wal', 1, 268435456, -65536, 5000])
+
+                production._start_transaction_under_autocommit()
+                # The lock is taken before any write: another writer can't begin.
+                with self.assertRaisesRegex(sqlite3.OperationalError, 'locked'):
+                    sqlite3.connect(path, timeout=0).execute('BEGIN IMMEDIATE')
+                production.connection.rollback()
+            finally:
+                production.close()
+
+
+class WriterQueueTestCase(TransactionTestCase):
+    THREADS = 8
+    WRITES = 25
+
+    def setUp(self):
+        self.workflow = Workflow.objects.create(name="Bake a cake", description="Bake a chocolate cake")
+
+    def comment(self, number: int):
+        return Comment.objects.create(workflow_id_id=self.workflow.id, name="comment", text="comment %d" % number)
+
+    def test_writes_of_many_threads_are_committed_in_batches(self):
+        """
+        Test the writes of concurrent threads all land, with fewer commits than writes.
+        """
+        writer = WriterQueue(batch_size=16)
+
+        def write(number):
+            for index in range(self.WRITES):
+                writer.run(self.comment, number * self.WRITES + index)
+            connections.close_all()
+
+        threads = [threading.Thread(target=write, args=(number,)) for number in range(self.THREADS)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        writer.close()
+
+        self.assertEqual(Comment.objects.count(), self.THREADS * self.WRITES)
+        self.assertEqual(Workflow.objects.get(id=self.workflow.id).comment_count, self.THREADS * self.WRITES)
+        self.assertEqual(writer.writes, self.THREADS * self.WRITES)
+        self.assertLess(writer.batches, writer.writes)
+
+    def test_failed_write_is_rolled_back_alone(self):
+        """
+        Test a write raising an exception is rolled back and raised to its caller only.
+        """
+        def fail():
+            self.comment(0)
+            raise ValueError("failed")
+
+        writer = WriterQueue()
+        futures = [writer.submit(self.comment, 1), writer.submit(fail), writer.submit(self.comment, 2)]
+        writer.close()
+
+        self.assertIsInstance(futures[1].exception(), ValueError)
+        self.assertEqual(sorted(Comment.objects.values_list('text', flat=True)), ["comment 1", "comment 2"])
+        self.assertEqual(futures[2].result().text, "comment 2")
+
+    def test_writes_are_timed_for_their_request(self):
+        """
+        Test the queries run by the writer thread are recorded in the timings of the request writing.
+        """
+        writer = WriterQueue()
+        try:
+            with recording() as timings:
+                writer.run(self.comment, 0)
+        finally:
+            writer.close()
+        self.assertTrue(any(sql.startswith('INSERT INTO "api_comment"') for sql in timings.statements))
+        self.assertGreater(timings.sql, 0)
+
+
+def retry(write, attempts: int = 100):
+    """
+    Run a write, again while the database is locked by another connection.
+    """
+    for attempt in range(attempts):
+        try:
+            return write()
+        except OperationalError as exc:
+            if 'locked' not in str(exc) or attempt == attempts - 1:
+                raise
+            time.sleep(0.001)
+
+
+def failing_step(step_run):
+    raise ValueError("step %d failed" % step_run.step_id_id)
+
+
+class StepGraphTestCase(TestCase):
+    def test_steps_are_sorted_in_levels(self):
+        """
+        Test the level of a step is the length of the longest chain of dependencies leading to it.
+        """
+        graph = StepGraph.build([10, 20, 30, 40, 50], [(30, 10), (30, 20), (40, 30), (50, 10), (40, 50), (99, 10)])
+        self.assertEqual(graph.levels, [0, 0, 1, 2, 1])
+        self.assertEqual(graph.level_sets(), [[0, 1], [2, 4], [3]])
+        self.assertEqual(graph.parents, [[], [], [0, 1], [2, 4], [0]])
+        self.assertEqual(sorted(graph.dependents(10)), [30, 50])
+        self.assertEqual(StepGraph.loads(graph.dumps()).edges(), graph.edges())
+
+    def test_cycles_are_rejected(self):
+        with self.assertRaises(CycleError) as raised:
+            StepGraph.build([1, 2, 3, 4], [(2, 1), (3, 2), (2, 3), (4, 3)])
+        self.assertEqual(raised.exception.steps, [2, 3, 4])
+
+
+class SchedulerTestCase(TestCase):
+    def setUp(self):
+        self.workflow = Workflow.objects.create(name="Bake a cake", description="Bake a chocolate cake")
+        self.steps = WorkflowSteps.objects.bulk_create(
+            WorkflowSteps(workflow_id=self.workflow, name="step %d" % number, description="step", status=status)
+            for number, status in enumerate((WorkflowSteps.ACTIVE, WorkflowSteps.DEFINITION, WorkflowSteps.ACTIVE,
+                                             WorkflowSteps.ACTIVE)))
+        # The dependency on the step that is not active is ignored by runs.
+        add_dependencies(self.workflow.id, saved_ids(self.steps), [{}, {}, {'depends_on': [0, 1]}, {'depends_on': [2]}])
+
+    def states(self, run: WorkflowRun) -> list:
+        return list(run.step_runs.order_by('id').values_list('state', flat=True))
+
+    def test_steps_run_one_after_another(self):
+        """
+        Test the active steps of a run are made ready one at a time, the run succeeding after the last one.
+        """
+        run = start_run(self.workflow)
+        self.assertEqual(run.steps_total, 3)
+        for done in range(3):
+            token, batch, conflicts = claim(10)
+            self.assertEqual(len(batch), 1)
+            self.assertEqual(self.states(run)[done], StepRun.CLAIMED)
+            finish(token, [(batch[0], None)])
+        self.assertEqual(claim(10)[1], [])
+
+        run.refresh_from_db()
+        self.assertEqual((run.state, run.steps_done), (WorkflowRun.SUCCEEDED, 3))
+        self.assertEqual(self.states(run), [StepRun.SUCCEEDED] * 3)
+        self.assertEqual([step_run.step_id.name for step_run in run.step_runs.all()], ["step 0", "step 2", "step 3"])
+
+    def test_failing_step_is_retried_then_fails_the_run(self):
+        """
+        Test a step failing WORKFLOW_STEP_ATTEMPTS times fails its run and cancels the steps left.
+        """
+        run = start_run(self.workflow)
+        for attempt in range(settings.WORKFLOW_STEP_ATTEMPTS):
+            token, batch, conflicts = claim(10)
+            self.assertEqual(batch[0].attempts, attempt + 1)
+            finish(token, [(batch[0], "ValueError: failed")])
+
+        run.refresh_from_db()
+        self.assertEqual(run.state, WorkflowRun.FAILED)
+        self.assertEqual(self.states(run), [StepRun.FAILED, StepRun.CANCELLED, StepRun.CANCELLED])
+        self.assertEqual(run.step_runs.first().error, "ValueError: failed")
+
+    def test_expired_claim_is_requeued_and_its_results_dropped(self):
+        """
+        Test the steps of an expired claim are claimed again, the stale worker's results being ignored.
+        """
+        run = start_run(self.workflow)
+        token, batch, conflicts = claim(10)
+        StepRun.objects.filter(id=batch[0].id).update(claimed_at=timezone.now() - timedelta(seconds=600))
+        self.assertEqual(requeue_expired(300), 1)
+        new_token, new_batch, conflicts = claim(10)
+
+        finish(token, [(batch[0], None)])
+        self.assertEqual(self.states(run)[0], StepRun.CLAIMED)
+        finish(new_token, [(new_batch[0], None)])
+        self.assertEqual(self.states(run)[:2], [StepRun.SUCCEEDED, StepRun.READY])
+
+    def test_expired_claims_fail_the_run_after_the_last_attempt(self):
+        """
+        Test a step whose claims keep expiring, e.g. killing its worker, fails its run after WORKFLOW_STEP_ATTEMPTS.
+        """
+        run = start_run(self.workflow)
+        for attempt in range(settings.WORKFLOW_STEP_ATTEMPTS):
+            token, batch, conflicts = claim(10)
+            self.assertEqual(batch[0].attempts, attempt + 1)
+            StepRun.objects.filter(id=batch[0].id).update(claimed_at=timezone.now() - timedelta(seconds=600))
+            ready = attempt + 1 < settings.WORKFLOW_STEP_ATTEMPTS
+            self.assertEqual(requeue_expired(300), int(ready))
+
+        run.refresh_from_db()
+        self.assertEqual(run.state, WorkflowRun.FAILED)
+        self.assertEqual(self.states(run), [StepRun.FAILED, StepRun.CANCELLED, StepRun.CANCELLED])
+        self.assertEqual(run.step_runs.first().error,
+                         'Claim expired after %d attempts' % settings.WORKFLOW_STEP_ATTEMPTS)
+        self.assertEqual(claim(10)[1], [])
+
+    def test_independent_steps_run_in_parallel(self):
+        """
+        Test the steps depending on no step left to run are ready together, a step waiting for all its dependencies.
+        """
+        workflow = Workflow.objects.create(name="Bake a pie", description="Bake an apple pie")
+        steps = saved_ids(WorkflowSteps.objects.bulk_create(
+            WorkflowSteps(workflow_id=workflow, name="step %d" % number, description="step",
+                          status=WorkflowSteps.ACTIVE) for number in range(4)))
+        add_dependencies(workflow.id, steps, [{}, {}, {'depends_on': [0, 1]}, {}])
+        run = start_run(workflow)
+
+        token, batch, conflicts = claim(10)
+        self.assertEqual([step_run.step_id_id for step_run in batch], [steps[0], steps[1], steps[3]])
+        finish(token, [(batch[0], None), (batch[2], None)])
+        self.assertEqual(self.states(run), [StepRun.SUCCEEDED, StepRun.CLAIMED, StepRun.WAITING, StepRun.SUCCEEDED])
+        finish(token, [(batch[1], None)])
+        token, batch, conflicts = claim(10)
+        self.assertEqual([step_run.step_id_id for step_run in batch], [steps[2]])
+        finish(token, [(batch[0], None)])
+        run.refresh_from_db()
+        self.assertEqual((run.state, run.steps_done), (WorkflowRun.SUCCEEDED, 4))
+
+    def test_workflow_without_active_step(self):
+        workflow = Workflow.objects.create(name="Empty", description="No active step")
+        self.assertEqual(start_run(workflow).state, WorkflowRun.SUCCEEDED)
+
+
+class WorkerPoolTestCase(TransactionTestCase):
+    RUNS = 10
+
+    def setUp(self):
+        workflows = WorkflowTreeFactory(steps=5, comments=0, statuses=(WorkflowSteps.ACTIVE,)).create_batch(self.RUNS)
+        self.runs = [start_run(workflow) for workflow in Workflow.objects.filter(id__in=workflows)]
+
+    def test_concurrent_workers_run_every_step_once(self):
+        """
+        Test threads claiming concurrently run every step exactly once and finish every run.
+        """
+        ran, lock = [], threading.Lock()
+
+        def record(step_run):
+            with lock:
+                ran.append(step_run.id)
+
+        with mock.patch('api.utils.scheduler.get_handler', return_value=record):
+            stats = run_workers(1, 4, batch_size=3, poll_interval=0.01, exit_when_idle=True)
+
+        self.assertEqual(stats['steps'], self.RUNS * 5)
+        self.assertEqual(sorted(ran), list(StepRun.objects.order_by('id').values_list('id', flat=True)))
+        self.assertEqual(WorkflowRun.objects.filter(state=WorkflowRun.SUCCEEDED, steps_done=5).count(), self.RUNS)
+
+    @override_settings(WORKFLOW_STEP_HANDLER='api.tests.test_models.failing_step', WORKFLOW_STEP_ATTEMPTS=2)
+    def test_failing_steps_fail_their_runs(self):
+        with self.assertLogs('api.utils.scheduler', 'ERROR') as logs:
+            stats = run_workers(1, 2, poll_interval=0.01, exit_when_idle=True)
+        # The steps of a run run in parallel: those claimed before the run failed still run.
+        self.assertEqual(len(logs.records), stats['steps'])
+        self.assertEqual(WorkflowRun.objects.filter(state=WorkflowRun.FAILED).count(), self.RUNS)
+        self.assertFalse(StepRun.objects.filter(state__in=(StepRun.WAITING, StepRun.READY, StepRun.CLAIMED)).exists())
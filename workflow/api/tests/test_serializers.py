@@ -1,9 +1,24 @@
+import io
+import uuid
+from collections import OrderedDict
+from datetime import date, datetime, time, timedelta
+from decimal import Decimal
+
+from django.core.exceptions import ImproperlyConfigured
 from django.test import TestCase
+from django.utils.timezone import override, utc
+from django.utils.translation import ugettext_lazy as _
+from rest_framework.exceptions import ParseError
+from rest_framework.renderers import JSONRenderer
 
 from .factories import WorkflowFactory, WorkflowStepFactory
-from ..models import Workflow, WorkflowSteps
+from ..models import Workflow, WorkflowSteps, Comment
 from ..serializers.serializers import WorkflowSerializer, WorkflowStepSerializer, CommentSerializer, \
-    CommentListSerializer, CommentItemSerializer, WorkflowItemSerializer, WorkflowListSerializer
+    CommentListSerializer, CommentItemSerializer, WorkflowItemSerializer, WorkflowListSerializer, \
+    workflow_list_values, comment_list_values
+from ..serializers.values import ValuesSerializer
+from ..utils.parsers import FastJSONParser, NDJSONParser
+from ..utils.renderers import FastJSONRenderer
 
 
 class WorkflowSerializerTestCase(TestCase):
@@ -18,6 +33,17 @@ class WorkflowSerializerTestCase(TestCase):
             ['name', 'description', 'steps']
         )
 
+    def test_dependencies_are_validated(self):
+        """
+        Dependencies must be other steps of the list, without cycle.
+        """
+        for depends_on, valid in (([[], [0], [0, 1]], True), ([[5], []], False), ([[0]], False),
+                                  ([[2], [0], [1]], False)):
+            data = {'name': 'workflow', 'description': 'workflow description',
+                    'steps': [{'name': 'step', 'description': 'step', 'depends_on': item} for item in depends_on]}
+            serializer = WorkflowSerializer(data=data)
+            self.assertEqual(serializer.is_valid(), valid, depends_on)
+
 
 class WorkflowStepsSerializerTestCase(TestCase):
     def test_model_fields(self):
@@ -28,7 +54,7 @@ class WorkflowStepsSerializerTestCase(TestCase):
 
         self.assertEqual(
             [field for field in workflowSteps_serializer.fields],
-            ['id', 'name', 'description', 'status']
+            ['id', 'name', 'description', 'status', 'depends_on']
         )
 
 
@@ -80,7 +106,7 @@ class WorkflowItemSerializerTestCase(TestCase):
 
         self.assertEqual(
             [field for field in workflowItem_serializer.fields],
-            ['name', 'description', 'steps', 'comments']
+            ['name', 'description', 'steps', 'comments', 'comments_count', 'graph']
         )
 
 
@@ -93,5 +119,129 @@ class WorkflowListSerializerTestCase(TestCase):
 
         self.assertEqual(
             [field for field in workflowList_serializer.fields],
-            ['id', 'name', 'description', 'created_at']
+            ['id', 'name', 'description', 'created_at', 'step_count', 'definition_step_count',
+             'active_step_count', 'retired_step_count', 'comment_count']
         )
+
+
+class ValuesSerializerTestCase(TestCase):
+    def setUp(self):
+        workflow = Workflow.objects.create(name="workflow", description="description")
+        Workflow.objects.create(name="naïve \\u2603", description="unicode")
+        Comment.objects.create(workflow_id=workflow, name="comment", text="text")
+        # A whole second renders without microseconds.
+        Workflow.objects.filter(id=workflow.id).update(created_at=datetime(2020, 4, 21, 17, 7, 29, tzinfo=utc))
+
+    def test_output_is_identical(self):
+        """
+        Test the values-based serializers render the same bytes as the model serializers.
+        """
+        renderer = JSONRenderer()
+        for current_timezone in ('UTC', 'Europe/Berlin'):
+            with override(current_timezone):
+                for serializer_class, fast, queryset in (
+                        (WorkflowListSerializer, workflow_list_values, Workflow.objects.all()),
+                        (CommentListSerializer, comment_list_values, Comment.objects.all())):
+                    self.assertEqual(
+                        renderer.render(fast.to_representation(fast.values(queryset))),
+                        renderer.render(serializer_class(queryset, many=True).data)
+                    )
+
+    def test_narrowed_output(self):
+        """
+        Test a narrowed fast path renders the subset of the fields, dropping the extra columns.
+        """
+        fast = workflow_list_values.narrow(('name', 'created_at'))
+        self.assertIs(fast, workflow_list_values.narrow(('name', 'created_at')))
+        self.assertIs(workflow_list_values.narrow(None), workflow_list_values)
+        expected = [{key: item[key] for key in ('name', 'created_at')}
+                    for item in WorkflowListSerializer(Workflow.objects.all(), many=True).data]
+        self.assertEqual(fast.to_representation(fast.values(Workflow.objects.all(), ('created_at', 'id'))), expected)
+
+    def test_unsupported_fields_are_rejected(self):
+        """
+        Test serializers with computed fields can't use the fast path.
+        """
+        with self.assertRaises(ImproperlyConfigured):
+            ValuesSerializer(WorkflowStepSerializer).converters
+
+
+class FastJSONTestCase(TestCase):
+    def test_output_is_identical(self):
+        """
+        Test the fast renderer renders the same bytes as DRF's renderer.
+        """
+        workflow = WorkflowFactory()
+        for status in (WorkflowSteps.DEFINITION, WorkflowSteps.ACTIVE, WorkflowSteps.RETIRED):
+            WorkflowSteps.objects.create(workflow_id=workflow, name="step", description="step", status=status)
+        data = {
+            'workflow': WorkflowItemSerializer(workflow).data,
+            'aware': datetime(2020, 4, 21, 17, 7, 29, 123456, tzinfo=utc),
+            'naive': datetime(2020, 4, 21, 17, 7, 29),
+            'date': date(2020, 4, 21),
+            'time': time(17, 7, 29, 500),
+            'duration': timedelta(hours=1),
+            'decimal': Decimal('1.10'),
+            'label': _('Active'),
+            'uuid': uuid.UUID(int=1),
+            'text': 'naïve \u2603 \u2028 \u2029 "quoted"',
+            'nested': OrderedDict([('b', [1, 2.5, None, True]), ('a', (1,))]),
+            'big': 2 ** 70,
+            'floats': [-1.2345e-6, 1e16, 0.1],
+            3: 'integer key',
+        }
+        with override('Europe/Berlin'):
+            data['local'] = datetime(2020, 4, 21, 17, 7, 29, tzinfo=utc).astimezone()
+        for value in data.values():
+            self.assertEqual(FastJSONRenderer().render(value), JSONRenderer().render(value))
+        self.assertEqual(FastJSONRenderer().render(data), JSONRenderer().render(data))
+
+    def test_non_finite_floats_are_rejected(self):
+        """
+        Test NaN and Infinity are rejected as by DRF's renderer instead of rendered as null.
+        """
+        for value in (float('nan'), float('inf')):
+            with self.assertRaisesMessage(ValueError, 'Out of range float values are not JSON compliant'):
+                FastJSONRenderer().render({'rank': value})
+
+    def test_indent_is_honoured(self):
+        """
+        Test indented output falls back to the stdlib renderer.
+        """
+        data = {'a': [1, 2]}
+        self.assertEqual(
+            FastJSONRenderer().render(data, 'application/json; indent=4'),
+            JSONRenderer().render(data, 'application/json; indent=4')
+        )
+        self.assertEqual(FastJSONRenderer().render(None), b'')
+
+    def test_parser(self):
+        """
+        Test the fast parser decodes like DRF's parser and rejects invalid documents.
+        """
+        parser = FastJSONParser()
+        self.assertEqual(parser.parse(io.BytesIO('{"name": "naïve", "n": [1, 2.5]}'.encode())),
+                         {'name': 'naïve', 'n': [1, 2.5]})
+        self.assertEqual(
+            parser.parse(io.BytesIO('{"name": "naïve"}'.encode('latin-1')), parser_context={'encoding': 'latin-1'}),
+            {'name': 'naïve'}
+        )
+        for document in (b'{"name": ', b'{"n": NaN}'):
+            with self.assertRaises(ParseError):
+                parser.parse(io.BytesIO(document))
+        document = b'{"big": 123456789012345678901234567890, "small": -9223372036854775809}'
+        self.assertEqual(parser.parse(io.BytesIO(document)),
+                         {'big': 123456789012345678901234567890, 'small': -9223372036854775809})
+        self.assertEqual(NDJSONParser().parse(io.BytesIO(document + b'\n')), [parser.parse(io.BytesIO(document))])
+
+    def test_ndjson_parser(self):
+        """
+        Test the NDJSON parser decodes one document per line and rejects invalid lines or encodings.
+        """
+        parser = NDJSONParser()
+        self.assertEqual(parser.parse(io.BytesIO(b'{"name": "a"}\n\n{"name": "b"}\n')), [{'name': 'a'}, {'name': 'b'}])
+        with self.assertRaisesMessage(ParseError, 'line 2'):
+            parser.parse(io.BytesIO(b'{"name": "a"}\n{"name": \n'))
+        for body in (b'\xff\xfe{"name":1}\n', b'{"name":"a"}\n\xff\n'):
+            with self.assertRaisesMessage(ParseError, 'not valid utf-8'):
+                parser.parse(io.BytesIO(body))
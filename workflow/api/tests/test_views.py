@@ -1,9 +1,29 @@
-from django.test import TestCase
+import csv
+import io
+import json
+import os
+import tempfile
+import threading
+
+from django.conf import settings
+from django.core.management import call_command
+from django.db import connection
+from django.core.exceptions import MiddlewareNotUsed
+from django.http import HttpResponse
+from django.test import RequestFactory, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
 from rest_framework import status
 from rest_framework.test import APIClient
 
-from ..models import Workflow, Comment
+from ..models import Workflow, WorkflowSteps, Comment, WorkflowRun, StepDependency
+from ..utils.export import ndjson_lines
+from ..utils.cache import DATA_KEY, get_cache, get_version, stats
+from ..utils.metrics import Registry
+from ..utils.routers import STICKY_COOKIE
+from ..utils.writer import close_writer
+from ..utils.timing import ServerTimingMiddleware
+from .helpers import QueryCountMixin, ReplicaMixin
 
 
 class WorkflowViewSetTestCase(TestCase):
@@ -139,3 +159,966 @@ class CommentViewSetTestCase(TestCase):
             reverse('api:CommentGetDeleteUpdate', kwargs={'pk': comment.id}), format='json', follow=True)
 
         self.assertEquals(response.status_code, status.HTTP_204_NO_CONTENT)
+
+
+class WorkflowQueryCountTestCase(QueryCountMixin, TestCase):
+    def setUp(self):
+        self.client = APIClient()
+
+    def create_workflow(self, steps: int, comments: int) -> Workflow:
+        workflow = Workflow.objects.create(name="workflow", description="workflow description")
+        WorkflowSteps.objects.bulk_create(
+            WorkflowSteps(workflow_id=workflow, name="step %d" % i, description="step description")
+            for i in range(steps)
+        )
+        Comment.objects.bulk_create(
+            Comment(workflow_id=workflow, name="comment %d" % i, text="comment text")
+            for i in range(comments)
+        )
+        return workflow
+
+    def test_get_workflow_query_count_is_constant(self):
+        """
+        Test the workflow detail runs the same number of queries for any size of workflow.
+        """
+        for steps, comments in ((1, 1), (50, 50)):
+            workflow = self.create_workflow(steps, comments)
+            url = reverse('api:WorkflowGetDeleteUpdate', kwargs={'pk': workflow.id})
+            response = self.assertEndpointQueries(5, 'get', url)
+            self.assertEqual(len(response.data['steps']), steps)
+            self.assertEqual(len(response.data['comments']), min(comments, settings.WORKFLOW_DETAIL_COMMENTS))
+            self.assertEqual(response.data['comments_count'], comments)
+
+    def test_list_counts_query_count_is_constant(self):
+        """
+        Test the workflow list renders the step and comment counters without aggregating the rows.
+        """
+        for steps, comments in ((1, 1), (50, 50)):
+            self.create_workflow(steps, comments)
+        response = self.assertEndpointQueries(2, 'get', reverse('api:WorkflowListPost'))
+        self.assertEqual(
+            [(row['step_count'], row['definition_step_count'], row['comment_count'])
+             for row in response.data['results']],
+            [(1, 1, 1), (50, 50, 50)])
+
+    def test_post_workflow_query_count_is_constant(self):
+        """
+        Test the workflow creation writes all steps in a single insert.
+        """
+        for steps in (1, 100):
+            data = {
+                "name": "workflow with %d steps" % steps,
+                "description": "workflow description",
+                "steps": [{'name': 'step %d' % i, 'description': 'step description'} for i in range(steps)],
+            }
+            self.assertEndpointQueries(7, 'post', reverse('api:WorkflowListPost'), data)
+            self.assertEqual(WorkflowSteps.objects.filter(workflow_id__name=data['name']).count(), steps)
+
+    def test_post_workflow_appends_steps_to_duplicate(self):
+        """
+        Test posting a workflow with the same name and description reuses the existing workflow.
+        """
+        data = {
+            "name": "workflow",
+            "description": "workflow description",
+            "steps": [{'name': 'step', 'description': 'step description'}],
+        }
+        self.client.post(reverse('api:WorkflowListPost'), data, format='json')
+        self.client.post(reverse('api:WorkflowListPost'), data, format='json')
+        self.assertEqual(Workflow.objects.count(), 1)
+        self.assertEqual(WorkflowSteps.objects.count(), 2)
+
+    def test_put_workflow_query_count_is_constant(self):
+        """
+        Test the workflow update reconciles any number of steps with the same number of queries.
+        """
+        for steps in (3, 100):
+            workflow = self.create_workflow(steps, 0)
+            step_ids = list(workflow.steps.values_list('id', flat=True))
+            data = {
+                "name": "workflow",
+                "description": "workflow description",
+                "steps": [{'id': _id, 'name': 'renamed %d' % _id, 'description': 'step description'}
+                          for _id in step_ids[1:]] + [{'name': 'new step', 'description': 'step description'}],
+            }
+            url = reverse('api:WorkflowGetDeleteUpdate', kwargs={'pk': workflow.id})
+            self.assertEndpointQueries(14, 'put', url, data)
+            self.assertEqual(
+                list(workflow.steps.values_list('name', flat=True)),
+                ['renamed %d' % _id for _id in step_ids[1:]] + ['new step']
+            )
+
+    def test_put_workflow_with_unknown_step(self):
+        """
+        Test the workflow update rejects steps of another workflow.
+        """
+        workflow = self.create_workflow(1, 0)
+        other_step = self.create_workflow(1, 0).steps.get()
+        data = {
+            "name": "workflow",
+            "description": "workflow description",
+            "steps": [{'id': other_step.id, 'name': 'renamed', 'description': 'step description'}],
+        }
+        response = self.client.put(
+            reverse('api:WorkflowGetDeleteUpdate', kwargs={'pk': workflow.id}), data, format='json')
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+        self.assertEqual(WorkflowSteps.objects.get(id=other_step.id).name, other_step.name)
+
+    def test_list_query_counts(self):
+        """
+        Test the list endpoints run a count and a page query only.
+        """
+        workflow = self.create_workflow(5, 5)
+        self.assertEndpointQueries(2, 'get', reverse('api:WorkflowListPost'))
+        self.assertEndpointQueries(2, 'get', reverse('api:CommentListPost'))
+        comment = workflow.comments.first()
+        self.assertEndpointQueries(3, 'get', reverse('api:CommentGetDeleteUpdate', kwargs={'pk': comment.id}))
+
+
+class KeysetPaginationTestCase(QueryCountMixin, TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.workflow = Workflow.objects.create(name="workflow", description="workflow description")
+        # Share a single creation time so that the id has to break the ties.
+        Comment.objects.bulk_create(
+            Comment(workflow_id=self.workflow, name="comment %d" % i, text="comment text") for i in range(25)
+        )
+        Comment.objects.update(created_at=self.workflow.created_at)
+
+    def test_cursor_pages_cover_every_row_once(self):
+        """
+        Test walking the cursor pages returns all comments in (created_at, id) order.
+        """
+        url = reverse('api:CommentListPost') + '?pagination=cursor&page_size=10'
+        ids = []
+        while url:
+            response = self.assertEndpointQueries(1, 'get', url)
+            ids.extend(item['id'] for item in response.data['results'])
+            url = response.data['next']
+        self.assertEqual(ids, list(Comment.objects.order_by('created_at', 'id').values_list('id', flat=True)))
+
+    def test_invalid_cursor(self):
+        """
+        Test a malformed cursor is rejected.
+        """
+        response = self.client.get(reverse('api:WorkflowListPost') + '?cursor=not-a-cursor')
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_page_number_pagination_is_the_default(self):
+        """
+        Test the list endpoints keep numbered pages unless cursor pagination is requested.
+        """
+        response = self.client.get(reverse('api:WorkflowListPost'))
+        self.assertEqual(response.data['count'], 1)
+
+
+class WorkflowCommentListTestCase(QueryCountMixin, TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.workflow = Workflow.objects.create(name="workflow", description="workflow description")
+        other = Workflow.objects.create(name="other", description="other description")
+        Comment.objects.bulk_create(
+            Comment(workflow_id=workflow, name="comment %d" % i, text="comment text")
+            for i in range(25) for workflow in (self.workflow, other)
+        )
+        self.url = reverse('api:WorkflowCommentList', kwargs={'pk': self.workflow.id})
+
+    def test_pages_cover_every_comment_once_newest_first(self):
+        """
+        Test walking the pages returns the comments of the workflow alone, newest first.
+        """
+        url, ids = self.url + '?page_size=10', []
+        while url:
+            response = self.assertEndpointQueries(1, 'get', url)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            ids.extend(item['id'] for item in response.data['results'])
+            url = response.data['next']
+        self.assertEqual(ids, list(self.workflow.comments.order_by('-id').values_list('id', flat=True)))
+
+    def test_pages_are_read_from_the_thread_index(self):
+        """
+        Test a page is a range of the (workflow_id, id) index, neither scanned nor sorted.
+        """
+        cursor = self.client.get(self.url + '?page_size=10').data['next'].split('cursor=')[1]
+        for url in (self.url, self.url + '?cursor=' + cursor):
+            with CaptureQueriesContext(connection) as context:
+                self.client.get(url)
+            page = context.captured_queries[-1]['sql']
+            with connection.cursor() as db:
+                db.execute('EXPLAIN QUERY PLAN ' + page)
+                plan = [row[-1] for row in db.fetchall()]
+            self.assertIn('comment_thread_idx', '\n'.join(plan))
+            self.assertFalse([step for step in plan if step.startswith('SCAN') or 'TEMP B-TREE' in step],
+                             "Unindexed page query %s:\n%s" % (page, '\n'.join(plan)))
+
+    def test_sparse_fields(self):
+        """
+        Test ?fields= narrows the rendered comments.
+        """
+        response = self.client.get(self.url + '?fields=id,name')
+        self.assertEqual(list(response.data['results'][0]), ['id', 'name'])
+
+    def test_unknown_workflow(self):
+        """
+        Test the comments of a missing or deleted workflow are not found.
+        """
+        response = self.client.get(reverse('api:WorkflowCommentList', kwargs={'pk': 0}))
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+        self.workflow.soft_delete()
+        self.assertEqual(self.client.get(self.url).status_code, status.HTTP_404_NOT_FOUND)
+
+
+class WorkflowRunListPostTestCase(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.workflow = Workflow.objects.create(name="workflow", description="workflow description")
+        WorkflowSteps.objects.bulk_create(
+            WorkflowSteps(workflow_id=self.workflow, name="step %d" % i, description="step", status=status_)
+            for i, status_ in enumerate((WorkflowSteps.ACTIVE, WorkflowSteps.ACTIVE, WorkflowSteps.RETIRED)))
+        self.url = reverse('api:WorkflowRunListPost', kwargs={'pk': self.workflow.id})
+
+    def test_start_and_list_runs(self):
+        """
+        Test posting starts a run of the active steps, listed newest first.
+        """
+        response = self.client.post(self.url)
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(response.data['state'], "Running")
+        self.assertEqual((response.data['steps_total'], response.data['steps_done']), (2, 0))
+        second = self.client.post(self.url).data['id']
+
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([run['id'] for run in response.data['results']], [second, response.data['results'][1]['id']])
+        self.assertEqual(WorkflowRun.objects.get(id=second).step_runs.count(), 2)
+
+    def test_unknown_workflow(self):
+        url = reverse('api:WorkflowRunListPost', kwargs={'pk': self.workflow.id + 1})
+        self.assertEqual(self.client.get(url).status_code, status.HTTP_404_NOT_FOUND)
+        self.assertEqual(self.client.post(url).status_code, status.HTTP_404_NOT_FOUND)
+
+
+class WorkflowGraphTestCase(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        get_cache().clear()
+        self.data = {
+            "name": "workflow",
+            "description": "workflow description",
+            "steps": [{'name': 'step %d' % i, 'description': 'step description', 'depends_on': depends_on}
+                      for i, depends_on in enumerate(([], [], [0, 1], [0]))],
+        }
+
+    def get_graph(self, workflow: Workflow) -> dict:
+        return self.client.get(reverse('api:WorkflowGetDeleteUpdate', kwargs={'pk': workflow.id})).data['graph']
+
+    def test_detail_renders_dependencies_and_levels(self):
+        """
+        Test the dependencies posted with the steps are rendered with the detail, by position in its steps.
+        """
+        response = self.client.post(reverse('api:WorkflowListPost'), self.data, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertNotIn('depends_on', response.data['steps'][0])
+        workflow = Workflow.objects.get()
+        self.assertEqual(self.get_graph(workflow), {'depends_on': [[], [], [0, 1], [0]], 'levels': [[0, 1], [2, 3]]})
+
+        steps = list(workflow.steps.values_list('id', flat=True))
+        data = dict(self.data, steps=[{'id': steps[2], 'name': 'step 2', 'description': 'step description'},
+                                      {'id': steps[3], 'name': 'step 3', 'description': 'step description',
+                                       'depends_on': [0]},
+                                      {'name': 'step 4', 'description': 'step description', 'depends_on': [1]}])
+        response = self.client.put(reverse('api:WorkflowGetDeleteUpdate', kwargs={'pk': workflow.id}), data,
+                                   format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(self.get_graph(workflow), {'depends_on': [[], [0], [1]], 'levels': [[0], [1], [2]]})
+
+    def test_cycles_are_rejected(self):
+        self.data['steps'][0]['depends_on'] = [3]
+        response = self.client.post(reverse('api:WorkflowListPost'), self.data, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('cycle', str(response.data['steps']))
+        self.assertFalse(Workflow.objects.exists())
+
+
+class SparseFieldsTestCase(QueryCountMixin, TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        get_cache().clear()
+        self.workflow = Workflow.objects.create(name="workflow", description="workflow description")
+        WorkflowSteps.objects.create(workflow_id=self.workflow, name="step", description="step description")
+        self.comment = Comment.objects.create(workflow_id=self.workflow, name="comment", text="comment text")
+        Workflow.objects.bulk_create(Workflow(name="workflow %d" % i, description="description") for i in range(12))
+
+    def get_sql(self, url: str):
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return response, '\n'.join(query['sql'] for query in context.captured_queries)
+
+    def test_list_reads_only_requested_fields(self):
+        """
+        Test the list endpoints render and select only the requested fields.
+        """
+        response, sql = self.get_sql(reverse('api:WorkflowListPost') + '?fields=name,id')
+        self.assertEqual(list(response.data['results'][0]), ['id', 'name'])
+        self.assertNotIn('"description"', sql)
+
+        response, sql = self.get_sql(reverse('api:CommentListPost') + '?fields=text')
+        self.assertEqual(response.data['results'], [{'text': 'comment text'}])
+        self.assertNotIn('"api_comment"."name"', sql)
+
+    def test_cursor_pages_without_key_fields(self):
+        """
+        Test keyset pagination still works when the key columns are not rendered.
+        """
+        url = reverse('api:WorkflowListPost') + '?pagination=cursor&fields=name'
+        names = []
+        while url:
+            response = self.client.get(url)
+            self.assertTrue(all(list(item) == ['name'] for item in response.data['results']))
+            names.extend(item['name'] for item in response.data['results'])
+            url = response.data['next']
+        self.assertEqual(names, list(Workflow.objects.order_by('created_at', 'id').values_list('name', flat=True)))
+
+    def test_detail_reads_only_requested_fields(self):
+        """
+        Test the detail endpoints render and select only the requested fields.
+        """
+        url = reverse('api:WorkflowGetDeleteUpdate', kwargs={'pk': self.workflow.id})
+        response, sql = self.get_sql(url + '?fields=name')
+        self.assertEqual(response.data, {'name': 'workflow'})
+        self.assertNotIn('"api_workflow"."description"', sql)
+        self.assertNotIn('"api_workflowsteps"."name"', sql)
+
+        response = self.assertEndpointQueries(3, 'get', url + '?fields=steps')
+        self.assertEqual(list(response.data), ['steps'])
+        # The full detail is cached apart from the sparse one.
+        response = self.assertEndpointQueries(5, 'get', url)
+        self.assertEqual(list(response.data), ['name', 'description', 'steps', 'comments', 'comments_count', 'graph'])
+
+        response, sql = self.get_sql(reverse('api:CommentGetDeleteUpdate', kwargs={'pk': self.comment.id})
+                                     + '?fields=name')
+        self.assertEqual(response.data, {'name': 'comment'})
+        self.assertNotIn('"api_comment"."text"', sql)
+
+    def test_unknown_fields_are_rejected(self):
+        """
+        Test unknown field names are rejected before any query.
+        """
+        for url in (reverse('api:WorkflowListPost'), reverse('api:CommentListPost'),
+                    reverse('api:WorkflowGetDeleteUpdate', kwargs={'pk': self.workflow.id}),
+                    reverse('api:CommentGetDeleteUpdate', kwargs={'pk': self.comment.id})):
+            response = self.assertEndpointQueries(0, 'get', url + '?fields=name,secret')
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+            self.assertIn('secret', response.data['fields'][0])
+
+
+class ListFilterTestCase(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.workflows = Workflow.objects.bulk_create(
+            Workflow(name="workflow %d" % i, description="description") for i in range(4))
+        self.workflows = list(Workflow.objects.order_by('id'))
+        Workflow.objects.filter(id=self.workflows[1].id).update(archived=True)
+        Workflow.objects.filter(id=self.workflows[2].id).update(created_at='2020-01-01T00:00:00Z')
+        WorkflowSteps.objects.create(workflow_id=self.workflows[0], name="step", description="step",
+                                     status=WorkflowSteps.RETIRED)
+        Comment.objects.bulk_create(Comment(workflow_id=workflow, name="comment", text="text")
+                                    for workflow in self.workflows)
+
+    def get_ids(self, url: str) -> list:
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK, response.data)
+        return [item['id'] for item in response.data['results']]
+
+    def assertIndexedQueries(self, url: str):
+        """
+        Fail if a query run by the endpoint scans a whole table.
+        """
+        with CaptureQueriesContext(connection) as context:
+            self.client.get(url)
+        for query in context.captured_queries:
+            with connection.cursor() as cursor:
+                cursor.execute('EXPLAIN QUERY PLAN ' + query['sql'])
+                plan = [row[-1] for row in cursor.fetchall()]
+            scans = [step for step in plan if step.startswith('SCAN')]
+            self.assertFalse(scans, "Full scan in %s:\n%s" % (query['sql'], '\n'.join(plan)))
+
+    def test_workflow_filters(self):
+        """
+        Test the workflow list filters by creation time, flags and step status.
+        """
+        url = reverse('api:WorkflowListPost')
+        ids = [workflow.id for workflow in self.workflows]
+        self.assertEqual(self.get_ids(url + '?created_before=2020-01-02'), [ids[2]])
+        self.assertEqual(self.get_ids(url + '?created_after=2020-01-02T00:00:00Z'), [ids[0], ids[1], ids[3]])
+        self.assertEqual(self.get_ids(url + '?archived=true'), [ids[1]])
+        self.assertEqual(self.get_ids(url + '?archived=false'), [ids[2], ids[0], ids[3]])
+        self.assertEqual(self.get_ids(url + '?status=%d' % WorkflowSteps.RETIRED), [ids[0]])
+        self.assertEqual(self.get_ids(url + '?status=%d' % WorkflowSteps.ACTIVE), [])
+        self.assertEqual(self.get_ids(url + '?modified_before=2020-01-01'), [])
+
+    def test_comment_filters(self):
+        """
+        Test the comment list filters by workflow and time.
+        """
+        url = reverse('api:CommentListPost')
+        comments = Comment.objects.filter(workflow_id=self.workflows[3]).values_list('id', flat=True)
+        self.assertEqual(self.get_ids(url + '?workflow_id=%d' % self.workflows[3].id), list(comments))
+        self.assertEqual(
+            self.get_ids(url + '?workflow_id=%d&pagination=cursor&created_after=2020-01-01' % self.workflows[3].id),
+            list(comments))
+
+    def test_invalid_filters(self):
+        """
+        Test invalid filter values are rejected with the name of the parameter.
+        """
+        for url, param in ((reverse('api:WorkflowListPost') + '?created_after=yesterday', 'created_after'),
+                           (reverse('api:WorkflowListPost') + '?status=9', 'status'),
+                           (reverse('api:WorkflowListPost') + '?archived=maybe', 'archived'),
+                           (reverse('api:CommentListPost') + '?workflow_id=-1', 'workflow_id')):
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+            self.assertIn(param, response.data)
+
+    def test_filters_use_indexes(self):
+        """
+        Test no filter falls back to a full table scan, with numbered and cursor pages.
+        """
+        for url in (reverse('api:WorkflowListPost'), reverse('api:CommentListPost')):
+            for params in ('created_after=2020-01-01', 'created_after=2020-01-01&created_before=2021-01-01',
+                           'modified_after=2020-01-01', 'modified_before=2021-01-01', 'archived=1'):
+                for pagination in ('', '&pagination=cursor'):
+                    self.assertIndexedQueries(url + '?' + params + pagination)
+        for pagination in ('', '&pagination=cursor'):
+            self.assertIndexedQueries(reverse('api:WorkflowListPost') + '?status=1' + pagination)
+            self.assertIndexedQueries(
+                reverse('api:CommentListPost') + '?workflow_id=%d' % self.workflows[0].id + pagination)
+
+
+class SoftDeleteViewTestCase(QueryCountMixin, TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        get_cache().clear()
+        self.workflow = Workflow.objects.create(name="workflow", description="workflow description")
+        WorkflowSteps.objects.bulk_create(
+            WorkflowSteps(workflow_id=self.workflow, name="step %d" % i, description="step") for i in range(50))
+        self.comment = Comment.objects.create(workflow_id=self.workflow, name="comment", text="comment text")
+        self.url = reverse('api:WorkflowGetDeleteUpdate', kwargs={'pk': self.workflow.id})
+
+    def test_delete_is_a_single_update(self):
+        """
+        Test deleting a workflow flags it with one query and hides it with its children.
+        """
+        self.client.get(self.url)
+        response = self.assertEndpointQueries(1, 'delete', self.url)
+        self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
+        self.assertEqual(WorkflowSteps.all_objects.count(), 50)
+
+        self.assertEqual(self.client.get(self.url).status_code, status.HTTP_404_NOT_FOUND)
+        self.assertEqual(self.client.delete(self.url).status_code, status.HTTP_404_NOT_FOUND)
+        self.assertEqual(self.client.get(reverse('api:WorkflowListPost')).data['count'], 0)
+        self.assertEqual(self.client.get(reverse('api:CommentListPost')).data['count'], 0)
+        comment_url = reverse('api:CommentGetDeleteUpdate', kwargs={'pk': self.comment.id})
+        self.assertEqual(self.client.get(comment_url).status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_deleted_comment_leaves_the_detail(self):
+        """
+        Test deleting a comment hides it from the lists and the detail of its workflow.
+        """
+        self.assertEqual(len(self.client.get(self.url).data['comments']), 1)
+        response = self.client.delete(reverse('api:CommentGetDeleteUpdate', kwargs={'pk': self.comment.id}))
+        self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
+        self.assertTrue(Comment.all_objects.get(id=self.comment.id).deleted)
+        self.assertEqual(self.client.get(self.url).data['comments'], [])
+        self.assertEqual(self.client.get(reverse('api:CommentListPost')).data['count'], 0)
+
+
+class SearchViewTestCase(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.workflow = Workflow.objects.create(name="How to start a car", description="Basic instructions")
+        Comment.objects.create(workflow_id=self.workflow, name="Car trouble", text="The car would not start")
+        Comment.objects.create(workflow_id=self.workflow, name="Thanks", text="Nice one")
+
+    def test_api_can_search(self):
+        """
+        Test the api ranks hits of every kind and filters them by kind.
+        """
+        response = self.client.get(reverse('api:SearchList'), {'q': 'start car'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['count'], 2)
+        self.assertEqual({hit['kind'] for hit in response.data['results']}, {'workflow', 'comment'})
+
+        response = self.client.get(reverse('api:SearchList'), {'q': 'car', 'kind': 'comment'})
+        self.assertEqual([hit['name'] for hit in response.data['results']], ['Car trouble'])
+        self.assertEqual(response.data['results'][0]['workflow_id'], self.workflow.id)
+
+    def test_api_rejects_invalid_search(self):
+        """
+        Test the api requires a query and a known kind.
+        """
+        response = self.client.get(reverse('api:SearchList'))
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        response = self.client.get(reverse('api:SearchList'), {'q': 'car', 'kind': 'user'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class WorkflowDetailCacheTestCase(QueryCountMixin, TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        get_cache().clear()
+        self.workflow = Workflow.objects.create(name="workflow", description="workflow description")
+        self.step = WorkflowSteps.objects.create(workflow_id=self.workflow, name="step", description="step")
+        self.url = reverse('api:WorkflowGetDeleteUpdate', kwargs={'pk': self.workflow.id})
+
+    def test_detail_is_served_from_cache(self):
+        """
+        Test a second read of a workflow only runs the validators query.
+        """
+        first = self.assertEndpointQueries(5, 'get', self.url)
+        second = self.assertEndpointQueries(1, 'get', self.url)
+        self.assertEqual(first.data, second.data)
+        self.assertEqual(stats(), {'hits': 1, 'misses': 1, 'evictions': 0, 'invalidations': 0})
+
+    def test_writes_invalidate_the_detail(self):
+        """
+        Test saving or deleting a workflow, a step or a comment drops the cached detail.
+        """
+        self.client.get(self.url)
+        Comment.objects.create(workflow_id=self.workflow, name="comment", text="text")
+        self.assertEqual(len(self.client.get(self.url).data['comments']), 1)
+
+        self.step.name = "renamed"
+        self.step.save()
+        self.assertEqual(self.client.get(self.url).data['steps'][0]['name'], "renamed")
+
+        self.workflow.delete()
+        self.assertEqual(self.client.get(self.url).status_code, status.HTTP_404_NOT_FOUND)
+        self.assertEqual(stats()['hits'], 0)
+
+    def test_evicted_detail_is_counted(self):
+        """
+        Test a detail dropped by the cache backend counts as an eviction.
+        """
+        self.client.get(self.url)
+        cache = get_cache()
+        cache.delete(DATA_KEY.format(self.workflow.id, get_version(cache, self.workflow.id)))
+        self.client.get(self.url)
+        self.assertEqual(stats()['evictions'], 1)
+
+
+class ConditionalGetTestCase(QueryCountMixin, TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.workflow = Workflow.objects.create(name="workflow", description="workflow description")
+        self.step = WorkflowSteps.objects.create(workflow_id=self.workflow, name="step", description="step")
+        self.detail_url = reverse('api:WorkflowGetDeleteUpdate', kwargs={'pk': self.workflow.id})
+
+    def test_unchanged_detail_is_not_modified(self):
+        """
+        Test a detail matching the client's ETag answers 304 after a single query.
+        """
+        response = self.client.get(self.detail_url)
+        self.assertIn('Last-Modified', response)
+        self.client.credentials(HTTP_IF_NONE_MATCH=response['ETag'])
+        not_modified = self.assertEndpointQueries(1, 'get', self.detail_url)
+        self.assertEqual(not_modified.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(not_modified['ETag'], response['ETag'])
+
+    def test_child_writes_change_the_etag(self):
+        """
+        Test adding or deleting a comment or a step changes the detail ETag.
+        """
+        etags = [self.client.get(self.detail_url)['ETag']]
+        comment = Comment.objects.create(workflow_id=self.workflow, name="comment", text="text")
+        etags.append(self.client.get(self.detail_url)['ETag'])
+        comment.delete()
+        etags.append(self.client.get(self.detail_url)['ETag'])
+        WorkflowSteps.objects.filter(id=self.step.id).delete()
+        etags.append(self.client.get(self.detail_url)['ETag'])
+        for before, after in zip(etags, etags[1:]):
+            self.assertNotEqual(before, after)
+
+    def test_list_pages_have_their_own_etag(self):
+        """
+        Test list validators depend on the page and on the rows.
+        """
+        url = reverse('api:WorkflowListPost')
+        etag = self.client.get(url)['ETag']
+        self.assertNotEqual(self.client.get(url, {'page_size': 5})['ETag'], etag)
+        self.client.credentials(HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(self.client.get(url).status_code, status.HTTP_304_NOT_MODIFIED)
+        Workflow.objects.create(name="other", description="other description")
+        self.assertEqual(self.client.get(url).status_code, status.HTTP_200_OK)
+
+    def test_list_deletions_change_the_etag(self):
+        """
+        Test deleting a row out of the page, or the workflow of the comments, changes the list ETag.
+        """
+        comments = [Comment.objects.create(workflow_id=self.workflow, name="comment", text="text") for _ in range(3)]
+        url = reverse('api:CommentListPost') + '?page_size=1'
+        etags = [self.client.get(url)['ETag']]
+        Comment.objects.filter(id=comments[-1].id).soft_delete()
+        etags.append(self.client.get(url)['ETag'])
+        Workflow.objects.filter(id=self.workflow.id).soft_delete()
+        etags.append(self.client.get(url)['ETag'])
+        for before, after in zip(etags, etags[1:]):
+            self.assertNotEqual(before, after)
+
+    def test_lists_ignore_if_modified_since(self):
+        """
+        Test lists have no Last-Modified, so a deletion can't be hidden by If-Modified-Since.
+        """
+        url = reverse('api:WorkflowListPost')
+        response = self.assertEndpointQueries(2, 'get', url)
+        self.assertNotIn('Last-Modified', response)
+        self.client.credentials(HTTP_IF_MODIFIED_SINCE='Fri, 01 Jan 2100 00:00:00 GMT')
+        self.assertEqual(self.client.get(url).status_code, status.HTTP_200_OK)
+
+    def test_missing_resources(self):
+        """
+        Test the validators of a missing resource answer 404.
+        """
+        response = self.client.get(reverse('api:CommentGetDeleteUpdate', kwargs={'pk': 404}))
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+        response = self.client.get(reverse('api:WorkflowGetDeleteUpdate', kwargs={'pk': 404}))
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+
+class WorkflowBatchPostTestCase(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.url = reverse('api:WorkflowBatchPost')
+
+    def payload(self, number: int, steps: int = 2) -> dict:
+        return {
+            "name": "workflow %d" % number,
+            "description": "workflow description",
+            "steps": [{'name': 'step %d' % i, 'description': 'step description'} for i in range(steps)],
+        }
+
+    def test_api_can_post_a_batch(self):
+        """
+        Test the api creates every workflow of a JSON array with its steps.
+        """
+        response = self.client.post(self.url, [self.payload(i) for i in range(3)], format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(response.data['created'], 3)
+        ids = [result['id'] for result in response.data['results']]
+        self.assertEqual(ids, list(Workflow.objects.order_by('name').values_list('id', flat=True)))
+        self.assertEqual(WorkflowSteps.objects.filter(workflow_id=ids[1]).count(), 2)
+
+    def test_api_writes_dependencies(self):
+        """
+        Test the dependencies of the steps of each workflow refer to its own steps.
+        """
+        items = [self.payload(i, steps=3) for i in range(2)]
+        items[1]['steps'][2]['depends_on'] = [0, 1]
+        response = self.client.post(self.url, items, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        steps = list(WorkflowSteps.objects.filter(workflow_id=response.data['results'][1]['id']).values_list(
+            'id', flat=True))
+        self.assertEqual(sorted(StepDependency.objects.values_list('step_id', 'depends_on')),
+                         [(steps[2], steps[0]), (steps[2], steps[1])])
+
+    def test_api_can_post_ndjson(self):
+        """
+        Test the api accepts one workflow per line.
+        """
+        body = '\n'.join(json.dumps(self.payload(i)) for i in range(2)) + '\n'
+        response = self.client.post(self.url, body, content_type='application/x-ndjson')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(Workflow.objects.count(), 2)
+
+    def test_api_reports_partial_failures(self):
+        """
+        Test invalid items are reported while the valid ones are created.
+        """
+        items = [self.payload(0), {"name": "no steps"}, self.payload(0, steps=1)]
+        response = self.client.post(self.url, items, format='json')
+        self.assertEqual(response.status_code, status.HTTP_207_MULTI_STATUS)
+        results = response.data['results']
+        self.assertEqual([result['status'] for result in results], [201, 400, 201])
+        self.assertIn('steps', results[1]['errors'])
+        # Duplicates of the same workflow are merged, like single posts.
+        self.assertEqual(results[0]['id'], results[2]['id'])
+        self.assertEqual(WorkflowSteps.objects.count(), 3)
+
+    def test_api_rejects_a_non_list(self):
+        """
+        Test the api requires a list of workflows.
+        """
+        response = self.client.post(self.url, self.payload(0), format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class WorkflowExportTestCase(QueryCountMixin, TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        for number in range(3):
+            workflow = Workflow.objects.create(name="workflow %d" % number, description="description, quoted \"")
+            WorkflowSteps.objects.create(workflow_id=workflow, name="step", description="step", status=1)
+            Comment.objects.create(workflow_id=workflow, name="comment", text="line\nbreak")
+
+    def test_api_can_export_ndjson(self):
+        """
+        Test the export streams one workflow per line, with its steps and comments.
+        """
+        response = self.client.get(reverse('api:WorkflowExport', kwargs={'export_format': 'ndjson'}))
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        lines = b''.join(response.streaming_content).decode().splitlines()
+        workflows = [json.loads(line) for line in lines]
+        self.assertEqual([workflow['name'] for workflow in workflows], ['workflow 0', 'workflow 1', 'workflow 2'])
+        self.assertEqual(workflows[0]['steps'][0]['status'], 1)
+        self.assertEqual(workflows[2]['comments'][0]['text'], "line\nbreak")
+
+    def test_api_can_export_csv(self):
+        """
+        Test the CSV export has a row per workflow, step and comment.
+        """
+        response = self.client.get(reverse('api:WorkflowExport', kwargs={'export_format': 'csv'}),
+                                   HTTP_ACCEPT='text/csv')
+        rows = list(csv.DictReader(io.StringIO(b''.join(response.streaming_content).decode())))
+        self.assertEqual([row['record'] for row in rows], ['workflow', 'step', 'comment'] * 3)
+        self.assertEqual(rows[0]['text'], "description, quoted \"")
+
+    def test_export_queries_per_chunk(self):
+        """
+        Test the export reads the workflows in one query, plus two queries per chunk for their children.
+        """
+        with self.assertNumQueries(5):
+            self.assertEqual(len(list(ndjson_lines(chunk_size=2))), 3)
+
+    def test_children_are_merged_with_their_workflow(self):
+        """
+        Test the streamed children go to their own workflow when some workflows have none.
+        """
+        first, second, third = Workflow.objects.order_by('id')
+        WorkflowSteps.objects.filter(workflow_id=second).delete()
+        Comment.objects.filter(workflow_id=third).delete()
+        Comment.objects.create(workflow_id=first, name="second comment", text="text")
+        workflows = [json.loads(line) for line in ndjson_lines(chunk_size=2)]
+        self.assertEqual([len(workflow['steps']) for workflow in workflows], [1, 0, 1])
+        self.assertEqual([[comment['name'] for comment in workflow['comments']] for workflow in workflows],
+                         [['comment', 'second comment'], ['comment'], []])
+
+    def test_export_command(self):
+        """
+        Test the management command writes the same export.
+        """
+        output = io.StringIO()
+        call_command('export_workflows', '--format', 'ndjson', stdout=output)
+        self.assertEqual(output.getvalue(), ''.join(ndjson_lines()))
+
+
+@override_settings(SERVER_TIMING=True, SERVER_TIMING_REPEATED_QUERIES=3)
+class ServerTimingTestCase(TestCase):
+    def setUp(self):
+        self.workflows = [Workflow.objects.create(name="workflow %d" % number, description="description")
+                          for number in range(3)]
+
+    def metrics(self, response) -> dict:
+        metrics = {}
+        for metric in response['Server-Timing'].split(', '):
+            name, *params = metric.split(';')
+            metrics[name] = dict(param.split('=', 1) for param in params)
+        return metrics
+
+    def test_response_carries_timings(self):
+        """
+        Test the header and the log line hold the query count and the SQL, serializer, render and total times.
+        """
+        with self.assertLogs('api.utils.timing', 'INFO') as logs:
+            response = self.client.get(reverse('api:WorkflowListPost'))
+        metrics = self.metrics(response)
+
+        self.assertEqual(list(metrics), ['db', 'serializer', 'render', 'total'])
+        self.assertEqual(metrics['db']['desc'], '"2 queries"')
+        self.assertGreaterEqual(float(metrics['total']['dur']),
+                                sum(float(metrics[name]['dur']) for name in ('db', 'serializer', 'render')))
+        self.assertEqual(len(logs.records), 1)
+        self.assertIn("GET /api/workflow/ 200 queries=2 db_ms=", logs.output[0])
+        self.assertEqual(logs.records[0].timing['queries'], 2)
+        self.assertEqual(logs.records[0].timing['repeated'], [])
+
+    def test_repeated_statements_are_flagged(self):
+        """
+        Test a statement run with different parameters as often as the threshold is reported as an N+1 query.
+        """
+        def view(request):
+            for workflow in self.workflows:
+                Workflow.objects.get(pk=workflow.pk)
+            return HttpResponse()
+
+        with self.assertLogs('api.utils.timing', 'INFO') as logs:
+            response = ServerTimingMiddleware(view)(RequestFactory().get('/'))
+
+        self.assertEqual(self.metrics(response)['nplusone']['desc'], '"1 repeated statements"')
+        self.assertEqual(logs.records[0].timing['repeated'][0]['runs'], 3)
+        self.assertIn('SELECT', logs.records[0].timing['repeated'][0]['sql'])
+        self.assertEqual(logs.records[1].levelname, 'WARNING')
+
+    @override_settings(SERVER_TIMING=False)
+    def test_disabled(self):
+        """
+        Test the middleware takes itself out of the chain when disabled.
+        """
+        with self.assertRaises(MiddlewareNotUsed):
+            ServerTimingMiddleware(lambda request: HttpResponse())
+        self.assertNotIn('Server-Timing', self.client.get(reverse('api:WorkflowListPost')))
+
+
+@override_settings(METRICS=True)
+class MetricsTestCase(TestCase):
+    def setUp(self):
+        self.workflow = Workflow.objects.create(name="workflow", description="description")
+
+    def scrape(self) -> dict:
+        response = self.client.get('/metrics')
+        self.assertEqual(response['Content-Type'], 'text/plain; version=0.0.4; charset=utf-8')
+        return dict(line.rsplit(' ', 1) for line in response.content.decode().splitlines()
+                    if not line.startswith('#'))
+
+    def test_requests_are_measured_by_url_name(self):
+        """
+        Test the requests, their latency, queries, serializer time and the cache events are exposed by URL name.
+        """
+        detail = reverse('api:WorkflowGetDeleteUpdate', kwargs={'pk': self.workflow.pk})
+        before = self.scrape()
+        self.client.get(reverse('api:WorkflowListPost'))
+        self.client.get(detail)
+        self.client.get(detail)
+        after = self.scrape()
+
+        def delta(sample):
+            return float(after[sample]) - float(before.get(sample, 0))
+
+        view = 'view="api:WorkflowListPost"'
+        self.assertEqual(delta('workflow_http_requests_total{%s,method="GET",status="200"}' % view), 1)
+        self.assertEqual(delta('workflow_http_request_duration_seconds_count{%s}' % view), 1)
+        self.assertEqual(delta('workflow_http_request_duration_seconds_bucket{%s,le="+Inf"}' % view), 1)
+        self.assertEqual(delta('workflow_db_queries_total{%s}' % view), 2)
+        self.assertEqual(delta('workflow_serializer_duration_seconds_count{%s}' % view), 1)
+        self.assertEqual(
+            delta('workflow_http_requests_total{view="api:WorkflowGetDeleteUpdate",method="GET",status="200"}'), 2)
+        self.assertEqual(delta('workflow_detail_cache_events_total{event="hits"}'), 1)
+        self.assertEqual(delta('workflow_detail_cache_events_total{event="misses"}'), 1)
+
+    def test_registry_sums_threads_and_processes(self):
+        """
+        Test the values recorded by several threads, and by the processes sharing a directory, are summed.
+        """
+        registry = Registry()
+        requests = registry.counter('requests_total', 'Requests.', ('view',))
+        latency = registry.histogram('latency_seconds', 'Latency.', buckets=(0.1, 1))
+        threads = [threading.Thread(target=lambda: [requests.inc('list') for _ in range(100)]) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        for value in (0.05, 0.1, 0.5, 5):
+            latency.observe(value)
+
+        with tempfile.TemporaryDirectory() as directory, self.settings(METRICS_DIRECTORY=directory):
+            # The snapshot of another worker.
+            with open(os.path.join(directory, '%d.json' % (os.getpid() + 1)), 'w') as stream:
+                json.dump([['requests_total', ['list'], 10], ['requests_total', ['detail'], 1],
+                           ['latency_seconds', [], [0, 1, 0, 1.0, 1]]], stream)
+            lines = registry.exposition().splitlines()
+
+        self.assertIn('# TYPE requests_total counter', lines)
+        self.assertIn('requests_total{view="list"} 410', lines)
+        self.assertIn('requests_total{view="detail"} 1', lines)
+        self.assertEqual(lines[-5:], [
+            'latency_seconds_bucket{le="0.1"} 2',
+            'latency_seconds_bucket{le="1"} 4',
+            'latency_seconds_bucket{le="+Inf"} 5',
+            'latency_seconds_sum 6.65',
+            'latency_seconds_count 5',
+        ])
+
+    def test_registry_folds_the_threads_that_ended(self):
+        """
+        Test the values of the threads that ended are kept once their dicts are dropped.
+        """
+        registry = Registry()
+        requests = registry.counter('requests_total', 'Requests.', ('view',))
+        latency = registry.histogram('latency_seconds', 'Latency.', buckets=(0.1, 1))
+        for _ in range(10):
+            thread = threading.Thread(target=lambda: (requests.inc('list'), latency.observe(0.5)))
+            thread.start()
+            thread.join()
+        # Each thread registering drops the dict of the one before it.
+        self.assertEqual(len(registry.shards), 1)
+        registry.snapshot()
+        self.assertEqual(registry.shards, [])
+        requests.inc('list')
+        values = registry.snapshot()
+        self.assertEqual(len(registry.shards), 1)
+        self.assertEqual(values[('requests_total', ('list',))], 11)
+        self.assertEqual(values[('latency_seconds', ())], [0, 10, 0, 5.0, 10])
+
+
+@override_settings(DATABASE_REPLICAS=['replica'], DATABASE_REPLICA_STICKINESS=60)
+class ReplicaRoutingTestCase(ReplicaMixin, TransactionTestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.workflow = Workflow.objects.create(name="replicated workflow", description="description")
+        self.sync_replica()
+        # Written after the last replication.
+        self.lagging = Workflow.objects.create(name="lagging workflow", description="description")
+
+    def names(self) -> list:
+        response = self.client.get(reverse('api:WorkflowListPost'))
+        return [workflow['name'] for workflow in response.json()['results']]
+
+    def test_reads_go_to_the_replica(self):
+        """
+        Test the lists of GET requests are read from the replica.
+        """
+        self.assertEqual(self.names(), ["replicated workflow"])
+        self.sync_replica()
+        self.assertEqual(self.names(), ["replicated workflow", "lagging workflow"])
+
+    def test_writes_go_to_the_primary_and_stick(self):
+        """
+        Test a write, and its validation, use the primary, and its client reads from it for a while.
+        """
+        response = self.client.post(reverse('api:CommentListPost'),
+                                    {'workflow_id': self.lagging.id, 'name': "comment", 'text': "text"}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(Comment.objects.using('default').count(), 1)
+        self.assertEqual(Comment.objects.using('replica').count(), 0)
+
+        self.assertIn(STICKY_COOKIE, response.cookies)
+        self.assertEqual(self.names(), ["replicated workflow", "lagging workflow"])
+        # Past the window.
+        self.client.cookies[STICKY_COOKIE] = '0'
+        self.assertEqual(self.names(), ["replicated workflow"])
+
+    @override_settings(SQLITE_WRITER_QUEUE=True)
+    def test_writes_through_the_writer_queue_stick(self):
+        """
+        Test a write run by the writer thread makes its client stick to the primary too.
+        """
+        try:
+            response = self.client.post(reverse('api:CommentListPost'),
+                                        {'workflow_id': self.lagging.id, 'name': "comment", 'text': "text"},
+                                        format='json')
+        finally:
+            close_writer()
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertIn(STICKY_COOKIE, response.cookies)
+
+    def test_detail_cache_is_built_from_the_primary(self):
+        """
+        Test the detail of a workflow changed since the last replication is built from the primary.
+        """
+        self.sync_replica()
+        self.lagging.name = "renamed workflow"
+        self.lagging.save()
+
+        response = self.client.get(reverse('api:WorkflowGetDeleteUpdate', kwargs={'pk': self.lagging.id}))
+        self.assertEqual(response.json()['name'], "renamed workflow")
+        self.assertEqual(Workflow.objects.using('replica').get(id=self.lagging.id).name, "lagging workflow")
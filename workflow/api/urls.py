@@ -9,10 +9,26 @@ urlpatterns = [
             views.WorkflowGetDeleteUpdate.as_view(),
             name='WorkflowGetDeleteUpdate'
             ),
+    re_path(r'^workflow/(?P<pk>[0-9]+)/comments/$',  # Url to list the comments of a workflow
+            views.WorkflowCommentList.as_view(),
+            name='WorkflowCommentList'
+            ),
+    re_path(r'^workflow/(?P<pk>[0-9]+)/runs/$',  # Url to list or start the runs of a workflow
+            views.WorkflowRunListPost.as_view(),
+            name='WorkflowRunListPost'
+            ),
     path('workflow/',  # urls list all and create new one
          views.WorkflowListPost.as_view(),
          name='WorkflowListPost'
          ),
+    path('workflow/batch/',  # url to create many workflows at once
+         views.WorkflowBatchPost.as_view(),
+         name='WorkflowBatchPost'
+         ),
+    re_path(r'^workflow/export\.(?P<export_format>ndjson|csv)$',  # url to export all workflows
+            views.WorkflowExport.as_view(),
+            name='WorkflowExport'
+            ),
     path('comment/',  # urls list all and create new one
          views.CommentListPost.as_view(),
          name='CommentListPost'
@@ -21,4 +37,8 @@ urlpatterns = [
             views.CommentGetDeleteUpdate.as_view(),
             name='CommentGetDeleteUpdate'
             ),
+    path('search/',  # url to search workflows, steps and comments
+         views.SearchList.as_view(),
+         name='SearchList'
+         ),
 ]
@@ -0,0 +1,107 @@
+"""
+Bulk insertion of workflows and their steps.
+
+Workflows are written with ``bulk_create`` in chunks, one transaction per chunk, so a
+failing chunk only fails its own items. They follow the deduplication of
+WorkflowSerializer.create: a workflow whose ``Workflow.DEDUPE_FIELDS`` match an
+existing workflow, or an earlier item of the batch, has its steps appended to it (see
+Workflow.DEDUPE_FIELDS for its guarantees). The dependencies of the steps are written
+for the workflows having some.
+"""
+from django.db import DatabaseError, transaction
+from django.utils import timezone
+from rest_framework import status
+
+from api.models import Workflow, WorkflowSteps
+from api.utils.cache import invalidate_detail
+from api.utils.graph import add_dependencies, saved_ids
+
+CHUNK_SIZE = 500
+
+
+def create_workflows(workflows: list) -> list:
+    """
+    Insert workflows with bulk_create and return their ids.
+
+    SQLite doesn't return the ids of bulk inserted rows, they are read back by uuid.
+    Args:
+        workflows (list): Unsaved Workflow instances
+    Returns:
+        list: The id of each workflow, in the same order
+    """
+    Workflow.objects.bulk_create(workflows)
+    ids = dict(Workflow.objects.filter(uuid__in=[workflow.uuid for workflow in workflows]).values_list('uuid', 'id'))
+    return [ids[workflow.uuid] for workflow in workflows]
+
+
+def insert_chunk(entries: list) -> dict:
+    """
+    Insert a chunk of validated workflows in the current transaction.
+
+    Args:
+        entries (list): (index, validated data) pairs
+    Returns:
+        dict: Result of each index
+    """
+    def key(data: dict) -> tuple:
+        return tuple(data[field] for field in Workflow.DEDUPE_FIELDS)
+
+    # Walk matches from the newest so that the oldest one wins, like WorkflowSerializer.create.
+    existing = {
+        key(workflow): workflow['id']
+        for workflow in Workflow.objects.filter(name__in={data['name'] for index, data in entries}).values(
+            'id', *Workflow.DEDUPE_FIELDS).order_by('-id')
+    }
+    appended = {existing[key(data)] for index, data in entries if key(data) in existing}
+
+    new = {}
+    for index, data in entries:
+        if key(data) not in existing and key(data) not in new:
+            new[key(data)] = Workflow(**{field: value for field, value in data.items() if field != 'steps'})
+    existing.update(zip(new.keys(), create_workflows(list(new.values()))))
+
+    # Step ids only make sense on update, a new step always gets a fresh one.
+    steps = WorkflowSteps.objects.bulk_create(
+        WorkflowSteps(workflow_id_id=existing[key(data)],
+                      **{field: value for field, value in step.items() if field not in ('id', 'depends_on')})
+        for index, data in entries for step in data['steps']
+    )
+    start = 0
+    for index, data in entries:
+        items, start = data['steps'], start + len(data['steps'])
+        if any(item.get('depends_on') for item in items):
+            add_dependencies(existing[key(data)], saved_ids(steps[start - len(items):start]), items)
+    if appended:
+        Workflow.objects.filter(id__in=appended).update(modified_at=timezone.now())
+        for pk in appended:
+            invalidate_detail(pk)
+
+    return {
+        index: {'index': index, 'status': status.HTTP_201_CREATED, 'id': existing[key(data)]}
+        for index, data in entries
+    }
+
+
+def insert_workflows(entries: list, chunk_size: int = CHUNK_SIZE) -> dict:
+    """
+    Insert validated workflows in chunked transactions.
+
+    Args:
+        entries (list): (index, validated data) pairs, the data as produced by WorkflowSerializer
+        chunk_size (int): Number of workflows per transaction
+    Returns:
+        dict: Result of each index, with the workflow id or the database error
+    """
+    results = {}
+    for start in range(0, len(entries), chunk_size):
+        chunk = entries[start:start + chunk_size]
+        try:
+            with transaction.atomic():
+                results.update(insert_chunk(chunk))
+        except DatabaseError as exc:
+            results.update(
+                (index, {'index': index, 'status': status.HTTP_500_INTERNAL_SERVER_ERROR,
+                         'errors': {'non_field_errors': [str(exc)]}})
+                for index, data in chunk
+            )
+    return results
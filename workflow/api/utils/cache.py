@@ -0,0 +1,153 @@
+"""
+Response cache of the workflow detail endpoint.
+
+Entries are keyed by workflow id and version. Writing a workflow, one of its steps or
+one of its comments bumps the version of the workflow (see api.signals), so outdated
+entries are never read again and age out of the cache. A version starts from the
+current time rather than 1, so that a version key lost by the cache can't bring back
+entries of an earlier version.
+
+Lists have a version per table instead, bumped by every write of the table, deletions
+included, so that the validators of a list page don't have to aggregate the table (see
+api.utils.conditional).
+"""
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+
+from api.utils.metrics import CACHE_EVENTS
+from api.utils.routers import use_primary
+
+VERSION_KEY = 'workflow:{}:version'
+DATA_KEY = 'workflow:{}:{}:data'
+STORED_KEY = 'workflow:{}:{}:stored'
+STATS_KEY = 'workflow:stats:{}'
+LIST_VERSION_KEY = 'list:{}:version'
+STATS = ('hits', 'misses', 'evictions', 'invalidations')
+
+
+def get_cache():
+    return caches[settings.WORKFLOW_DETAIL_CACHE]
+
+
+def count(cache, stat: str):
+    CACHE_EVENTS.inc(stat)
+    try:
+        cache.incr(STATS_KEY.format(stat))
+    except ValueError:
+        cache.add(STATS_KEY.format(stat), 1, timeout=None)
+
+
+def get_version(cache, pk: int) -> int:
+    key = VERSION_KEY.format(pk)
+    version = cache.get(key)
+    if version is None:
+        cache.add(key, time.time_ns(), timeout=None)
+        version = cache.get(key)
+    return version
+
+
+def get_detail(pk: int, build, fields: tuple = None):
+    """
+    Return the cached detail of a workflow, building and caching it on a miss.
+
+    A miss on an entry that was stored and not invalidated since is also counted as an
+    eviction: the backend dropped it for room or because it timed out. Sparse fieldsets
+    are cached apart from the full detail, under the same version.
+    Args:
+        pk (int): Identifier of the workflow
+        build (callable): Return the detail of the workflow, called on a miss
+        fields (tuple): Names of the rendered fields, None for every field
+    Returns:
+        dict: The serialized workflow
+    """
+    pk, cache = int(pk), get_cache()
+    version = get_version(cache, pk)
+    data_key, stored_key = DATA_KEY.format(pk, version), STORED_KEY.format(pk, version)
+    if fields is not None:
+        variant = ':' + ','.join(fields)
+        data_key, stored_key = data_key + variant, stored_key + variant
+
+    found = cache.get_many([data_key, stored_key])
+    if data_key in found:
+        count(cache, 'hits')
+        return found[data_key]
+    count(cache, 'misses')
+    if stored_key in found:
+        count(cache, 'evictions')
+
+    # A replica may not have the latest version of the workflow yet.
+    with use_primary():
+        data = build()
+    cache.set(data_key, data)
+    timeout = cache.default_timeout and cache.default_timeout * 2
+    cache.set(stored_key, True, timeout=timeout)
+    return data
+
+
+def bump_version(pk: int):
+    cache = get_cache()
+    try:
+        cache.incr(VERSION_KEY.format(pk))
+    except ValueError:
+        # Nothing was cached for this workflow since the version key was lost.
+        return
+    count(cache, 'invalidations')
+
+
+def invalidate_detail(pk: int):
+    """
+    Invalidate the cached detail of a workflow.
+
+    The version is bumped right away and once more when the current transaction
+    commits, so a detail cached by a concurrent request in between is dropped too.
+    Args:
+        pk (int): Identifier of the workflow
+    """
+    bump_version(pk)
+    transaction.on_commit(lambda: bump_version(pk))
+
+
+def get_list_versions(models: tuple) -> tuple:
+    """
+    Return the list versions of the tables of models, starting the missing ones.
+    """
+    cache, keys = get_cache(), [LIST_VERSION_KEY.format(model._meta.db_table) for model in models]
+    found = cache.get_many(keys)
+    for key in keys:
+        if key not in found:
+            cache.add(key, time.time_ns(), timeout=None)
+            found[key] = cache.get(key)
+    return tuple(found[key] for key in keys)
+
+
+def bump_list_version(key: str):
+    try:
+        get_cache().incr(key)
+    except ValueError:
+        # The next read starts a later version.
+        pass
+
+
+def invalidate_lists(model):
+    """
+    Change the validators of the lists reading the table of a model.
+
+    As for a detail, the version is bumped right away and once more on commit.
+    Args:
+        model (Model): Written model
+    """
+    key = LIST_VERSION_KEY.format(model._meta.db_table)
+    bump_list_version(key)
+    transaction.on_commit(lambda: bump_list_version(key))
+
+
+def stats() -> dict:
+    """
+    Return the hit, miss, eviction and invalidation counters of the cache.
+    """
+    cache = get_cache()
+    found = cache.get_many([STATS_KEY.format(stat) for stat in STATS])
+    return {stat: found.get(STATS_KEY.format(stat), 0) for stat in STATS}
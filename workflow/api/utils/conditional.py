@@ -0,0 +1,106 @@
+"""
+Validators for conditional GET requests (ETag, Last-Modified and 304 Not Modified).
+
+The validators of a detail are computed with a single aggregate query, before anything
+is serialized. Counts are part of its ETag because deleting a row does not move the
+latest ``modified_at``.
+
+The validators of a list page are computed from the rows of the page and the list
+versions of the tables it reads (see api.utils.cache), so they cost no more than reading
+the page. Lists have no Last-Modified, which a deletion would not move either.
+"""
+import hashlib
+
+from django.db.models import Count, Max, OuterRef, Subquery, IntegerField, DateTimeField
+from django.db.models.functions import Coalesce
+from django.http import Http404
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date
+
+from api.models import Workflow, WorkflowSteps, Comment
+from api.utils.cache import get_list_versions
+
+
+class Validators:
+    """
+    ETag and Last-Modified of a resource.
+
+    Attributes:
+        etag (str): Quoted strong entity tag
+        last_modified (datetime): Latest modification of the resource, None if unknown
+    """
+    # Columns of the rows of a list page read for its validators, see for_list().
+    ROW_FIELDS = ('id', 'modified_at')
+
+    def __init__(self, request, last_modified, *state):
+        # The tag also depends on the url (page, filters) and the negotiated media type.
+        parts = (request.get_full_path(), request.accepted_media_type, last_modified) + state
+        self.etag = '"%s"' % hashlib.md5('|'.join(str(part) for part in parts).encode('utf-8')).hexdigest()
+        self.last_modified = last_modified
+
+    @classmethod
+    def for_list(cls, request, models: tuple, page: list) -> 'Validators':
+        """
+        Validators of a page of a list, whose rows are read with ROW_FIELDS.
+
+        The list versions of the tables cover the count and the links of the page; the
+        rows also catch the changes of the page made by another worker when the cache
+        is not shared between workers.
+        Args:
+            models (tuple): Models of the tables read by the list
+            page (list): Dicts of the rows of the page, before their conversion
+        """
+        rows = [(row['id'], row['modified_at']) for row in page]
+        return cls(request, None, get_list_versions(models), rows)
+
+    @classmethod
+    def for_workflow(cls, request, pk: int) -> 'Validators':
+        """
+        Validators of a workflow detail, covering its steps and comments.
+
+        Raises:
+            Http404: The workflow doesn't exist
+        """
+        children = {}
+        for name, model in (('steps', WorkflowSteps), ('comments', Comment)):
+            related = model.objects.filter(workflow_id=OuterRef('pk')).order_by().values('workflow_id')
+            children[name + '_modified'] = Subquery(
+                related.annotate(last=Max('modified_at')).values('last'), output_field=DateTimeField())
+            children[name + '_count'] = Coalesce(Subquery(
+                related.annotate(count=Count('id')).values('count'), output_field=IntegerField()), 0)
+        row = Workflow.objects.filter(pk=pk).values('modified_at', **children).first()
+        if row is None:
+            raise Http404
+        last_modified = max(row[key] for key in ('modified_at', 'steps_modified', 'comments_modified')
+                            if row[key] is not None)
+        return cls(request, last_modified, row['steps_count'], row['comments_count'])
+
+    @classmethod
+    def for_comment(cls, request, pk: int) -> 'Validators':
+        """
+        Raises:
+            Http404: The comment doesn't exist
+        """
+        last_modified = Comment.objects.filter(pk=pk).values_list('modified_at', flat=True).first()
+        if last_modified is None:
+            raise Http404
+        return cls(request, last_modified)
+
+    def not_modified(self, request):
+        """
+        Return a 304 response if the client already has this version of the resource, else None.
+        """
+        timestamp = self.last_modified and int(self.last_modified.timestamp())
+        response = get_conditional_response(request, etag=self.etag, last_modified=timestamp)
+        if response is not None:
+            self.apply(response)
+        return response
+
+    def apply(self, response):
+        """
+        Set the ETag and Last-Modified headers of a response and return it.
+        """
+        response['ETag'] = self.etag
+        if self.last_modified is not None:
+            response['Last-Modified'] = http_date(self.last_modified.timestamp())
+        return response
@@ -0,0 +1,175 @@
+"""
+Counters of the live steps and comments of each workflow, stored on the workflow.
+
+Lists render "12 steps, 3 active, 480 comments" from these columns instead of
+aggregating the children of every row. A counter is never read and written back: each
+change is an UPDATE adding a delta with an F() expression, in the transaction writing
+the steps or comments, so concurrent writers can't lose each other's changes. Changing
+the counters also bumps ``modified_at`` of the workflow, so that conditional GETs of the
+lists see the new counts.
+
+The models count their own writes (see api.models.CountedModel): saving and deleting
+instances, bulk_create, bulk_update and soft_delete. ``QuerySet.update()`` of a counted
+field and raw SQL are not counted, the ``recount`` command repairs the counters then.
+"""
+import threading
+from collections import Counter, defaultdict
+from contextlib import contextmanager
+from functools import reduce
+from operator import add, or_
+
+from django.db import transaction
+from django.db.models import Count, F, IntegerField, OuterRef, Q, Subquery
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from api.models import Workflow, WorkflowSteps, Comment
+
+BATCH_SIZE = 500
+
+
+def add_deltas(deltas: dict, model, rows, sign: int) -> dict:
+    """
+    Add the rows of a counted model to a set of deltas.
+
+    Args:
+        deltas (dict): Counter of the deltas of each workflow counter, by workflow id
+        model (CountedModel): Model of the rows
+        rows (iterable): Values of ``model.COUNTED_FIELDS``, None for uncounted rows
+        sign (int): 1 for added rows, -1 for removed rows
+    Returns:
+        dict: The deltas
+    """
+    for row in rows:
+        if row is not None:
+            for counter in model.counters(row):
+                deltas[row[0]][counter] += sign
+    return deltas
+
+
+def update_counters(deltas: dict):
+    """
+    Add deltas to the counters of workflows.
+
+    Workflows receiving the same deltas, e.g. one comment each, are updated together,
+    so a bulk insert runs a handful of UPDATE queries rather than one per workflow.
+    Args:
+        deltas (dict): Counter of the deltas of each workflow counter, by workflow id
+    """
+    workflows = defaultdict(list)
+    for pk, delta in deltas.items():
+        delta = tuple(sorted((counter, value) for counter, value in delta.items() if value))
+        if delta:
+            workflows[delta].append(pk)
+
+    now = timezone.now()
+    for delta, ids in workflows.items():
+        Workflow.all_objects.filter(id__in=sorted(ids)).update(
+            modified_at=now, **{counter: F(counter) + value for counter, value in delta})
+
+
+def count_rows(model, rows, sign: int = 1):
+    """
+    Add rows of a counted model to the counters of their workflows, or remove them.
+    """
+    update_counters(add_deltas(defaultdict(Counter), model, rows, sign))
+
+
+def count_instances(instances: list):
+    """
+    Add new instances of a counted model to the counters of their workflows.
+    """
+    for instance in instances:
+        instance.counted_row = instance.get_counted_row()
+    if instances:
+        count_rows(type(instances[0]), [instance.counted_row for instance in instances])
+
+
+def count_changes(instances: list):
+    """
+    Move saved instances between counters, from their counted row as read to their current one.
+
+    Instances without a counted row, read without the counted fields, are left out.
+    """
+    deltas = defaultdict(Counter)
+    for instance in instances:
+        if not hasattr(instance, 'counted_row'):
+            continue
+        row = instance.get_counted_row()
+        if row != instance.counted_row:
+            add_deltas(deltas, type(instance), [instance.counted_row], -1)
+            add_deltas(deltas, type(instance), [row], 1)
+            instance.counted_row = row
+    update_counters(deltas)
+
+
+_deleting = threading.local()
+
+
+@contextmanager
+def deleting_workflows(ids):
+    """
+    Leave alone the counters of workflows being deleted, while their children are deleted with them.
+
+    Args:
+        ids (iterable): Identifiers of the workflows
+    """
+    previous = getattr(_deleting, 'ids', frozenset())
+    _deleting.ids = previous.union(ids)
+    try:
+        yield
+    finally:
+        _deleting.ids = previous
+
+
+def is_deleting(pk: int) -> bool:
+    return pk in getattr(_deleting, 'ids', ())
+
+
+def live_count(model, **filters) -> Coalesce:
+    """
+    Return the number of live rows of a model for each workflow, as a subquery.
+    """
+    rows = model.all_objects.filter(workflow_id=OuterRef('pk'), deleted=False, **filters).order_by()
+    return Coalesce(Subquery(rows.values('workflow_id').annotate(count=Count('id')).values('count'),
+                             output_field=IntegerField()), 0)
+
+
+def actual_counts() -> dict:
+    """
+    Return the expressions computing each counter from the rows.
+
+    The steps are counted by status from the (status, workflow_id) index, their total
+    being the sum.
+    """
+    statuses = {counter: live_count(WorkflowSteps, status=status)
+                for status, counter in WorkflowSteps.STATUS_COUNTERS.items()}
+    return dict(statuses, step_count=reduce(add, statuses.values()), comment_count=live_count(Comment))
+
+
+def recount(batch_size: int = BATCH_SIZE):
+    """
+    Recompute the counters of the live workflows from their rows, batch by batch.
+
+    Each batch is one transaction: the drifted workflows are found, then updated from
+    the rows with subqueries, so steps or comments written meanwhile are not missed.
+    Args:
+        batch_size (int): Number of workflows checked per transaction
+    Yields:
+        tuple: (number of workflows checked, ids of the repaired workflows) for each batch
+    """
+    last = 0
+    while True:
+        with transaction.atomic():
+            ids = list(Workflow.objects.filter(id__gt=last).order_by('id').values_list('id', flat=True)[:batch_size])
+            if not ids:
+                break
+            counts = actual_counts()
+            drifted = list(Workflow.objects.filter(id__in=ids).annotate(
+                **{'actual_' + counter: expression for counter, expression in counts.items()}
+            ).filter(reduce(or_, (~Q(**{counter: F('actual_' + counter)}) for counter in counts))).values_list(
+                'id', flat=True))
+            if drifted:
+                Workflow.all_objects.filter(id__in=drifted).update(**counts)
+        last = ids[-1]
+        yield len(ids), drifted
@@ -0,0 +1,124 @@
+"""
+Streaming export of workflows with their steps and comments.
+
+Workflows are read with ``QuerySet.iterator()`` and, for every chunk of them, the steps
+and comments are fetched with one streamed query each, ordered like the workflows and
+merged with them: memory only depends on the chunk size and on the children of one
+workflow, not on those of the whole chunk. Step statuses are exported as their integer
+code.
+"""
+import csv
+import json
+from itertools import groupby, islice
+from operator import itemgetter
+
+from api.models import Workflow, WorkflowSteps, Comment
+
+CHUNK_SIZE = 500
+WORKFLOW_FIELDS = ('id', 'name', 'description', 'created_at', 'modified_at')
+STEP_FIELDS = ('id', 'workflow_id', 'name', 'description', 'status', 'created_at', 'modified_at')
+COMMENT_FIELDS = ('id', 'workflow_id', 'name', 'text', 'created_at', 'modified_at')
+CSV_HEADER = ('record', 'id', 'workflow_id', 'name', 'text', 'status', 'created_at', 'modified_at')
+CONTENT_TYPES = {
+    'ndjson': 'application/x-ndjson',
+    'csv': 'text/csv',
+}
+
+
+def isoformat(value) -> str:
+    # Same representation as the datetimes of the API responses.
+    value = value.isoformat()
+    return value[:-6] + 'Z' if value.endswith('+00:00') else value
+
+
+def children(model, fields: tuple, workflow_ids: list, chunk_size: int):
+    """
+    Yield the list of the rows of each workflow, in the order of ``workflow_ids``, from one streamed query.
+
+    Args:
+        model (Model): WorkflowSteps or Comment
+        fields (tuple): Fields of the rows
+        workflow_ids (list): Ids of the workflows, ascending
+        chunk_size (int): Number of rows read per round trip
+    """
+    def row(values: tuple) -> dict:
+        row = dict(zip(fields, values))
+        row['created_at'], row['modified_at'] = isoformat(row['created_at']), isoformat(row['modified_at'])
+        return row
+
+    queryset = model.objects.filter(workflow_id__in=workflow_ids).order_by('workflow_id', 'id').values_list(
+        *(field if field != 'workflow_id' else 'workflow_id_id' for field in fields))
+    groups = groupby(map(row, queryset.iterator(chunk_size=chunk_size)), key=itemgetter('workflow_id'))
+    group = next(groups, None)
+    for workflow_id in workflow_ids:
+        if group is not None and group[0] == workflow_id:
+            yield list(group[1])
+            group = next(groups, None)
+        else:
+            yield []
+
+
+def iter_workflows(chunk_size: int = CHUNK_SIZE):
+    """
+    Yield every workflow as a dict, with the lists of its steps and comments.
+
+    Args:
+        chunk_size (int): Number of workflows read per round trip
+    """
+    workflows = Workflow.objects.order_by('id').values_list(*WORKFLOW_FIELDS).iterator(chunk_size=chunk_size)
+    while True:
+        chunk = [dict(zip(WORKFLOW_FIELDS, row)) for row in islice(workflows, chunk_size)]
+        if not chunk:
+            return
+        ids = [workflow['id'] for workflow in chunk]
+        steps = children(WorkflowSteps, STEP_FIELDS, ids, chunk_size)
+        comments = children(Comment, COMMENT_FIELDS, ids, chunk_size)
+        for workflow, workflow_steps, workflow_comments in zip(chunk, steps, comments):
+            workflow['created_at'] = isoformat(workflow['created_at'])
+            workflow['modified_at'] = isoformat(workflow['modified_at'])
+            workflow['steps'] = workflow_steps
+            workflow['comments'] = workflow_comments
+            yield workflow
+
+
+def ndjson_lines(chunk_size: int = CHUNK_SIZE):
+    """
+    Yield the export as NDJSON, one workflow per line.
+    """
+    for workflow in iter_workflows(chunk_size):
+        yield json.dumps(workflow) + '\n'
+
+
+class Echo:
+    """
+    File-like object returning what is written to it, to stream the lines of csv.writer.
+    """
+
+    def write(self, value: str) -> str:
+        return value
+
+
+def csv_lines(chunk_size: int = CHUNK_SIZE):
+    """
+    Yield the export as CSV, one row per record.
+
+    Each workflow row is followed by the rows of its steps and comments; the text column
+    holds the description of workflows and steps and the text of comments.
+    """
+    writer = csv.writer(Echo())
+    yield writer.writerow(CSV_HEADER)
+    for workflow in iter_workflows(chunk_size):
+        yield writer.writerow(('workflow', workflow['id'], workflow['id'], workflow['name'], workflow['description'],
+                               '', workflow['created_at'], workflow['modified_at']))
+        for step in workflow['steps']:
+            yield writer.writerow(('step', step['id'], step['workflow_id'], step['name'], step['description'],
+                                   step['status'], step['created_at'], step['modified_at']))
+        for comment in workflow['comments']:
+            yield writer.writerow(('comment', comment['id'], comment['workflow_id'], comment['name'],
+                                   comment['text'], '', comment['created_at'], comment['modified_at']))
+
+
+FORMATS = {
+    'ndjson': ndjson_lines,
+    'csv': csv_lines,
+}
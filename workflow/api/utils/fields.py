@@ -0,0 +1,70 @@
+"""
+Sparse fieldsets: ``?fields=id,name`` narrows the fields rendered by an endpoint.
+
+The requested names are checked against the fields of the serializer before any query
+is run, and only the columns backing them are read from the database.
+"""
+from functools import lru_cache
+
+from django.core.exceptions import FieldDoesNotExist
+from rest_framework.exceptions import ValidationError
+
+FIELDS_PARAM = 'fields'
+
+
+@lru_cache(maxsize=None)
+def serializer_fields(serializer_class) -> dict:
+    """
+    Return the fields of a serializer class, built once and only read for their names and sources.
+    """
+    return serializer_class().fields
+
+
+def get_sparse_fields(request, fields) -> tuple:
+    """
+    Return the field names requested with ``?fields=``, in the order of the serializer.
+
+    Args:
+        request (Request): The request
+        fields (dict): Fields of the serializer, by name
+    Returns:
+        tuple: Requested names, None when every field is requested
+    Raises:
+        ValidationError: A requested name is not a field of the serializer
+    """
+    value = request.query_params.get(FIELDS_PARAM, '')
+    requested = {name.strip() for name in value.split(',')} - {''}
+    if not requested:
+        return None
+    unknown = requested.difference(fields)
+    if unknown:
+        raise ValidationError({FIELDS_PARAM: ['Unknown field(s): %s. Available fields: %s.' % (
+            ', '.join(sorted(unknown)), ', '.join(fields))]})
+    return tuple(name for name in fields if name in requested)
+
+
+def get_columns(model, fields, names) -> tuple:
+    """
+    Return the concrete model fields read to render some serializer fields, for ``QuerySet.only()``.
+
+    Relations (nested serializers) and sources that are not model fields, such as
+    annotations, are not columns of the model and are left out.
+    Args:
+        model (Model): Model of the serializer
+        fields (dict): Fields of the serializer, by name
+        names (tuple): Rendered field names
+    Returns:
+        tuple: Model field names, None when a field can't be mapped to a column
+    """
+    columns = []
+    for name in names:
+        source = fields[name].source
+        if source == '*':
+            return None
+        try:
+            field = model._meta.get_field(source.split('.')[0])
+        except FieldDoesNotExist:
+            continue
+        if field.concrete:
+            columns.append(field.name)
+    return tuple(columns)
@@ -0,0 +1,247 @@
+"""
+Dependencies between the steps of a workflow, precomputed in topological levels.
+
+The dependencies are stored as StepDependency rows, and with each change a WorkflowGraph
+of the workflow is stored too: its live steps in id order and, by position, the steps
+depending on each of them and the topological level of each, in compact JSON. A graph is
+never changed, a new one is stored instead, so graphs are parsed once per process and kept
+in an LRU cache by id. The id of a graph rolled back is used again by the next one: storing
+a graph empties the cache of its process.
+
+Scheduling a run needs no query of the dependencies: a run counts on each step run the
+dependencies left to run (``StepRun.waiting_on``), and when a step succeeds, the step runs
+of its dependents, read from the cached graph, count one less; those at zero are the new
+frontier of the run. Saving a graph with a cycle raises CycleError, which rolls back the
+dependencies written with it.
+"""
+import json
+from collections import defaultdict, deque
+from functools import lru_cache
+
+from django.db import connection, transaction
+from django.utils.functional import cached_property
+
+from api.models import StepDependency, WorkflowGraph, WorkflowSteps
+
+
+class CycleError(ValueError):
+    """
+    The dependencies of some steps form a cycle.
+
+    Attributes:
+        steps (list): The steps in a cycle or depending on one
+    """
+
+    def __init__(self, steps: list):
+        super().__init__('Dependencies form a cycle between steps %s.' % ', '.join(str(step) for step in steps))
+        self.steps = steps
+
+
+class StepGraph:
+    """
+    Steps and their dependencies, each step being numbered by its position in ``steps``.
+
+    Attributes:
+        steps (list): Step ids, in id order
+        children (list): Positions of the steps depending on each step
+        levels (list): Level of each step, the length of the longest chain of dependencies
+            leading to it: the steps of a level only depend on steps of lower levels
+    """
+
+    def __init__(self, steps: list, children: list, levels: list):
+        self.steps = steps
+        self.children = children
+        self.levels = levels
+
+    @classmethod
+    def build(cls, steps, edges) -> 'StepGraph':
+        """
+        Sort steps in topological levels (Kahn's algorithm), in O(steps + edges).
+
+        Args:
+            steps (iterable): Step ids, in id order
+            edges (iterable): (step, step it depends on) id pairs, pairs of unknown steps being ignored
+        Returns:
+            StepGraph: The graph of the steps
+        Raises:
+            CycleError: The dependencies form a cycle
+        """
+        steps = list(steps)
+        index = {step: position for position, step in enumerate(steps)}
+        children, parents = [[] for _ in steps], [0] * len(steps)
+        for step, depends_on in edges:
+            if step in index and depends_on in index:
+                children[index[depends_on]].append(index[step])
+                parents[index[step]] += 1
+
+        levels = [0] * len(steps)
+        ready = deque(position for position, count in enumerate(parents) if not count)
+        sorted_count = 0
+        while ready:
+            position = ready.popleft()
+            sorted_count += 1
+            for child in children[position]:
+                levels[child] = max(levels[child], levels[position] + 1)
+                parents[child] -= 1
+                if not parents[child]:
+                    ready.append(child)
+        if sorted_count < len(steps):
+            raise CycleError([steps[position] for position, count in enumerate(parents) if count])
+        return cls(steps, children, levels)
+
+    @classmethod
+    def loads(cls, data: str) -> 'StepGraph':
+        data = json.loads(data)
+        return cls(data['steps'], data['children'], data['levels'])
+
+    def dumps(self) -> str:
+        return json.dumps({'steps': self.steps, 'children': self.children, 'levels': self.levels},
+                          separators=(',', ':'))
+
+    @cached_property
+    def index(self) -> dict:
+        """
+        Return the position of each step, by id.
+        """
+        return {step: position for position, step in enumerate(self.steps)}
+
+    @cached_property
+    def parents(self) -> list:
+        """
+        Return the positions of the steps each step depends on.
+        """
+        parents = [[] for _ in self.steps]
+        for position, children in enumerate(self.children):
+            for child in children:
+                parents[child].append(position)
+        return parents
+
+    def edges(self) -> list:
+        """
+        Return the dependencies, as (step, step it depends on) id pairs.
+        """
+        return [(self.steps[child], step) for step, children in zip(self.steps, self.children) for child in children]
+
+    def level_sets(self) -> list:
+        """
+        Return the positions of the steps of each level, lowest level first.
+        """
+        levels = defaultdict(list)
+        for position, level in enumerate(self.levels):
+            levels[level].append(position)
+        return [levels[level] for level in sorted(levels)]
+
+    def dependents(self, step: int) -> list:
+        """
+        Return the ids of the steps depending on a step.
+        """
+        return [self.steps[child] for child in self.children[self.index[step]]]
+
+
+@lru_cache(maxsize=256)
+def get_graph(graph_id: int) -> StepGraph:
+    """
+    Return a stored graph, parsed once per process.
+    """
+    return StepGraph.loads(WorkflowGraph.objects.values_list('data', flat=True).get(id=graph_id))
+
+
+def latest_graph(workflow_id: int):
+    """
+    Return the id of the current graph of a workflow, None when it has none.
+    """
+    return WorkflowGraph.objects.filter(workflow_id=workflow_id).order_by('-id').values_list('id', flat=True).first()
+
+
+def save_graph(workflow_id: int) -> WorkflowGraph:
+    """
+    Store the graph of the live steps of a workflow as its current graph.
+
+    Graphs stored before and used by no run are removed.
+    Args:
+        workflow_id (int): Identifier of the workflow
+    Returns:
+        WorkflowGraph: The stored graph
+    Raises:
+        CycleError: The dependencies of the steps form a cycle
+    """
+    steps = WorkflowSteps.objects.filter(workflow_id=workflow_id).order_by('id').values_list('id', flat=True)
+    edges = StepDependency.objects.filter(workflow_id=workflow_id).values_list('step_id', 'depends_on')
+    graph = StepGraph.build(steps, edges)
+    with transaction.atomic(savepoint=False):
+        stored = WorkflowGraph.objects.create(workflow_id_id=workflow_id, data=graph.dumps())
+        WorkflowGraph.objects.filter(workflow_id=workflow_id, id__lt=stored.id, runs__isnull=True).delete()
+    get_graph.cache_clear()
+    return stored
+
+
+def current_graph(workflow_id: int, steps: list) -> tuple:
+    """
+    Return the current graph of a workflow, storing a new one when its steps aren't the live steps.
+
+    Steps inserted without the serializers, e.g. by the factories, have no dependencies but
+    must be in the graph.
+    Args:
+        workflow_id (int): Identifier of the workflow
+        steps (list): Ids of the live steps of the workflow, in id order
+    Returns:
+        tuple: The id of the graph and the StepGraph
+    """
+    graph_id = latest_graph(workflow_id)
+    if graph_id is not None and get_graph(graph_id).steps == steps:
+        return graph_id, get_graph(graph_id)
+    stored = save_graph(workflow_id)
+    return stored.id, StepGraph.loads(stored.data)
+
+
+def load_graph(workflow) -> StepGraph:
+    """
+    Return the graph of the steps of a workflow, as rendered: steps missing from the stored graph have no
+    dependencies, and deleted steps are left out.
+
+    Args:
+        workflow (Workflow): The workflow, with its steps prefetched
+    """
+    steps = [step.id for step in workflow.steps.all()]
+    graph_id = latest_graph(workflow.id)
+    graph = get_graph(graph_id) if graph_id is not None else None
+    if graph is not None and graph.steps == steps:
+        return graph
+    return StepGraph.build(steps, graph.edges() if graph is not None else ())
+
+
+def saved_ids(steps: list) -> list:
+    """
+    Return the ids of bulk created steps, read back by uuid where the database doesn't return them.
+    """
+    if all(step.pk is not None for step in steps):
+        return [step.pk for step in steps]
+    ids = dict(WorkflowSteps.objects.filter(uuid__in=[step.uuid for step in steps]).values_list('uuid', 'id'))
+    return [ids[step.uuid] for step in steps]
+
+
+def add_dependencies(workflow_id: int, steps: list, items: list, replace: bool = False):
+    """
+    Write the dependencies of steps given as positions in a list, then the graph of their workflow, in
+    the transaction writing the steps.
+
+    The dependencies are inserted with plain SQL: a workflow of thousands of steps has
+    several times as many dependencies, not worth a model instance each.
+    Args:
+        workflow_id (int): Identifier of the workflow
+        steps (list): Ids of the steps of the list
+        items (list): Validated step dicts, their ``depends_on`` being positions in the list
+        replace (bool): Whether the list holds every step of the workflow, replacing its dependencies
+    """
+    edges = [(workflow_id, steps[position], steps[parent])
+             for position, item in enumerate(items) for parent in item.get('depends_on', ())]
+    removed = replace and StepDependency.objects.filter(workflow_id=workflow_id).delete()[0]
+    if not (edges or removed):
+        return
+    if edges:
+        columns = (StepDependency._meta.get_field(field).column for field in ('workflow_id', 'step_id', 'depends_on'))
+        with connection.cursor() as cursor:
+            cursor.executemany('INSERT INTO {} ({}) VALUES (%s, %s, %s)'.format(
+                connection.ops.quote_name(StepDependency._meta.db_table),
+                ', '.join(connection.ops.quote_name(column) for column in columns)), edges)
+    save_graph(workflow_id)
@@ -0,0 +1,198 @@
+"""
+Bulk import of workflows, steps and comments in the NDJSON or CSV shape of the export
+(see api.utils.export).
+
+Records are parsed as a stream and checked by a lightweight validator instead of the
+DRF serializers, then inserted with bulk_create, one transaction per chunk of
+workflows. Ids and timestamps are assigned by the import, and no deduplication is done.
+The position reached in a file is saved in the transaction of each chunk (see
+api.models.ImportProgress), so an interrupted import resumes right after its last
+committed chunk without inserting any record twice.
+"""
+import csv
+import json
+from itertools import islice
+
+from django.db import transaction
+
+from api.models import Workflow, WorkflowSteps, Comment, ImportProgress
+from api.utils.bulk import create_workflows
+
+CHUNK_SIZE = 500
+STATUSES = {code for code, label in WorkflowSteps.STATUS_CHOICE_LIST}
+
+
+class InvalidRecord(ValueError):
+    pass
+
+
+def text_fields(model, *names) -> tuple:
+    return tuple((name, model._meta.get_field(name).max_length) for name in names)
+
+
+WORKFLOW_FIELDS = text_fields(Workflow, 'name', 'description')
+STEP_FIELDS = text_fields(WorkflowSteps, 'name', 'description')
+COMMENT_FIELDS = text_fields(Comment, 'name', 'text')
+
+
+def clean_text(record: dict, fields: tuple, label: str) -> dict:
+    cleaned = {}
+    for name, max_length in fields:
+        value = record.get(name)
+        if not isinstance(value, str) or not value.strip():
+            raise InvalidRecord('%s %s: this field may not be blank.' % (label, name))
+        if max_length is not None and len(value) > max_length:
+            raise InvalidRecord('%s %s: ensure this field has no more than %d characters.' % (
+                label, name, max_length))
+        cleaned[name] = value
+    return cleaned
+
+
+def clean_status(value) -> int:
+    if value in (None, ''):
+        return WorkflowSteps.DEFINITION
+    try:
+        value = int(value)
+    except (TypeError, ValueError):
+        value = None
+    if value not in STATUSES:
+        raise InvalidRecord('step status: "%s" is not a valid choice.' % value)
+    return value
+
+
+def validate(record) -> tuple:
+    """
+    Check a parsed record and keep the imported fields only.
+
+    Args:
+        record (dict): A workflow with its lists of steps and comments
+    Raises:
+        InvalidRecord: The record can't be imported
+    Returns:
+        tuple: The workflow fields, the list of step fields and the list of comment fields
+    """
+    if isinstance(record, InvalidRecord):
+        raise record
+    if not isinstance(record, dict):
+        raise InvalidRecord('expected a workflow object.')
+    steps, comments = record.get('steps', []), record.get('comments', [])
+    if not isinstance(steps, list) or not isinstance(comments, list):
+        raise InvalidRecord('steps and comments must be lists.')
+    if not all(isinstance(child, dict) for child in steps + comments):
+        raise InvalidRecord('expected step and comment objects.')
+    return (
+        clean_text(record, WORKFLOW_FIELDS, 'workflow'),
+        [dict(clean_text(step, STEP_FIELDS, 'step'), status=clean_status(step.get('status'))) for step in steps],
+        [clean_text(comment, COMMENT_FIELDS, 'comment') for comment in comments],
+    )
+
+
+def read_ndjson(lines):
+    """
+    Yield the records of an NDJSON export, one workflow per non blank line.
+    """
+    for line in lines:
+        if not line.strip():
+            continue
+        try:
+            yield json.loads(line)
+        except ValueError as exc:
+            yield InvalidRecord('invalid JSON: %s' % exc)
+
+
+def read_csv(lines):
+    """
+    Yield the records of a CSV export, grouping each workflow row with the step and
+    comment rows that follow it.
+    """
+    record = None
+    for row in csv.DictReader(lines):
+        kind = row.get('record')
+        if kind == 'workflow':
+            if record is not None:
+                yield record
+            record = {'name': row['name'], 'description': row['text'], 'steps': [], 'comments': []}
+        elif isinstance(record, InvalidRecord):
+            # The rows of a broken workflow are dropped with it.
+            continue
+        elif kind in ('step', 'comment') and record is not None:
+            if kind == 'step':
+                record['steps'].append({'name': row['name'], 'description': row['text'], 'status': row['status']})
+            else:
+                record['comments'].append({'name': row['name'], 'text': row['text']})
+        else:
+            error = InvalidRecord('unexpected %s row.' % (kind or 'untyped'))
+            if record is None:
+                yield error
+            else:
+                record = error
+    if record is not None:
+        yield record
+
+
+READERS = {
+    'ndjson': read_ndjson,
+    'csv': read_csv,
+}
+
+
+def insert_records(records: list) -> int:
+    """
+    Insert validated records in the current transaction.
+
+    Args:
+        records (list): Results of validate()
+    Returns:
+        int: Number of inserted rows
+    """
+    ids = create_workflows([Workflow(**fields) for fields, steps, comments in records])
+    steps = [WorkflowSteps(workflow_id_id=pk, **step) for pk, record in zip(ids, records) for step in record[1]]
+    comments = [Comment(workflow_id_id=pk, **comment) for pk, record in zip(ids, records) for comment in record[2]]
+    WorkflowSteps.objects.bulk_create(steps)
+    Comment.objects.bulk_create(comments)
+    return len(ids) + len(steps) + len(comments)
+
+
+def get_position(path: str = None) -> int:
+    """
+    Return the number of records of a file imported by previous runs.
+    """
+    if path is None:
+        return 0
+    return ImportProgress.objects.filter(path=path).values_list('position', flat=True).first() or 0
+
+
+def import_records(records, path: str = None, chunk_size: int = CHUNK_SIZE):
+    """
+    Import parsed records chunk by chunk, resuming the import of a file.
+
+    Yield after each committed chunk. The progress of the file is saved with the chunk
+    and removed once every record is imported.
+    Args:
+        records (iterator): Parsed records, as yielded by a reader
+        path (str): Absolute path of the imported file, None to import without progress
+        chunk_size (int): Number of records per transaction
+    Yields:
+        tuple: Number of records consumed so far, rows inserted by the chunk and the
+        (record number, error) of the records rejected by the chunk
+    """
+    position = get_position(path)
+    records = islice(records, position, None)
+    while True:
+        chunk = list(islice(records, chunk_size))
+        if not chunk:
+            break
+        valid, rejected = [], []
+        for number, record in enumerate(chunk, position + 1):
+            try:
+                valid.append(validate(record))
+            except InvalidRecord as exc:
+                rejected.append((number, str(exc)))
+        with transaction.atomic():
+            rows = insert_records(valid) if valid else 0
+            position += len(chunk)
+            if path is not None:
+                ImportProgress.objects.update_or_create(path=path, defaults={'position': position})
+        yield position, rows, rejected
+    if path is not None:
+        ImportProgress.objects.filter(path=path).delete()
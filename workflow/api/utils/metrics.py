@@ -0,0 +1,265 @@
+"""
+In-process metrics, served in the Prometheus text format at /metrics.
+
+Counters and histograms are recorded without locks: each thread adds to a dict of its
+own, and the dicts of all threads are summed when the metrics are read. A thread only
+takes the registry lock once, to register its dict. Histogram rows are tuples replaced
+whole, so that a dict copied while its thread records holds no half updated row. The
+dicts of the threads that ended, e.g. one per request with runserver, are folded into
+the values of the registry when a thread registers or the metrics are read.
+
+Each worker process has a registry of its own. With METRICS_DIRECTORY set to a directory
+shared by the workers, e.g. of gunicorn, a worker writes a snapshot of its metrics to
+``<pid>.json`` in it at most every METRICS_FLUSH_INTERVAL seconds, and /metrics sums the
+snapshots of all the workers. Like the counters of a worker, the snapshots outlive it:
+empty the directory when starting the server.
+"""
+import atexit
+import json
+import os
+import threading
+import time
+from bisect import bisect_left
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+
+from api.utils.timing import recording, time_rendering
+
+# Seconds.
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+class Metric:
+    kind = None
+
+    def __init__(self, registry, name: str, documentation: str, labels: tuple = ()):
+        self.registry = registry
+        self.name = name
+        self.documentation = documentation
+        self.labels = labels
+
+    def samples(self, key: tuple, value) -> list:
+        """
+        Return the samples of a labelled value, as (suffix, labels, value) tuples.
+        """
+        return [('', dict(zip(self.labels, key)), value)]
+
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def inc(self, *labels, amount: float = 1):
+        """
+        Add ``amount`` to the counter of the given label values.
+        """
+        values, key = self.registry.shard(), (self.name, labels)
+        values[key] = values.get(key, 0) + amount
+
+
+class Histogram(Metric):
+    """
+    Observations counted by bucket, stored as the counts of each bucket (not cumulated),
+    of the +Inf bucket, then the sum and the count of the observations.
+    """
+    kind = 'histogram'
+
+    def __init__(self, registry, name: str, documentation: str, labels: tuple = (), buckets: tuple = LATENCY_BUCKETS):
+        super().__init__(registry, name, documentation, labels)
+        self.buckets = buckets
+
+    def observe(self, value: float, *labels):
+        values, key = self.registry.shard(), (self.name, labels)
+        row = values.get(key)
+        row = list(row) if row is not None else [0] * (len(self.buckets) + 1) + [0.0, 0]
+        row[bisect_left(self.buckets, value)] += 1
+        row[-2] += value
+        row[-1] += 1
+        values[key] = tuple(row)
+
+    def samples(self, key: tuple, value) -> list:
+        labels, samples, cumulated = dict(zip(self.labels, key)), [], 0
+        for bound, count in zip(self.buckets + ('+Inf',), value):
+            cumulated += count
+            samples.append(('_bucket', dict(labels, le=str(bound)), cumulated))
+        return samples + [('_sum', labels, value[-2]), ('_count', labels, value[-1])]
+
+
+def merge(values: dict, other: dict):
+    """
+    Add the values of ``other`` to ``values``, a number or a histogram row by key.
+    """
+    for key, value in other.items():
+        if key not in values:
+            values[key] = list(value) if isinstance(value, (list, tuple)) else value
+        elif isinstance(value, (list, tuple)):
+            values[key] = [mine + theirs for mine, theirs in zip(values[key], value)]
+        else:
+            values[key] += value
+
+
+def escape(value: str) -> str:
+    return str(value).replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n')
+
+
+class Registry:
+    """
+    The metrics of a process, see the module documentation.
+    """
+
+    def __init__(self):
+        self.metrics = {}
+        # (thread, its values) of the live threads, and the values of the threads that ended.
+        self.shards = []
+        self.retired = {}
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        self.flushed = 0.0
+
+    def counter(self, name: str, documentation: str, labels: tuple = ()) -> Counter:
+        self.metrics[name] = Counter(self, name, documentation, labels)
+        return self.metrics[name]
+
+    def histogram(self, name: str, documentation: str, labels: tuple = (), **kwargs) -> Histogram:
+        self.metrics[name] = Histogram(self, name, documentation, labels, **kwargs)
+        return self.metrics[name]
+
+    def shard(self) -> dict:
+        """
+        Return the values recorded by the current thread.
+        """
+        try:
+            return self.local.values
+        except AttributeError:
+            values = self.local.values = {}
+            with self.lock:
+                self.retire()
+                self.shards.append((threading.current_thread(), values))
+            return values
+
+    def retire(self):
+        """
+        Fold the values of the threads that ended into ``retired``, with the lock held.
+        """
+        live = []
+        for thread, values in self.shards:
+            if thread.is_alive():
+                live.append((thread, values))
+            else:
+                merge(self.retired, values)
+        self.shards = live
+
+    def snapshot(self) -> dict:
+        """
+        Return the values of every thread of the process, summed.
+        """
+        values = {}
+        with self.lock:
+            self.retire()
+            merge(values, self.retired)
+            shards = [shard for thread, shard in self.shards]
+        # Copying a dict holds the GIL: a thread can't add a key or replace a row while it is copied.
+        for shard in shards:
+            merge(values, shard.copy())
+        return values
+
+    def flush(self, directory: str):
+        """
+        Write the snapshot of the process in ``directory``, replacing the previous one.
+        """
+        path = os.path.join(directory, '%d.json' % os.getpid())
+        with open(path + '.tmp', 'w') as stream:
+            json.dump([[name, labels, value] for (name, labels), value in self.snapshot().items()], stream)
+        os.replace(path + '.tmp', path)
+        self.flushed = time.monotonic()
+
+    def flush_if_due(self):
+        directory = settings.METRICS_DIRECTORY
+        if directory and time.monotonic() - self.flushed >= settings.METRICS_FLUSH_INTERVAL:
+            self.flush(directory)
+
+    def collect(self) -> dict:
+        """
+        Return the values of every process sharing METRICS_DIRECTORY, of this one only without it.
+        """
+        directory = settings.METRICS_DIRECTORY
+        if not directory:
+            return self.snapshot()
+        self.flush(directory)
+        values = {}
+        for name in sorted(os.listdir(directory)):
+            if name.endswith('.json'):
+                with open(os.path.join(directory, name)) as stream:
+                    merge(values, {(metric, tuple(labels)): value for metric, labels, value in json.load(stream)})
+        return values
+
+    def exposition(self) -> str:
+        """
+        Return the metrics in the Prometheus text format.
+        """
+        values, lines = self.collect(), []
+        for metric in self.metrics.values():
+            lines.append('# HELP %s %s' % (metric.name, metric.documentation))
+            lines.append('# TYPE %s %s' % (metric.name, metric.kind))
+            keys = sorted(key for key in values if key[0] == metric.name)
+            for name, key in keys:
+                value = values[name, key]
+                for suffix, labels, sample in metric.samples(key, value):
+                    labels = ','.join('%s="%s"' % (label, escape(text)) for label, text in labels.items())
+                    lines.append('%s%s%s %s' % (name, suffix, '{%s}' % labels if labels else '', sample))
+        return '\n'.join(lines) + '\n'
+
+
+registry = Registry()
+
+REQUESTS = registry.counter(
+    'workflow_http_requests_total', 'Requests answered, by URL name, method and status.', ('view', 'method', 'status'))
+LATENCY = registry.histogram(
+    'workflow_http_request_duration_seconds', 'Time to answer a request, by URL name.', ('view',))
+QUERIES = registry.counter('workflow_db_queries_total', 'Queries run by the requests, by URL name.', ('view',))
+SQL = registry.counter(
+    'workflow_db_duration_seconds_total', 'Time spent running the queries of the requests, by URL name.', ('view',))
+SERIALIZER = registry.histogram(
+    'workflow_serializer_duration_seconds', 'Time spent in serializers by a request, queries left out, by URL name.',
+    ('view',))
+CACHE_EVENTS = registry.counter(
+    'workflow_detail_cache_events_total', 'Hits, misses, evictions and invalidations of the workflow detail cache.',
+    ('event',))
+
+
+@atexit.register
+def flush_at_exit():
+    if settings.configured and getattr(settings, 'METRICS_DIRECTORY', None):
+        registry.flush(settings.METRICS_DIRECTORY)
+
+
+class MetricsMiddleware:
+    """
+    Record the latency, queries and serializer time of every request, by URL name.
+    """
+
+    def __init__(self, get_response):
+        if not getattr(settings, 'METRICS', False):
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+
+    def __call__(self, request):
+        start = time.perf_counter()
+        with recording() as timings:
+            response = self.get_response(request)
+        elapsed = time.perf_counter() - start
+
+        match = request.resolver_match
+        view = match.view_name if match is not None else 'unresolved'
+        REQUESTS.inc(view, request.method, str(response.status_code))
+        LATENCY.observe(elapsed, view)
+        QUERIES.inc(view, amount=timings.queries)
+        SQL.inc(view, amount=timings.sql)
+        if 'serializer' in timings.phases:
+            SERIALIZER.observe(timings.phases['serializer'], view)
+        registry.flush_if_due()
+        return response
+
+    def process_template_response(self, request, response):
+        return time_rendering(response)
@@ -1,6 +1,148 @@
-from rest_framework.pagination import PageNumberPagination
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from collections import OrderedDict
+
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination, PageNumberPagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
 
 
 class CustomPagination(PageNumberPagination):
     page_size = 10
     page_size_query_param = 'page_size'
+
+
+class KeysetPagination(BasePagination):
+    """
+    Cursor pagination keyed on ``(created_at, id)``.
+
+    Rows are always returned in ascending ``(created_at, id)`` order. The pair is unique,
+    so every row appears on exactly one page even when rows share a creation time, and
+    rows inserted while a client is paging show up on a later page instead of shifting
+    the following pages. The cursor is an opaque token holding the key of the last row
+    of the page; each page is a range scan on the key, so deep pages cost the same as
+    the first one and no ``COUNT(*)`` is run.
+    """
+    page_size = 10
+    page_size_query_param = 'page_size'
+    cursor_query_param = 'cursor'
+    ordering = ('created_at', 'id')
+    # Columns read to build the key of a row.
+    key_fields = ('created_at', 'id')
+    invalid_cursor_message = 'Invalid cursor'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.page_size = self.get_page_size(request)
+
+        queryset = queryset.order_by(*self.ordering)
+        cursor = self.decode_cursor(request)
+        if cursor is not None:
+            queryset = self.filter_after(queryset, cursor)
+
+        # Fetch one extra row to know whether there is a following page.
+        results = list(queryset[:self.page_size + 1])
+        self.page = results[:self.page_size]
+        # Read the key now, the rows of the page may be converted once returned.
+        self.next_key = self.get_key(self.page[-1]) if len(results) > self.page_size else None
+        return self.page
+
+    def get_paginated_response(self, data):
+        return Response(OrderedDict([
+            ('next', self.get_next_link()),
+            ('results', data),
+        ]))
+
+    def get_page_size(self, request) -> int:
+        try:
+            page_size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+        return page_size if page_size > 0 else self.page_size
+
+    def filter_after(self, queryset, key: tuple):
+        created_at, _id = key
+        return queryset.filter(Q(created_at__gt=created_at) | Q(created_at=created_at, id__gt=_id))
+
+    def get_key(self, row) -> tuple:
+        # Pages hold model instances, or dicts when read with values().
+        if isinstance(row, dict):
+            return row['created_at'], row['id']
+        return row.created_at, row.id
+
+    def get_next_link(self):
+        if self.next_key is None:
+            return None
+        return replace_query_param(
+            self.request.build_absolute_uri(), self.cursor_query_param, self.encode_cursor(self.next_key))
+
+    def format_key(self, key: tuple) -> str:
+        created_at, _id = key
+        return '%s|%d' % (created_at.isoformat(), _id)
+
+    def parse_key(self, token: str) -> tuple:
+        created_at, _id = token.split('|')
+        created_at = parse_datetime(created_at)
+        if created_at is None:
+            raise ValueError(token)
+        return created_at, int(_id)
+
+    def encode_cursor(self, key: tuple) -> str:
+        return urlsafe_b64encode(self.format_key(key).encode('ascii')).decode('ascii')
+
+    def decode_cursor(self, request):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None
+        try:
+            return self.parse_key(urlsafe_b64decode(encoded.encode('ascii')).decode('ascii'))
+        except (TypeError, ValueError, UnicodeError):
+            raise NotFound(self.invalid_cursor_message)
+
+
+class LatestFirstPagination(KeysetPagination):
+    """
+    Cursor pagination on the id alone, newest rows first.
+
+    Used where rows are listed under a parent, e.g. the comments of a workflow: the
+    ``(workflow_id, id)`` index serves each page as a backward range scan.
+    """
+    ordering = ('-id',)
+    key_fields = ('id',)
+
+    def filter_after(self, queryset, key: int):
+        return queryset.filter(id__lt=key)
+
+    def get_key(self, row) -> int:
+        return row['id'] if isinstance(row, dict) else row.id
+
+    def format_key(self, key: int) -> str:
+        return str(key)
+
+    def parse_key(self, token: str) -> int:
+        return int(token)
+
+
+class SelectablePaginationMixin:
+    """
+    Let clients of a list view choose keyset pagination with ``?pagination=cursor``.
+
+    Requests carrying a ``cursor`` parameter keep using keyset pagination, so ``next``
+    links work as they are. Any other request uses ``pagination_class``. Both order the
+    rows by the key of the keyset pagination, which the indexes of the list filters end
+    with, so a filtered page is read from an index in order.
+    """
+    keyset_pagination_class = KeysetPagination
+
+    def paginate_queryset(self, queryset):
+        return super().paginate_queryset(queryset.order_by(*self.keyset_pagination_class.ordering))
+
+    @property
+    def paginator(self):
+        if not hasattr(self, '_paginator'):
+            params = self.request.query_params
+            keyset = params.get('pagination') == 'cursor' or self.keyset_pagination_class.cursor_query_param in params
+            self._paginator = (self.keyset_pagination_class if keyset else self.pagination_class)()
+        return self._paginator
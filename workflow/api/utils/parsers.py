@@ -0,0 +1,77 @@
+import codecs
+import json
+import re
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover
+    orjson = None
+
+from django.conf import settings
+from rest_framework.exceptions import ParseError
+from rest_framework.parsers import BaseParser, JSONParser
+from rest_framework.utils.json import strict_constant
+
+from api.utils.renderers import FastJSONRenderer
+
+
+# orjson reads the integers that don't fit in 64 bits as floats. They have 19 digits or
+# more, so a document holding such a run of digits, even in a string, goes to the stdlib.
+LONG_NUMBER = re.compile(r'\d{19}')
+LONG_NUMBER_BYTES = re.compile(rb'\d{19}')
+
+
+def loads(document):
+    """
+    Decode one JSON document, str or UTF-8 bytes, with orjson when it is installed and
+    reads its numbers exactly, with the stdlib otherwise.
+
+    Both reject NaN and Infinity like DRF's strict JSON parsing.
+    """
+    long_number = LONG_NUMBER_BYTES if isinstance(document, bytes) else LONG_NUMBER
+    if orjson is None or long_number.search(document):
+        return json.loads(document, parse_constant=strict_constant)
+    return orjson.loads(document)
+
+
+class FastJSONParser(JSONParser):
+    """
+    JSON parser decoding with orjson when it is installed, see loads().
+
+    orjson reads UTF-8 bytes only, other request encodings go through the stdlib parser.
+    """
+    renderer_class = FastJSONRenderer
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        parser_context = parser_context or {}
+        encoding = parser_context.get('encoding', settings.DEFAULT_CHARSET)
+        if orjson is None or codecs.lookup(encoding).name != 'utf-8':
+            return super().parse(stream, media_type, parser_context)
+        try:
+            return loads(stream.read())
+        except ValueError as exc:
+            raise ParseError('JSON parse error - %s' % str(exc))
+
+
+class NDJSONParser(BaseParser):
+    """
+    Parse newline delimited JSON: one JSON document per line, blank lines ignored.
+
+    Return the list of the documents.
+    """
+    media_type = 'application/x-ndjson'
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        parser_context = parser_context or {}
+        encoding = parser_context.get('encoding', settings.DEFAULT_CHARSET)
+        documents, number = [], 0
+        try:
+            for number, line in enumerate(codecs.getreader(encoding)(stream), 1):
+                if line.strip():
+                    documents.append(loads(line))
+        except UnicodeDecodeError:
+            # The reader decodes a whole chunk before yielding its first line, the line is unknown.
+            raise ParseError('NDJSON body is not valid %s' % encoding)
+        except ValueError as exc:
+            raise ParseError('NDJSON parse error on line %d - %s' % (number, exc))
+        return documents
@@ -0,0 +1,79 @@
+"""
+Physical removal of soft deleted rows.
+
+Deleting through the API only flags rows (see api.models.SoftDeleteQuerySet.soft_delete).
+The tombstones are removed here in small batches, one transaction each, so that the
+database is never locked for long and concurrent writes go through between batches.
+Rows are deleted with plain SQL: they are hidden since they were flagged, so there is no
+cache to invalidate nor signal to send, while the search index triggers still fire.
+"""
+from django.db import connection, transaction
+
+from api.models import Workflow, WorkflowSteps, Comment, StepRun, WorkflowRun, StepDependency, WorkflowGraph
+
+BATCH_SIZE = 500
+CHILDREN = (WorkflowSteps, Comment)
+# The runs and dependencies of a workflow are removed before its steps, which they refer to.
+RUNS = ((StepRun, 'run_id__workflow_id__in'), (WorkflowRun, 'workflow_id__in'), (WorkflowGraph, 'workflow_id__in'),
+        (StepDependency, 'workflow_id__in'))
+
+
+def delete_rows(model, ids: list, column: str = 'id'):
+    with connection.cursor() as cursor:
+        cursor.execute('DELETE FROM {} WHERE {} IN ({})'.format(
+            connection.ops.quote_name(model._meta.db_table), connection.ops.quote_name(column),
+            ', '.join(['%s'] * len(ids))), ids)
+
+
+def next_batch(queryset, batch_size: int) -> list:
+    return list(queryset.values_list('id', flat=True)[:batch_size])
+
+
+def purge_deleted(before, batch_size: int = BATCH_SIZE):
+    """
+    Remove the rows soft deleted before a time, batch by batch.
+
+    The runs, graphs, dependencies, steps and comments of a deleted workflow are removed before
+    it, whether they were flagged themselves or not, and the runs and dependencies of a deleted
+    step with it. The tombstones are read from the partial indexes holding only the deleted
+    rows, so finding a batch never scans the live rows.
+    Args:
+        before (datetime): Only rows deleted before this time are removed
+        batch_size (int): Maximum number of rows removed per transaction
+    Yields:
+        tuple: (model, number of rows removed) after each committed batch
+    """
+    while True:
+        workflows = next_batch(
+            Workflow.all_objects.filter(deleted=True, modified_at__lt=before).order_by('modified_at'), batch_size)
+        if not workflows:
+            break
+        children = [(model, model._default_manager, lookup) for model, lookup in RUNS] + [
+            (model, model.all_objects, 'workflow_id__in') for model in CHILDREN]
+        for model, manager, lookup in children:
+            while True:
+                with transaction.atomic():
+                    ids = next_batch(manager.filter(**{lookup: workflows}), batch_size)
+                    if ids:
+                        delete_rows(model, ids)
+                if not ids:
+                    break
+                yield model, len(ids)
+        with transaction.atomic():
+            delete_rows(Workflow, workflows)
+        yield Workflow, len(workflows)
+
+    for model in CHILDREN:
+        while True:
+            with transaction.atomic():
+                ids = next_batch(
+                    model.all_objects.filter(deleted=True, modified_at__lt=before).order_by('modified_at'), batch_size)
+                if ids:
+                    if model is WorkflowSteps:
+                        delete_rows(StepRun, ids, StepRun._meta.get_field('step_id').column)
+                        for field in ('step_id', 'depends_on'):
+                            delete_rows(StepDependency, ids, StepDependency._meta.get_field(field).column)
+                    delete_rows(model, ids)
+            if not ids:
+                break
+            yield model, len(ids)
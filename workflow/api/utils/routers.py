@@ -0,0 +1,116 @@
+"""
+Read/write splitting: the reads of safe requests go to a replica, everything else to the primary.
+
+ReadWriteRouter sends the writes to the primary database, ``default``, and the reads
+to the replica chosen for the current request among DATABASE_REPLICAS, when
+ReplicaMiddleware allows it:
+
+- only GET, HEAD and OPTIONS requests read from a replica. The other requests, their
+  validation included, and the code run outside of requests, e.g. management commands,
+  read from the primary;
+- a request reads from the primary after it wrote, and so do the requests of its
+  client for DATABASE_REPLICA_STICKINESS seconds, through a cookie: the client reads its
+  writes while the replicas catch up;
+- ``use_primary()`` blocks read from the primary, e.g. the builds of the detail cache,
+  which must not store an outdated workflow under its latest version.
+
+Streamed responses, e.g. the exports, read from the primary: their body is produced
+after the request. Without DATABASE_REPLICAS, the middleware is not loaded and every
+query goes to the primary.
+"""
+import random
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+
+PRIMARY = 'default'
+STICKY_COOKIE = 'primary_until'
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+
+_routing = ContextVar('routing', default=None)
+
+
+class Routing:
+    """
+    Routing of the reads of a request.
+
+    Attributes:
+        replica (str): Alias of the database read, None for the primary
+        wrote (bool): Whether the request wrote to the primary
+    """
+
+    def __init__(self, replica: str = None):
+        self.replica = replica
+        self.wrote = False
+
+
+class ReadWriteRouter:
+    def db_for_read(self, model, **hints) -> str:
+        routing = _routing.get()
+        if routing is None or routing.replica is None:
+            return PRIMARY
+        return routing.replica
+
+    def db_for_write(self, model, **hints) -> str:
+        routing = _routing.get()
+        if routing is not None:
+            # Read your writes.
+            routing.wrote, routing.replica = True, None
+        return PRIMARY
+
+    def allow_relation(self, obj1, obj2, **hints) -> bool:
+        # Every database of the settings is the primary or a copy of it.
+        return True
+
+
+@contextmanager
+def use_primary():
+    """
+    Read from the primary in the block.
+    """
+    routing = _routing.get()
+    if routing is None or routing.replica is None:
+        yield
+        return
+    replica, routing.replica = routing.replica, None
+    try:
+        yield
+    finally:
+        if not routing.wrote:
+            routing.replica = replica
+
+
+class ReplicaMiddleware:
+    """
+    Choose the database read by each request, see the module documentation.
+    """
+
+    def __init__(self, get_response):
+        if not getattr(settings, 'DATABASE_REPLICAS', None):
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+
+    def __call__(self, request):
+        routing = Routing()
+        if request.method in SAFE_METHODS and not self.is_sticky(request):
+            routing.replica = random.choice(settings.DATABASE_REPLICAS)
+        token = _routing.set(routing)
+        try:
+            response = self.get_response(request)
+        finally:
+            _routing.reset(token)
+
+        if routing.wrote:
+            window = settings.DATABASE_REPLICA_STICKINESS
+            response.set_cookie(STICKY_COOKIE, '%.3f' % (time.time() + window), max_age=window, httponly=True,
+                                samesite='Lax')
+        return response
+
+    def is_sticky(self, request) -> bool:
+        try:
+            return float(request.COOKIES.get(STICKY_COOKIE, 0)) > time.time()
+        except ValueError:
+            return False
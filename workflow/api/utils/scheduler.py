@@ -0,0 +1,353 @@
+"""
+Execution of workflow runs by a pool of workers claiming their steps from the database.
+
+``start_run()`` creates a WorkflowRun with a StepRun per active step of the workflow: the
+steps without dependencies are ready, the others wait for the steps they depend on (see
+api.utils.graph). The ready step runs are the queue of the workers, read from a partial
+index holding only them. A worker claims a batch of them at once, runs each through
+WORKFLOW_STEP_HANDLER, then records the whole batch in one transaction, making ready the
+steps whose dependencies all succeeded.
+
+Claims don't wait on each other:
+
+- where the database supports it (PostgreSQL, MySQL 8, Oracle), the batch is selected
+  ``FOR UPDATE SKIP LOCKED``: a worker skips the rows locked by the claims of the others;
+- otherwise, e.g. on SQLite, which locks the whole database, the batch is claimed
+  without a lock by one ``UPDATE ... WHERE state = READY``: the rows claimed meanwhile
+  by another worker are not updated and left out of the batch. On SQLite the ids of the
+  batch are selected by a subquery of this statement, which runs alone in the database:
+  two workers never pick the same rows. Without LIMIT in subqueries (MySQL), they are
+  read first, and a conflict only shrinks the batch.
+
+Every batch is claimed with a token of its own, checked when its results are recorded.
+A claim older than WORKFLOW_STEP_TIMEOUT seconds, e.g. of a killed worker, expires: its
+steps are made ready again and the results of the stale worker are dropped. A failing
+step, or one whose claims expire, is retried until it was claimed WORKFLOW_STEP_ATTEMPTS
+times, then fails its run.
+"""
+import logging
+import multiprocessing
+import os
+import signal
+import socket
+import threading
+import uuid
+from collections import Counter, defaultdict
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import OperationalError, connection, connections, transaction
+from django.db.models import F
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from api.models import StepRun, Workflow, WorkflowRun, WorkflowSteps
+from api.utils.graph import current_graph, get_graph
+
+logger = logging.getLogger(__name__)
+
+BATCH_SIZE = 10
+POLL_INTERVAL = 0.5
+
+
+def start_run(workflow: Workflow) -> WorkflowRun:
+    """
+    Start a run of the active steps of a workflow.
+
+    The steps without dependencies are ready at once, the others wait for the ones they
+    depend on. Dependencies on steps that are not active are ignored.
+    Args:
+        workflow (Workflow): Workflow to run
+    Returns:
+        WorkflowRun: The new run, already succeeded when the workflow has no active step
+    """
+    steps = list(WorkflowSteps.objects.filter(workflow_id=workflow).order_by('id').values_list('id', 'status'))
+    graph_id, graph = current_graph(workflow.id, [step for step, status in steps])
+    active = {position for position, (step, status) in enumerate(steps) if status == WorkflowSteps.ACTIVE}
+    waiting_on = [sum(parent in active for parent in parents) for parents in graph.parents]
+    with transaction.atomic():
+        run = WorkflowRun.objects.create(
+            workflow_id=workflow, graph_id_id=graph_id, steps_total=len(active),
+            state=WorkflowRun.RUNNING if active else WorkflowRun.SUCCEEDED,
+            finished_at=None if active else timezone.now())
+        StepRun.objects.bulk_create(
+            StepRun(run_id=run, step_id_id=graph.steps[position], waiting_on=waiting_on[position],
+                    state=StepRun.WAITING if waiting_on[position] else StepRun.READY)
+            for position in sorted(active))
+    return run
+
+
+def claim(limit: int = BATCH_SIZE) -> tuple:
+    """
+    Claim a batch of ready steps, see the module documentation.
+
+    Args:
+        limit (int): Most steps claimed
+    Returns:
+        tuple: The token of the claim, the claimed StepRun with their step and run, and the number
+            of steps read but claimed first by another worker
+    """
+    token, now = uuid.uuid4().hex, timezone.now()
+    ready = StepRun.objects.filter(state=StepRun.READY).order_by('id').values_list('id', flat=True)
+    claimed = dict(state=StepRun.CLAIMED, claim=token, claimed_at=now, attempts=F('attempts') + 1)
+    if connection.features.has_select_for_update_skip_locked:
+        with transaction.atomic():
+            candidates = list(ready.select_for_update(skip_locked=True)[:limit])
+            StepRun.objects.filter(id__in=candidates).update(**claimed)
+    else:
+        candidates = ready[:limit]
+        if not connection.features.allow_sliced_subqueries_with_in:
+            candidates = list(candidates)
+        StepRun.objects.filter(id__in=candidates, state=StepRun.READY).update(**claimed)
+    batch = list(StepRun.objects.filter(state=StepRun.CLAIMED, claim=token).select_related('step_id', 'run_id'))
+    return token, batch, len(candidates) - len(batch) if isinstance(candidates, list) else 0
+
+
+def get_handler():
+    """
+    Return the function running a step, None when steps only have to be recorded as done.
+    """
+    path = settings.WORKFLOW_STEP_HANDLER
+    return import_string(path) if path else None
+
+
+def run_step(handler, step_run: StepRun) -> str:
+    """
+    Run a step, returning its error message, None when it succeeded.
+    """
+    if handler is None:
+        return None
+    try:
+        handler(step_run)
+    except Exception as exc:
+        logger.exception('Step run %d of run %d failed', step_run.id, step_run.run_id_id)
+        return '%s: %s' % (type(exc).__name__, exc)
+    return None
+
+
+def finish(token: str, results: list):
+    """
+    Record the results of a claimed batch in one transaction, with a few queries whatever its size.
+
+    Args:
+        token (str): Token of the claim
+        results (list): (StepRun, error message or None) tuples
+    """
+    now = timezone.now()
+    mine = StepRun.objects.filter(claim=token, state=StepRun.CLAIMED)
+    succeeded = [step_run.id for step_run, error in results if error is None]
+    # Every statement writes before reading, so that the transaction takes the write lock of
+    # SQLite upfront (it can't wait for it once it read). The steps whose claim expired are
+    # left out by the filters on the claim.
+    with transaction.atomic():
+        if succeeded and mine.filter(id__in=succeeded).update(state=StepRun.SUCCEEDED, finished_at=now):
+            recorded = set(StepRun.objects.filter(id__in=succeeded, claim=token, state=StepRun.SUCCEEDED).values_list(
+                'id', flat=True))
+            succeed([step_run for step_run, error in results if step_run.id in recorded], now)
+        failed = []
+        for step_run, error in results:
+            if error is None:
+                continue
+            if step_run.attempts < settings.WORKFLOW_STEP_ATTEMPTS:
+                mine.filter(id=step_run.id).update(state=StepRun.READY, claim=None, claimed_at=None, error=error)
+            elif mine.filter(id=step_run.id).update(state=StepRun.FAILED, finished_at=now, error=error):
+                failed.append(step_run.run_id_id)
+        if failed:
+            fail(failed, now)
+
+
+def succeed(step_runs: list, now):
+    """
+    Count succeeded steps on their runs and make ready the steps depending on them alone, finishing
+    the runs whose every step succeeded.
+
+    The dependents of a step are read from the cached graph of its run: recording a step
+    costs the same queries whatever the size of its workflow.
+    Args:
+        step_runs (list): The succeeded StepRun, with their run
+        now (datetime): Time of the results
+    """
+    by_run = defaultdict(list)
+    for step_run in step_runs:
+        by_run[step_run.run_id].append(step_run.step_id_id)
+    by_count = defaultdict(list)
+    for run, steps in by_run.items():
+        by_count[len(steps)].append(run.id)
+        if run.graph_id_id is None:
+            continue
+        graph = get_graph(run.graph_id_id)
+        dependents = Counter(dependent for step in steps for dependent in graph.dependents(step))
+        by_done = defaultdict(list)
+        for dependent, done in dependents.items():
+            by_done[done].append(dependent)
+        # The dependents of a succeeded step are waiting, or cancelled with their run. They are
+        # found by step rather than by state, which most step runs of a large run share.
+        for done, dependent in by_done.items():
+            StepRun.objects.filter(run_id=run, step_id__in=dependent).update(waiting_on=F('waiting_on') - done)
+        if dependents:
+            StepRun.objects.filter(run_id=run, step_id__in=list(dependents), waiting_on=0).exclude(
+                state=StepRun.CANCELLED).update(state=StepRun.READY)
+    for count, ids in by_count.items():
+        WorkflowRun.objects.filter(pk__in=ids).update(steps_done=F('steps_done') + count)
+    WorkflowRun.objects.filter(pk__in=[run.id for run in by_run], state=WorkflowRun.RUNNING,
+                               steps_done=F('steps_total')).update(state=WorkflowRun.SUCCEEDED, finished_at=now)
+
+
+def fail(runs: list, now):
+    """
+    Fail runs, cancelling their steps left to run.
+    """
+    WorkflowRun.objects.filter(pk__in=runs, state=WorkflowRun.RUNNING).update(state=WorkflowRun.FAILED, finished_at=now)
+    StepRun.objects.filter(run_id__in=runs, state__in=(StepRun.WAITING, StepRun.READY)).update(
+        state=StepRun.CANCELLED, finished_at=now)
+
+
+def requeue_expired(timeout: float) -> int:
+    """
+    Make the steps claimed more than ``timeout`` seconds ago ready again.
+
+    A step whose claim expired after it was claimed WORKFLOW_STEP_ATTEMPTS times fails its
+    run instead: a step hanging or killing its worker would be claimed forever otherwise.
+    Returns:
+        int: Number of steps made ready
+    """
+    token, now = uuid.uuid4().hex, timezone.now()
+    expired = StepRun.objects.filter(state=StepRun.CLAIMED, claimed_at__lt=now - timedelta(seconds=timeout))
+    with transaction.atomic():
+        # Failed under a token of their own to find their runs, writing before reading as in finish().
+        if expired.filter(attempts__gte=settings.WORKFLOW_STEP_ATTEMPTS).update(
+                state=StepRun.FAILED, claim=token, finished_at=now, error='Claim expired after %d attempts' % (
+                    settings.WORKFLOW_STEP_ATTEMPTS)):
+            fail(list(StepRun.objects.filter(claim=token, state=StepRun.FAILED).values_list(
+                'run_id', flat=True).distinct()), now)
+        return expired.update(state=StepRun.READY, claim=None, claimed_at=None)
+
+
+def is_idle() -> bool:
+    """
+    Return whether no step is ready nor claimed, each read from its partial index.
+    """
+    return not (StepRun.objects.filter(state=StepRun.READY).exists() or
+                StepRun.objects.filter(state=StepRun.CLAIMED).exists())
+
+
+class Worker:
+    """
+    Loop claiming and running batches of steps until stopped.
+
+    Attributes:
+        name (str): Name of the worker in the logs
+        stop (threading.Event): Set to stop the worker after its current batch
+        batch_size (int): Most steps claimed at once
+        poll_interval (float): Seconds waited when no step is ready
+        exit_when_idle (bool): Whether to stop once no step is ready nor claimed
+        stats (Counter): Numbers of steps run, batches claimed and conflicts, the steps
+            read but claimed first by another worker
+    """
+
+    def __init__(self, name: str, stop: threading.Event, batch_size: int = BATCH_SIZE,
+                 poll_interval: float = POLL_INTERVAL, exit_when_idle: bool = False):
+        self.name = name
+        self.stop = stop
+        self.batch_size = batch_size
+        self.poll_interval = poll_interval
+        self.exit_when_idle = exit_when_idle
+        self.stats = Counter()
+
+    def run_batch(self) -> bool:
+        """
+        Claim a batch of steps, run them and record their results.
+
+        Returns:
+            bool: Whether steps were ready, run by this worker or claimed first by another one
+        """
+        token, batch, conflicts = claim(self.batch_size)
+        self.stats['conflicts'] += conflicts
+        if batch:
+            handler = get_handler()
+            finish(token, [(step_run, run_step(handler, step_run)) for step_run in batch])
+            self.stats['batches'] += 1
+            self.stats['steps'] += len(batch)
+        return bool(batch or conflicts)
+
+    def run(self):
+        try:
+            while not self.stop.is_set():
+                try:
+                    if self.run_batch():
+                        continue
+                    if self.exit_when_idle and is_idle():
+                        return
+                    requeue_expired(settings.WORKFLOW_STEP_TIMEOUT)
+                except OperationalError:
+                    # E.g. the busy timeout of SQLite, the steps are claimed again later.
+                    logger.warning('Worker %s failed to reach the database', self.name, exc_info=True)
+                self.stop.wait(self.poll_interval)
+        finally:
+            connections.close_all()
+
+
+def run_threads(threads: int, **options) -> Counter:
+    """
+    Run workers in threads of the current process until SIGINT or SIGTERM, or until idle with ``exit_when_idle``.
+
+    Args:
+        threads (int): Number of workers
+        options: Arguments of the workers
+    Returns:
+        Counter: Stats of all the workers
+    """
+    stop = threading.Event()
+    handlers = {}
+    if threading.current_thread() is threading.main_thread():
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            handlers[signum] = signal.signal(signum, lambda *args: stop.set())
+    workers = [Worker('%s:%d:%d' % (socket.gethostname(), os.getpid(), number), stop, **options)
+               for number in range(threads)]
+    pool = [threading.Thread(target=worker.run, name=worker.name) for worker in workers]
+    try:
+        for thread in pool:
+            thread.start()
+        for thread in pool:
+            thread.join()
+    finally:
+        stop.set()
+        for signum, handler in handlers.items():
+            signal.signal(signum, handler)
+    return sum((worker.stats for worker in workers), Counter())
+
+
+def work(threads: int, options: dict, results):
+    results.put(run_threads(threads, **options))
+
+
+def run_workers(processes: int = 1, threads: int = 1, **options) -> Counter:
+    """
+    Run ``threads`` workers in each of ``processes`` processes, see run_threads.
+
+    With one process, the workers run in threads of the current process; otherwise in
+    forked processes, stopped by SIGTERM.
+    Returns:
+        Counter: Stats of all the workers
+    """
+    if processes == 1:
+        return run_threads(threads, **options)
+    # Connections must not be shared with the forked processes.
+    connections.close_all()
+    context = multiprocessing.get_context('fork')
+    results = context.SimpleQueue()
+    pool = [context.Process(target=work, args=(threads, options, results)) for _ in range(processes)]
+    for process in pool:
+        process.start()
+    try:
+        for process in pool:
+            process.join()
+    finally:
+        for process in pool:
+            if process.is_alive():
+                process.terminate()
+                process.join()
+    stats = Counter()
+    while not results.empty():
+        stats += results.get()
+    return stats
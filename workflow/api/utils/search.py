@@ -0,0 +1,112 @@
+"""
+Full-text search over workflows, steps and comments.
+
+The documents live in the ``api_search_index`` SQLite FTS5 table, kept in sync with
+the model tables by triggers (see migration 0008), so bulk inserts, queryset updates
+and cascading deletes are indexed as well as ``save()`` and ``delete()``. The rowid of
+a document encodes its kind and the id of its row: ``rowid = id * len(KINDS) + kind``.
+"""
+from django.db import connection
+from django.db.models.expressions import RawSQL
+
+from api.models import normalize
+
+INDEX_TABLE = 'api_search_index'
+KINDS = ('workflow', 'step', 'comment')
+MODEL_KINDS = {'workflow': 'workflow', 'workflowsteps': 'step', 'comment': 'comment'}
+
+
+def match_expression(query_string: str):
+    """
+    Build an FTS5 query matching documents that contain every term of a query statement.
+
+    Args:
+        query_string (str): Words and "quoted phrases" to look for
+    Returns:
+        str: The MATCH expression, None if the statement has no searchable term
+    """
+    phrases = ['"%s"' % term.replace('"', '""') for term in normalize(query_string)
+               if any(char.isalnum() for char in term)]
+    return ' AND '.join(phrases) or None
+
+
+class SearchResults:
+    """
+    Lazy result set of a full-text query, best match first.
+
+    It supports ``count()`` and slicing, so it can be handed to the paginators. Each
+    item is a dict with the kind, id, workflow id and name of the document and its
+    bm25 rank (lower is better).
+    """
+
+    def __init__(self, query_string: str, kind: str = None):
+        self.expression = match_expression(query_string)
+        self.kind = kind
+
+    def _where(self):
+        # Soft deleted rows leave the index, the children of a soft deleted workflow don't.
+        sql = '{table} MATCH %s AND workflow_id NOT IN (SELECT id FROM api_workflow WHERE deleted = 1)'.format(
+            table=INDEX_TABLE)
+        params = [self.expression]
+        if self.kind is not None:
+            sql += ' AND rowid %% {kinds} = %s'.format(kinds=len(KINDS))
+            params.append(KINDS.index(self.kind))
+        return sql, params
+
+    def count(self) -> int:
+        if self.expression is None:
+            return 0
+        where, params = self._where()
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT COUNT(*) FROM {table} WHERE {where}'.format(table=INDEX_TABLE, where=where), params)
+            return cursor.fetchone()[0]
+
+    def __len__(self) -> int:
+        return self.count()
+
+    def __getitem__(self, key):
+        if not isinstance(key, slice) or key.step is not None:
+            raise TypeError("SearchResults only supports slicing without a step.")
+        start = key.start or 0
+        limit = -1 if key.stop is None else max(key.stop - start, 0)
+        if self.expression is None or limit == 0:
+            return []
+
+        where, params = self._where()
+        with connection.cursor() as cursor:
+            cursor.execute(
+                'SELECT rowid, workflow_id, name, bm25({table}) AS rank FROM {table} WHERE {where} '
+                'ORDER BY rank, rowid LIMIT %s OFFSET %s'.format(table=INDEX_TABLE, where=where),
+                params + [limit, start]
+            )
+            return [
+                {
+                    'kind': KINDS[rowid % len(KINDS)],
+                    'id': rowid // len(KINDS),
+                    'workflow_id': workflow_id,
+                    'name': name,
+                    'rank': rank,
+                }
+                for rowid, workflow_id, name, rank in cursor.fetchall()
+            ]
+
+
+def search_queryset(model, query_string: str):
+    """
+    Filter the rows of an indexed model to those matching every term of a query statement.
+
+    Args:
+        model (Model): Workflow, WorkflowSteps or Comment
+        query_string (str): Words and "quoted phrases" to look for
+    Returns:
+        QuerySet: The matching rows, oldest first
+    """
+    expression = match_expression(query_string)
+    if expression is None:
+        return model.objects.none()
+    ids = RawSQL(
+        'SELECT rowid / {kinds} FROM {table} WHERE {table} MATCH %s AND rowid %% {kinds} = %s'.format(
+            table=INDEX_TABLE, kinds=len(KINDS)),
+        [expression, KINDS.index(MODEL_KINDS[model._meta.model_name])]
+    )
+    return model.objects.filter(id__in=ids).order_by('created_at')
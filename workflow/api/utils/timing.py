@@ -0,0 +1,196 @@
+"""
+Per request instrumentation: SQL, serializer and render times in a Server-Timing header.
+
+ServerTimingMiddleware records, for each request, the number of queries and the time
+spent in the database (through a query wrapper on every connection), in serializers
+(the ``phase('serializer')`` blocks of the views) and in rendering the response. The
+serializer and render times exclude the queries run within them, so the durations of
+the header add up to at most the total. They are also logged on the ``api.utils.timing``
+logger, one line per request with the values in ``extra['timing']``.
+
+A statement run SERVER_TIMING_REPEATED_QUERIES times or more in one request, with any
+parameters, is the mark of an N+1 query: it is counted in the header and logged as a
+warning.
+
+The middleware is only loaded when the SERVER_TIMING setting is True. Otherwise Django
+drops it from the middleware chain and ``phase`` only reads a context variable.
+Streamed responses are timed up to their first byte: their body is produced later.
+The queries run for a request by the writer queue are recorded too.
+"""
+import logging
+import time
+from collections import Counter, defaultdict
+from contextlib import ExitStack, contextmanager, nullcontext
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+
+logger = logging.getLogger(__name__)
+
+_current = ContextVar('request_timings', default=None)
+_idle = nullcontext()
+
+
+class RequestTimings:
+    """
+    Timings of one request, also the query wrapper recording its SQL.
+
+    Attributes:
+        queries (int): Number of queries run
+        sql (float): Time spent running them, in seconds
+        statements (Counter): Number of runs by SQL statement, parameters left out
+        phases (dict): Time spent in each phase, in seconds, queries left out
+    """
+
+    def __init__(self):
+        self.queries = 0
+        self.sql = 0.0
+        self.statements = Counter()
+        self.phases = defaultdict(float)
+        self.rendering = False
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.sql += time.perf_counter() - start
+            self.queries += 1
+            self.statements[sql] += 1
+
+    def start(self, name: str):
+        """
+        Start timing a phase, returning the function stopping it.
+        """
+        start, sql = time.perf_counter(), self.sql
+
+        def stop(*args):
+            self.phases[name] += time.perf_counter() - start - (self.sql - sql)
+        return stop
+
+    @contextmanager
+    def phase(self, name: str):
+        stop = self.start(name)
+        try:
+            yield
+        finally:
+            stop()
+
+    def repeated(self, threshold: int) -> list:
+        """
+        Return the statements run ``threshold`` times or more, with their number of runs, most run first.
+        """
+        return [(sql, runs) for sql, runs in self.statements.most_common() if runs >= threshold]
+
+    def header(self, total: float, repeated: list) -> str:
+        """
+        Return the value of the Server-Timing header, durations in milliseconds.
+        """
+        metrics = ['db;dur=%.2f;desc="%d queries"' % (self.sql * 1000, self.queries)]
+        metrics.extend('%s;dur=%.2f' % (name, seconds * 1000) for name, seconds in self.phases.items())
+        if repeated:
+            metrics.append('nplusone;desc="%d repeated statements"' % len(repeated))
+        metrics.append('total;dur=%.2f' % (total * 1000))
+        return ', '.join(metrics)
+
+    def as_dict(self, total: float, repeated: list) -> dict:
+        return {
+            'queries': self.queries,
+            'db_ms': round(self.sql * 1000, 2),
+            **{name + '_ms': round(seconds * 1000, 2) for name, seconds in self.phases.items()},
+            'total_ms': round(total * 1000, 2),
+            'repeated': [{'sql': sql, 'runs': runs} for sql, runs in repeated],
+        }
+
+
+@contextmanager
+def recording():
+    """
+    Record the timings of the code run in the block, yielding the RequestTimings.
+
+    Nested blocks, e.g. of two middlewares, share the timings of the outermost one.
+    """
+    timings = _current.get()
+    if timings is not None:
+        yield timings
+        return
+    timings = RequestTimings()
+    token = _current.set(timings)
+    try:
+        with ExitStack() as stack:
+            for connection in connections.all():
+                stack.enter_context(connection.execute_wrapper(timings))
+            yield timings
+    finally:
+        _current.reset(token)
+
+
+def record_queries(using: str, func, *args, **kwargs):
+    """
+    Call a function, its queries on a connection of the current thread being recorded in the
+    timings of the current request, if timed.
+
+    Used by the writer thread (see api.utils.writer), whose connection is not wrapped by
+    recording(), in the context of the request it writes for.
+    """
+    timings = _current.get()
+    if timings is None:
+        return func(*args, **kwargs)
+    with connections[using].execute_wrapper(timings):
+        return func(*args, **kwargs)
+
+
+def time_rendering(response):
+    """
+    Time the rendering of a template response as the 'render' phase of the current request, once.
+    """
+    timings = _current.get()
+    if timings is not None and not timings.rendering:
+        timings.rendering = True
+        # Post render callbacks are run right after rendering.
+        response.add_post_render_callback(timings.start('render'))
+    return response
+
+
+def phase(name: str):
+    """
+    Return a context manager timing a phase of the current request, doing nothing when it is not timed.
+
+    Args:
+        name (str): Name of the phase in the Server-Timing header, e.g. 'serializer'
+    """
+    timings = _current.get()
+    return _idle if timings is None else timings.phase(name)
+
+
+class ServerTimingMiddleware:
+    """
+    Record the timings of every request, see the module documentation.
+    """
+
+    def __init__(self, get_response):
+        if not getattr(settings, 'SERVER_TIMING', False):
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.threshold = settings.SERVER_TIMING_REPEATED_QUERIES
+
+    def __call__(self, request):
+        start = time.perf_counter()
+        with recording() as timings:
+            response = self.get_response(request)
+        total = time.perf_counter() - start
+
+        repeated = timings.repeated(self.threshold)
+        response['Server-Timing'] = timings.header(total, repeated)
+        values = timings.as_dict(total, repeated)
+        logger.info('%s %s %s %s', request.method, request.get_full_path(), response.status_code,
+                    ' '.join('%s=%s' % (key, value) for key, value in values.items() if key != 'repeated'),
+                    extra={'timing': values})
+        for sql, runs in repeated:
+            logger.warning('Repeated statement, %d runs in %s %s: %s', runs, request.method, request.path, sql)
+        return response
+
+    def process_template_response(self, request, response):
+        return time_rendering(response)
@@ -1,3 +1,4 @@
+from rest_framework.negotiation import BaseContentNegotiation
 from rest_framework.views import exception_handler
 from django.http import Http404
 
@@ -13,3 +14,15 @@ def custom_exception_handler(exc, context):
         response.data = custom_response_data  # set the custom response data on response object
 
     return response
+
+
+class IgnoreClientContentNegotiation(BaseContentNegotiation):
+    """
+    Content negotiation for views returning their own content type, whatever the client accepts.
+    """
+
+    def select_parser(self, request, parsers):
+        return parsers[0]
+
+    def select_renderer(self, request, renderers, format_suffix=None):
+        return renderers[0], renderers[0].media_type
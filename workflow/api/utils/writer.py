@@ -0,0 +1,146 @@
+"""
+In-process writer queue: the writes of every thread run one after the other on a single
+connection, several per transaction.
+
+SQLite lets one connection write at a time. Writers of many threads queue for the
+database lock, sleeping and retrying in the busy handler, and each of them pays a commit.
+With SQLITE_WRITER_QUEUE, ``write()`` hands its function to a writer thread instead,
+which runs the pending functions, up to SQLITE_WRITER_BATCH of them, in one transaction:
+a commit is shared by the whole batch (group commit). Each function runs in a savepoint
+of its own, so a failing function is rolled back alone and its exception raised in its
+caller. Callers wait for the commit of their batch, their write is durable when
+``write()`` returns.
+"""
+import contextvars
+import queue
+import threading
+from concurrent.futures import Future
+
+from django.conf import settings
+from django.db import connections, transaction
+
+from api.utils.timing import record_queries
+
+
+class WriterQueue:
+    """
+    Thread running the submitted functions in batches, one transaction per batch.
+
+    Attributes:
+        using (str): Alias of the database written
+        batch_size (int): Most functions run in one transaction
+        batches (int): Number of transactions committed
+        writes (int): Number of functions run
+    """
+
+    def __init__(self, using: str = 'default', batch_size: int = 64):
+        self.using = using
+        self.batch_size = batch_size
+        self.batches = 0
+        self.writes = 0
+        self.jobs = queue.SimpleQueue()
+        self.thread = threading.Thread(target=self.work, name='writer-queue', daemon=True)
+        self.thread.start()
+
+    def submit(self, func, *args, **kwargs) -> Future:
+        """
+        Queue a call of ``func``, returning the future of its result, set once committed.
+
+        ``func`` runs in a copy of the context of the caller, e.g. to know the request it
+        writes for (see api.utils.routers) and record its queries in the timings of the
+        request (see api.utils.timing).
+        """
+        future = Future()
+        self.jobs.put((future, contextvars.copy_context().run, (func,) + args, kwargs))
+        return future
+
+    def run(self, func, *args, **kwargs):
+        """
+        Call ``func`` in the writer thread, returning its result once committed.
+        """
+        if threading.current_thread() is self.thread:
+            # A write of a write, already in the transaction of the batch.
+            return func(*args, **kwargs)
+        return self.submit(func, *args, **kwargs).result()
+
+    def close(self):
+        """
+        Stop the thread once the queued functions are run.
+        """
+        self.jobs.put(None)
+        self.thread.join()
+
+    def work(self):
+        try:
+            while True:
+                batch = [self.jobs.get()]
+                while batch[-1] is not None and len(batch) < self.batch_size:
+                    try:
+                        batch.append(self.jobs.get_nowait())
+                    except queue.Empty:
+                        break
+                stop = batch[-1] is None
+                self.commit([job for job in batch if job is not None])
+                if stop:
+                    return
+        finally:
+            connections[self.using].close()
+
+    def commit(self, batch: list):
+        results = []
+        try:
+            with transaction.atomic(using=self.using):
+                for future, func, args, kwargs in batch:
+                    try:
+                        with transaction.atomic(using=self.using):
+                            results.append((future, func(record_queries, self.using, *args, **kwargs), None))
+                    except Exception as exc:
+                        results.append((future, None, exc))
+        except Exception as exc:
+            for future, func, args, kwargs in batch:
+                future.set_exception(exc)
+            return
+        self.batches += 1
+        self.writes += len(batch)
+        for future, result, exc in results:
+            if exc is None:
+                future.set_result(result)
+            else:
+                future.set_exception(exc)
+
+
+_writer = None
+_lock = threading.Lock()
+
+
+def get_writer() -> WriterQueue:
+    global _writer
+    with _lock:
+        if _writer is None:
+            _writer = WriterQueue(batch_size=settings.SQLITE_WRITER_BATCH)
+        return _writer
+
+
+def close_writer():
+    """
+    Stop the writer thread, if started, once the queued writes are run.
+    """
+    global _writer
+    with _lock:
+        if _writer is not None:
+            _writer.close()
+            _writer = None
+
+
+def write(func, *args, **kwargs):
+    """
+    Call a function writing to the database, through the writer queue when SQLITE_WRITER_QUEUE is set.
+
+    Args:
+        func (callable): Function to call with ``args`` and ``kwargs``
+    Returns:
+        The result of ``func``
+    """
+    if not settings.SQLITE_WRITER_QUEUE:
+        return func(*args, **kwargs)
+    return get_writer().run(func, *args, **kwargs)
@@ -1,17 +1,34 @@
 from urllib.request import Request
 
-from django.http import Http404
+from django.db.models import Prefetch
+from django.http import Http404, HttpResponse, StreamingHttpResponse
+from django.views import View
 from rest_framework import status
 from rest_framework.response import Response
 from rest_framework.generics import GenericAPIView
-
-from .models import Workflow, Comment
-from api.utils.pagination import CustomPagination
+from rest_framework.exceptions import ValidationError
+from rest_framework.serializers import as_serializer_error
+
+from .models import Workflow, WorkflowSteps, Comment, WorkflowRun
+from api.utils.bulk import insert_workflows
+from api.utils.cache import get_detail, invalidate_detail
+from api.utils.conditional import Validators
+from api.utils.export import CONTENT_TYPES, FORMATS
+from api.utils.fields import get_columns, get_sparse_fields, serializer_fields
+from api.utils.filters import COMMENT_FILTERS, WORKFLOW_FILTERS, QueryParamFilterBackend
+from api.utils.metrics import CONTENT_TYPE, registry
+from api.utils.pagination import CustomPagination, LatestFirstPagination, SelectablePaginationMixin
+from api.utils.parsers import FastJSONParser, NDJSONParser
+from api.utils.scheduler import start_run
+from api.utils.search import KINDS, SearchResults
+from api.utils.timing import phase
+from api.utils.utils import IgnoreClientContentNegotiation
+from api.utils.writer import write
 from .serializers.serializers import WorkflowSerializer, CommentSerializer, WorkflowItemSerializer, \
-    CommentListSerializer, WorkflowListSerializer
+    SearchResultSerializer, WorkflowRunSerializer, workflow_list_values, comment_list_values
 
 
-class WorkflowListPost(GenericAPIView):
+class WorkflowListPost(SelectablePaginationMixin, GenericAPIView):
     """
     To perform List and Create actions on Workflow Model.
 
@@ -26,11 +43,22 @@ class WorkflowListPost(GenericAPIView):
     serializer_class = WorkflowSerializer
     pagination_class = CustomPagination
     queryset = Workflow.objects.all()
+    filter_backends = (QueryParamFilterBackend,)
+    filters = WORKFLOW_FILTERS
 
     def get(self, request: Request, format=None) -> Response:
         """
         List all created workflows.
 
+        Pages are numbered by default; ``?pagination=cursor`` switches to keyset
+        pagination ordered by ``(created_at, id)``, see KeysetPagination.
+        ``?fields=id,name`` renders and reads only the given fields.
+        Workflows are filtered with ``created_after``, ``created_before``,
+        ``modified_after``, ``modified_before``, ``archived`` and ``status``
+        (having a step with this status), see api.utils.filters.
+        Answers 304 Not Modified when the ETag known by the client is still
+        current, without serializing anything.
+
         Parameters
         ----------
         request : Request
@@ -42,10 +70,19 @@ class WorkflowListPost(GenericAPIView):
         Response
             Return the response with all serialized workflows
         """
-        workflows = Workflow.objects.all()
-        paginate_queryset = self.paginate_queryset(workflows)
-        serializer = WorkflowListSerializer(paginate_queryset, many=True)
-        return self.get_paginated_response(serializer.data)
+        fast = workflow_list_values.narrow(get_sparse_fields(request, workflow_list_values.fields))
+        workflows = self.filter_queryset(Workflow.objects.all())
+        paginate_queryset = self.paginate_queryset(
+            fast.values(workflows, getattr(self.paginator, 'key_fields', ()) + Validators.ROW_FIELDS))
+        # The status filter reads the steps.
+        validators = Validators.for_list(request, (Workflow, WorkflowSteps), paginate_queryset)
+        not_modified = validators.not_modified(request)
+        if not_modified is not None:
+            return not_modified
+
+        with phase('serializer'):
+            data = fast.to_representation(paginate_queryset)
+        return validators.apply(self.get_paginated_response(data))
 
     def post(self, request: Request, format=None) -> Response:
         """
@@ -64,12 +101,109 @@ class WorkflowListPost(GenericAPIView):
         """
 
         serializer = WorkflowSerializer(data=request.data)
-        if serializer.is_valid():
-            serializer.save()
-            return Response(serializer.data, status=status.HTTP_201_CREATED)
+        with phase('serializer'):
+            if serializer.is_valid():
+                write(serializer.save)
+                return Response(serializer.data, status=status.HTTP_201_CREATED)
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
 
+class WorkflowBatchPost(GenericAPIView):
+    """
+    To create many instances of Workflow Model in one request.
+
+    Methods
+    -------
+    post
+        Create a list of Workflow instances.
+    """
+
+    serializer_class = WorkflowSerializer
+    parser_classes = (FastJSONParser, NDJSONParser)
+    max_items = 10000
+
+    def post(self, request: Request, format=None) -> Response:
+        """
+        Create workflow instances from a JSON array or a NDJSON body of workflows.
+
+        Every item is validated, then the valid ones are inserted in chunked transactions.
+        The response holds one result per item, in the order of the request: the id of
+        the workflow, or the errors that prevented its creation.
+
+        Parameters
+        ----------
+        request : Request
+            HTTP POST request
+        format : str, optional
+            Format for the rendered response (the default is None)
+        Returns
+        -------
+        Response
+            201 if every item is created, 207 if only some are, 400 if none is
+        """
+        items = request.data
+        if not isinstance(items, list):
+            return Response({'non_field_errors': ['Expected a list of workflows.']},
+                            status=status.HTTP_400_BAD_REQUEST)
+        if len(items) > self.max_items:
+            return Response({'non_field_errors': ['At most %d workflows per request.' % self.max_items]},
+                            status=status.HTTP_400_BAD_REQUEST)
+
+        # A single serializer validates every item, so its fields are only built once.
+        serializer, results, valid = WorkflowSerializer(), {}, []
+        with phase('serializer'):
+            for index, item in enumerate(items):
+                try:
+                    valid.append((index, serializer.run_validation(item)))
+                except ValidationError as exc:
+                    results[index] = {'index': index, 'status': status.HTTP_400_BAD_REQUEST,
+                                      'errors': as_serializer_error(exc)}
+        results.update(write(insert_workflows, valid))
+
+        results = [results[index] for index in range(len(items))]
+        created = sum(result['status'] == status.HTTP_201_CREATED for result in results)
+        if created == len(results):
+            response_status = status.HTTP_201_CREATED
+        elif created:
+            response_status = status.HTTP_207_MULTI_STATUS
+        else:
+            response_status = status.HTTP_400_BAD_REQUEST
+        return Response({'created': created, 'failed': len(results) - created, 'results': results},
+                        status=response_status)
+
+
+class WorkflowExport(GenericAPIView):
+    """
+    To export all Workflow instances with their steps and comments.
+
+    Methods
+    -------
+    get
+        Stream every workflow as NDJSON or CSV.
+    """
+
+    content_negotiation_class = IgnoreClientContentNegotiation
+
+    def get(self, request: Request, export_format: str) -> StreamingHttpResponse:
+        """
+        Stream the export of the workflows.
+
+        Parameters
+        ----------
+        request : Request
+            HTTP GET request
+        export_format : str
+            Either ndjson or csv
+        Returns
+        -------
+        StreamingHttpResponse
+            Return the streamed export, read from the database chunk by chunk
+        """
+        response = StreamingHttpResponse(FORMATS[export_format](), content_type=CONTENT_TYPES[export_format])
+        response['Content-Disposition'] = 'attachment; filename="workflows.%s"' % export_format
+        return response
+
+
 class WorkflowGetDeleteUpdate(GenericAPIView):
     """
     To perform Retrieve, Update or delete an instance of Workflow Model.
@@ -89,15 +223,24 @@ class WorkflowGetDeleteUpdate(GenericAPIView):
     """
 
     serializer_class = WorkflowSerializer
-    queryset = Workflow.objects.all()
-
-    def get_object(self, pk: int) -> Workflow:
+    # Steps are prefetched with only the columns that WorkflowItemSerializer
+    # renders, for the steps and their graph. Comments are not: the detail
+    # embeds the latest ones and their count, so a detail miss costs the same
+    # queries regardless of how many steps or comments the workflow has.
+    steps_prefetch = Prefetch(
+        'steps', queryset=WorkflowSteps.objects.only('id', 'workflow_id', 'name', 'description', 'status'))
+    prefetches = {'steps': steps_prefetch, 'graph': steps_prefetch}
+    queryset = Workflow.objects.prefetch_related(steps_prefetch)
+
+    def get_object(self, pk: int, fields: tuple = None) -> Workflow:
         """
         Get the Workflow object.
         Parameters
         ----------
         pk: integer
             Identifier of the Workflow
+        fields: tuple, optional
+            Names of the fields of WorkflowItemSerializer to load, every field when None
         Raises
         ------
         Http404
@@ -107,14 +250,26 @@ class WorkflowGetDeleteUpdate(GenericAPIView):
         dict
             Dictionary of the query result
         """
+        queryset = self.get_queryset()
+        if fields is not None:
+            columns = get_columns(Workflow, serializer_fields(WorkflowItemSerializer), fields)
+            queryset = Workflow.objects.all() if columns is None else Workflow.objects.only('id', *columns)
+            queryset = queryset.prefetch_related(
+                *{self.prefetches[name] for name in fields if name in self.prefetches})
         try:
-            return Workflow.objects.get(pk=pk)
+            return queryset.get(pk=pk)
         except Workflow.DoesNotExist:
             raise Http404
 
     def get(self, request: Request, pk: int, format=None) -> Response:
         """
-        Obtain a workflow instance.
+        Obtain a workflow instance, served from the detail cache when possible.
+        Only the latest ``WORKFLOW_DETAIL_COMMENTS`` comments are embedded, with
+        the stored count of all of them (see Workflow.latest_comments), the others
+        are listed by WorkflowCommentList.
+        ``?fields=name,steps`` renders and reads only the given fields.
+        Answers 304 Not Modified when the ETag or Last-Modified known by the
+        client is still current, without serializing anything.
         Parameters
         ----------
         request: Request
@@ -133,10 +288,16 @@ class WorkflowGetDeleteUpdate(GenericAPIView):
             Return the response with the serialized workflow
         """
 
-        workflow = self.get_object(pk)
-        if isinstance(workflow, Workflow):
-            serializer = WorkflowItemSerializer(workflow)
-            return Response(data=serializer.data, status=status.HTTP_200_OK)
+        fields = get_sparse_fields(request, serializer_fields(WorkflowItemSerializer))
+        validators = Validators.for_workflow(request, pk)
+        not_modified = validators.not_modified(request)
+        if not_modified is not None:
+            return not_modified
+
+        with phase('serializer'):
+            data = get_detail(
+                pk, lambda: WorkflowItemSerializer(self.get_object(pk, fields), fields=fields).data, fields)
+        return validators.apply(Response(data=data, status=status.HTTP_200_OK))
 
     def put(self, request: Request, pk: int, format=None) -> Response:
         """
@@ -162,15 +323,21 @@ class WorkflowGetDeleteUpdate(GenericAPIView):
         workflow = self.get_object(pk)
 
         serializer = WorkflowSerializer(workflow, data=request.data)
-        if serializer.is_valid():
-            serializer.save()
-            return Response(serializer.data, status=status.HTTP_201_CREATED)
+        with phase('serializer'):
+            if serializer.is_valid():
+                write(serializer.save)
+                # The prefetched steps are stale once the update is applied.
+                workflow._prefetched_objects_cache = {}
+                return Response(serializer.data, status=status.HTTP_201_CREATED)
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
     def delete(self, request: Request, pk: int, format=None) -> Response("", status.HTTP_204_NO_CONTENT):
         """
         Delete a workflow instance.
 
+        The workflow is flagged as deleted with a single UPDATE, which hides its steps and
+        comments as well; the rows are purged later by the purge_deleted command.
+
         Parameters
         ----------
         request : Request
@@ -188,9 +355,8 @@ class WorkflowGetDeleteUpdate(GenericAPIView):
         Response
             Return the response with the result code of the deletion
         """
-        workflow = self.get_object(pk)
-        if workflow is not None:
-            workflow.delete()
+        if write(Workflow.objects.filter(pk=pk).soft_delete):
+            invalidate_detail(pk)
             content = {
                 'status': 'NO CONTENT'
             }
@@ -198,7 +364,132 @@ class WorkflowGetDeleteUpdate(GenericAPIView):
         raise Http404
 
 
-class CommentListPost(GenericAPIView):
+class WorkflowCommentList(GenericAPIView):
+    """
+    To list the comments of a Workflow.
+
+    Methods
+    -------
+    get
+        Return the comments of a workflow, newest first.
+    Raises
+    ------
+    Http404
+        HTTP error if the Workflow doesn't exist
+    """
+    pagination_class = LatestFirstPagination
+
+    def get(self, request: Request, pk: int, format=None) -> Response:
+        """
+        List the comments of a workflow, newest first.
+
+        Pages are keyed on the comment id and read backwards from the
+        ``(workflow_id, id)`` index; follow the ``next`` links to page through.
+        ``?fields=id,name`` renders and reads only the given fields.
+        Answers 304 Not Modified when the ETag known by the client is still
+        current, without serializing anything.
+
+        Parameters
+        ----------
+        request : Request
+            HTTP GET request
+        pk : int
+            Identifier of the Workflow
+        format : str, optional
+            Format for the rendered response (the default is None)
+        Returns
+        -------
+        Response
+            Return the response with a page of serialized comments
+        """
+        fast = comment_list_values.narrow(get_sparse_fields(request, comment_list_values.fields))
+        comments = Comment.objects.filter(workflow_id=pk)
+        paginate_queryset = self.paginate_queryset(
+            fast.values(comments, self.paginator.key_fields + Validators.ROW_FIELDS))
+        # Without comments, the workflow may not exist at all.
+        if not paginate_queryset and not Workflow.objects.filter(pk=pk).exists():
+            raise Http404
+        # Deleting a workflow hides its comments.
+        validators = Validators.for_list(request, (Comment, Workflow), paginate_queryset)
+        not_modified = validators.not_modified(request)
+        if not_modified is not None:
+            return not_modified
+
+        with phase('serializer'):
+            data = fast.to_representation(paginate_queryset)
+        return validators.apply(self.get_paginated_response(data))
+
+
+class WorkflowRunListPost(GenericAPIView):
+    """
+    To list and start the runs of a Workflow.
+
+    Methods
+    -------
+    get
+        Return the runs of a workflow, newest first.
+    post
+        Start a run of a workflow.
+    Raises
+    ------
+    Http404
+        HTTP error if the Workflow doesn't exist
+    """
+    serializer_class = WorkflowRunSerializer
+    pagination_class = LatestFirstPagination
+
+    def get(self, request: Request, pk: int, format=None) -> Response:
+        """
+        List the runs of a workflow, newest first, with their progress.
+
+        Parameters
+        ----------
+        request : Request
+            HTTP GET request
+        pk : int
+            Identifier of the Workflow
+        format : str, optional
+            Format for the rendered response (the default is None)
+        Returns
+        -------
+        Response
+            Return the response with a page of serialized runs
+        """
+        if not Workflow.objects.filter(pk=pk).exists():
+            raise Http404
+        page = self.paginate_queryset(WorkflowRun.objects.filter(workflow_id=pk))
+        with phase('serializer'):
+            data = self.serializer_class(page, many=True).data
+        return self.get_paginated_response(data)
+
+    def post(self, request: Request, pk: int, format=None) -> Response:
+        """
+        Start a run of the active steps of a workflow, one after another, by the workers
+        of ``python manage.py run_workers``.
+
+        Parameters
+        ----------
+        request : Request
+            HTTP POST request, without body
+        pk : int
+            Identifier of the Workflow
+        format : str, optional
+            Format for the rendered response (the default is None)
+        Returns
+        -------
+        Response
+            Return the response with the serialized run
+        """
+        workflow = Workflow.objects.filter(pk=pk).only('id').first()
+        if workflow is None:
+            raise Http404
+        run = write(start_run, workflow)
+        with phase('serializer'):
+            data = self.serializer_class(run).data
+        return Response(data, status=status.HTTP_201_CREATED)
+
+
+class CommentListPost(SelectablePaginationMixin, GenericAPIView):
     """
     To perform List and Create actions on Comment Model.
 
@@ -212,11 +503,22 @@ class CommentListPost(GenericAPIView):
     serializer_class = CommentSerializer
     pagination_class = CustomPagination
     queryset = Comment.objects.all()
+    filter_backends = (QueryParamFilterBackend,)
+    filters = COMMENT_FILTERS
 
     def get(self, request: Request, format=None) -> Response:
         """
         List all created comments.
 
+        Pages are numbered by default; ``?pagination=cursor`` switches to keyset
+        pagination ordered by ``(created_at, id)``, see KeysetPagination.
+        ``?fields=id,name`` renders and reads only the given fields.
+        Comments are filtered with ``created_after``, ``created_before``,
+        ``modified_after``, ``modified_before``, ``archived`` and ``workflow_id``,
+        see api.utils.filters.
+        Answers 304 Not Modified when the ETag known by the client is still
+        current, without serializing anything.
+
         Parameters
         ----------
         request : Request
@@ -229,10 +531,19 @@ class CommentListPost(GenericAPIView):
             Return the response with all serialized comments
         """
 
-        comments = Comment.objects.all()
-        paginate_queryset = self.paginate_queryset(comments)
-        serializer = CommentListSerializer(paginate_queryset, many=True)
-        return self.get_paginated_response(serializer.data)
+        fast = comment_list_values.narrow(get_sparse_fields(request, comment_list_values.fields))
+        comments = self.filter_queryset(Comment.objects.all())
+        paginate_queryset = self.paginate_queryset(
+            fast.values(comments, getattr(self.paginator, 'key_fields', ()) + Validators.ROW_FIELDS))
+        # Deleting a workflow hides its comments.
+        validators = Validators.for_list(request, (Comment, Workflow), paginate_queryset)
+        not_modified = validators.not_modified(request)
+        if not_modified is not None:
+            return not_modified
+
+        with phase('serializer'):
+            data = fast.to_representation(paginate_queryset)
+        return validators.apply(self.get_paginated_response(data))
 
     def post(self, request: Request, format=None) -> Response:
         """
@@ -250,9 +561,10 @@ class CommentListPost(GenericAPIView):
             Return the response with the created serialized comment
         """
         serializer = CommentSerializer(data=request.data)
-        if serializer.is_valid():
-            serializer.save()
-            return Response(serializer.data, status=status.HTTP_201_CREATED)
+        with phase('serializer'):
+            if serializer.is_valid():
+                write(serializer.save)
+                return Response(serializer.data, status=status.HTTP_201_CREATED)
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
 
@@ -276,13 +588,15 @@ class CommentGetDeleteUpdate(GenericAPIView):
     serializer_class = CommentSerializer
     queryset = Comment.objects.all()
 
-    def get_object(self, pk: int) -> Comment:
+    def get_object(self, pk: int, fields: tuple = None) -> Comment:
         """
         Get the Comment object.
         Parameters
         ----------
         pk: integer
             Identifier of the Comment
+        fields: tuple, optional
+            Names of the fields of the serializer to load, every field when None
         Raises
         ------
         Http404
@@ -292,14 +606,22 @@ class CommentGetDeleteUpdate(GenericAPIView):
         dict
             Dictionary of the query result
         """
+        queryset = Comment.objects.all()
+        if fields is not None:
+            columns = get_columns(Comment, serializer_fields(self.serializer_class), fields)
+            if columns is not None:
+                queryset = queryset.only('id', *columns)
         try:
-            return Comment.objects.get(pk=pk)
+            return queryset.get(pk=pk)
         except Comment.DoesNotExist:
             raise Http404
 
     def get(self, request: Request, pk: int, format=None) -> Response:
         """
         Obtain a comment instance.
+        ``?fields=name,text`` renders and reads only the given fields.
+        Answers 304 Not Modified when the ETag or Last-Modified known by the
+        client is still current, without serializing anything.
         Parameters
         ----------
         request: Request
@@ -317,10 +639,17 @@ class CommentGetDeleteUpdate(GenericAPIView):
         Response
             Return the response with the serialized comment
         """
-        comment = self.get_object(pk)
+        fields = get_sparse_fields(request, serializer_fields(self.serializer_class))
+        validators = Validators.for_comment(request, pk)
+        not_modified = validators.not_modified(request)
+        if not_modified is not None:
+            return not_modified
+
+        comment = self.get_object(pk, fields)
         if isinstance(comment, Comment):
-            serializer = self.serializer_class(comment)
-            return Response(serializer.data, status=status.HTTP_200_OK)
+            with phase('serializer'):
+                data = self.serializer_class(comment, fields=fields).data
+            return validators.apply(Response(data, status=status.HTTP_200_OK))
 
     def put(self, request: Request, pk: int, format=None) -> Response:
         """
@@ -346,15 +675,18 @@ class CommentGetDeleteUpdate(GenericAPIView):
         comment = self.get_object(pk)
 
         serializer = self.serializer_class(comment, data=request.data)
-        if serializer.is_valid():
-            serializer.save()
-            return Response(serializer.data, status=status.HTTP_201_CREATED)
+        with phase('serializer'):
+            if serializer.is_valid():
+                write(serializer.save)
+                return Response(serializer.data, status=status.HTTP_201_CREATED)
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
     def delete(self, request: Request, pk: int) -> Response("", status.HTTP_204_NO_CONTENT):
         """
         Delete a comment instance.
 
+        The comment is flagged as deleted and purged later by the purge_deleted command.
+
         Parameters
         ----------
         request : Request
@@ -374,9 +706,77 @@ class CommentGetDeleteUpdate(GenericAPIView):
         """
         comment = self.get_object(pk)
         if comment is not None:
-            comment.delete()
+            write(comment.soft_delete)
             content = {
                 'status': 'NO CONTENT'
             }
             return Response(content, status=status.HTTP_204_NO_CONTENT)
         raise Http404
+
+
+class SearchList(GenericAPIView):
+    """
+    To perform a full-text search on workflows, steps and comments.
+
+    Methods
+    -------
+    get
+        Return a ranked list of the documents matching a query.
+    """
+    serializer_class = SearchResultSerializer
+    pagination_class = CustomPagination
+
+    def get(self, request: Request, format=None) -> Response:
+        """
+        Search the documents containing every term of the query.
+
+        Parameters
+        ----------
+        request : Request
+            HTTP GET request, with the query in ``q`` and optionally a ``kind``
+            among workflow, step and comment
+        format : str, optional
+            Format for the rendered response (the default is None)
+        Returns
+        -------
+        Response
+            Return the response with the serialized hits, best match first
+        """
+        query = request.query_params.get('q', '').strip()
+        kind = request.query_params.get('kind') or None
+        if not query:
+            return Response({'q': ['This parameter is required.']}, status=status.HTTP_400_BAD_REQUEST)
+        if kind is not None and kind not in KINDS:
+            return Response({'kind': ['Must be one of: %s.' % ', '.join(KINDS)]},
+                            status=status.HTTP_400_BAD_REQUEST)
+
+        paginate_queryset = self.paginate_queryset(SearchResults(query, kind))
+        with phase('serializer'):
+            data = SearchResultSerializer(paginate_queryset, many=True).data
+        return self.get_paginated_response(data)
+
+
+class Metrics(View):
+    """
+    To expose the metrics of the service to Prometheus.
+
+    Methods
+    -------
+    get
+        Return the metrics in the Prometheus text format.
+    """
+
+    def get(self, request: Request) -> HttpResponse:
+        """
+        Return the request, query, serializer and cache metrics, see api.utils.metrics.
+
+        Parameters
+        ----------
+        request : Request
+            HTTP GET request
+        Returns
+        -------
+        HttpResponse
+            Return the metrics of every worker sharing METRICS_DIRECTORY, of this one only without it
+        """
+        return HttpResponse(registry.exposition(), content_type=CONTENT_TYPE)
@@ -33,6 +33,12 @@ INSTALLED_APPS = [
 SITE_ID = 1
 
 MIDDLEWARE = [
+    # Only loaded when METRICS is True.
+    'api.utils.metrics.MetricsMiddleware',
+    # Only loaded when SERVER_TIMING is True.
+    'api.utils.timing.ServerTimingMiddleware',
+    # Only loaded with DATABASE_REPLICAS.
+    'api.utils.routers.ReplicaMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -68,11 +74,108 @@ WSGI_APPLICATION = 'workflow.wsgi.application'
 
 DATABASES = {
     'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
+        # django.db.backends.sqlite3 applying PRAGMAS to every connection.
+        'ENGINE': 'api.backends.sqlite3',
         'NAME': os.path.join(BASE_DIR, 'db.sqlite3'),
-    }
+        # A file rather than the shared in-memory database, which the search index
+        # (FTS5) can't be opened from by several connections at once.
+        'TEST': {
+            'NAME': os.path.join(BASE_DIR, 'test_db.sqlite3'),
+        },
+    },
+    # Copy of the default database, kept in sync by replication, only read when listed in
+    # DATABASE_REPLICAS.
+    'replica': {
+        'ENGINE': 'api.backends.sqlite3',
+        'NAME': os.path.join(BASE_DIR, 'db.replica.sqlite3'),
+        'TEST': {
+            'NAME': os.path.join(BASE_DIR, 'test_db.replica.sqlite3'),
+        },
+    },
+}
+
+# Reads of GET requests go to one of the DATABASE_REPLICAS, writes to the default database.
+# A client reads from the default database for DATABASE_REPLICA_STICKINESS seconds after
+# it wrote, see api.utils.routers.
+DATABASE_ROUTERS = ['api.utils.routers.ReadWriteRouter']
+DATABASE_REPLICAS = [alias for alias in os.environ.get('DATABASE_REPLICAS', '').split(',') if alias]
+DATABASE_REPLICA_STICKINESS = 5
+
+# Production profile of the SQLite database, applied with DATABASE_PROFILE=production:
+# write-ahead log, so that readers and the writer don't block each other, commits synced
+# at checkpoints only (a power loss may lose the last commits, never corrupt the file),
+# 256 MiB of memory mapped I/O, 64 MiB of page cache and a 5 s busy timeout. Write
+# transactions take the lock upfront, see api.backends.sqlite3.
+SQLITE_PRODUCTION = {
+    'PRAGMAS': {
+        'journal_mode': 'WAL',
+        'synchronous': 'NORMAL',
+        'mmap_size': 268435456,
+        'cache_size': -65536,
+        'busy_timeout': 5000,
+    },
+    'IMMEDIATE_TRANSACTIONS': True,
+}
+
+if os.environ.get('DATABASE_PROFILE') == 'production':
+    for database in DATABASES.values():
+        database.update(SQLITE_PRODUCTION)
+
+# Run the writes of the views on a single writer thread, which commits them in batches of
+# SQLITE_WRITER_BATCH at most, see api.utils.writer.
+SQLITE_WRITER_QUEUE = os.environ.get('SQLITE_WRITER_QUEUE') == '1'
+SQLITE_WRITER_BATCH = 64
+
+# Cache
+# https://docs.djangoproject.com/en/3.0/topics/cache/
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    # Serialized workflow details, see api.utils.cache. Use a shared backend such as
+    # django.core.cache.backends.filebased.FileBasedCache to share it between workers.
+    'workflow-detail': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'workflow-detail',
+        'TIMEOUT': 300,
+        'OPTIONS': {
+            'MAX_ENTRIES': 10000,
+        },
+    },
 }
 
+WORKFLOW_DETAIL_CACHE = 'workflow-detail'
+
+# Number of comments embedded in a workflow detail, the latest ones; the others are
+# read from /api/workflow/<pk>/comments/.
+WORKFLOW_DETAIL_COMMENTS = 10
+
+# Per request query count, SQL, serializer and render times in a Server-Timing header
+# and a log line, see api.utils.timing. A statement run SERVER_TIMING_REPEATED_QUERIES
+# times or more in a request is reported as an N+1 query.
+SERVER_TIMING = False
+SERVER_TIMING_REPEATED_QUERIES = 5
+
+# Request latency, queries, serializer time and cache events served at /metrics in the
+# Prometheus text format, see api.utils.metrics. Set METRICS_DIRECTORY to a directory
+# shared by the worker processes (and emptied when the server starts) to serve the
+# metrics of all of them; the metrics of a worker are written there at most every
+# METRICS_FLUSH_INTERVAL seconds. Enabled with METRICS=1 in the environment: the queries of
+# the requests are then timed by a database execute wrapper, a few microseconds per query.
+METRICS = os.environ.get('METRICS') == '1'
+METRICS_DIRECTORY = os.environ.get('METRICS_DIRECTORY')
+METRICS_FLUSH_INTERVAL = 1.0
+
+# Workflow runs, executed by ``python manage.py run_workers``, see api.utils.scheduler.
+# WORKFLOW_STEP_HANDLER is the dotted path of the function called with each StepRun to
+# run, None to only record the steps as done. A failing step is retried until claimed
+# WORKFLOW_STEP_ATTEMPTS times; a step claimed WORKFLOW_STEP_TIMEOUT seconds ago, e.g. by
+# a killed worker, is made ready for another worker, or fails once claimed that many times.
+WORKFLOW_STEP_HANDLER = None
+WORKFLOW_STEP_ATTEMPTS = 3
+WORKFLOW_STEP_TIMEOUT = 300
+
 # Password validation
 # https://docs.djangoproject.com/en/3.0/ref/settings/#auth-password-validators
 
@@ -111,6 +214,16 @@ STATIC_URL = '/static/'
 
 REST_FRAMEWORK = {
     'EXCEPTION_HANDLER': 'api.utils.utils.custom_exception_handler',
+    # orjson backed JSON, falling back to the stdlib when orjson is not installed.
+    'DEFAULT_RENDERER_CLASSES': (
+        'api.utils.renderers.FastJSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ),
+    'DEFAULT_PARSER_CLASSES': (
+        'api.utils.parsers.FastJSONParser',
+        'rest_framework.parsers.FormParser',
+        'rest_framework.parsers.MultiPartParser',
+    ),
 }
 
 SESSION_COOKIE_SECURE = True  # to avoid transmitting the session cookie over HTTP accidentally.